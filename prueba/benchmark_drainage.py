@@ -0,0 +1,531 @@
+"""
+Benchmark del sistema de predicción de drenaje
+
+Genera libros sintéticos con create_excel_example.create_sample_excel y mide
+cada etapa: carga en frío (procesar el Excel), carga en caliente (caché),
+indexado perezoso, simulación a 24/72/8760 horas, ensamble, lote de zonas,
+reproducción del historial, exportación y peticiones HTTP con el cliente de prueba de Flask.
+
+Antes de medir, cada libro pasa por una verificación: las versiones
+optimizadas deben dar lo mismo que sus referencias directas (el bucle por
+hora y el lector original del libro, la simulación completa frente a la
+simulación por bloques, etc.). Si alguna difiere, el benchmark se detiene
+con AssertionError; --sin-verificacion la omite (libros muy grandes).
+
+El resultado es JSON para comparar corridas entre commits:
+
+    python benchmark_drainage.py --zonas 5 500 --salida base.json
+    python benchmark_drainage.py --zonas 5 500 --salida nuevo.json --comparar base.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import openpyxl
+
+from create_excel_example import create_sample_excel, DATE_FORMATS
+from drainage_model import DrainageSimulationModel, DISAGGREGATION_PROFILES, RISK_LEVELS, route_storage
+import zone_cache
+
+# Intensidades comparadas entre evaluate_scenario e iter_scenario
+VERIFY_INTENSITIES = ['light', 'moderate', 'heavy', 'extreme', 'historical', 'stochastic', 'idf']
+# Diferencia admitida en valores redondeados a 2 decimales cuando la versión
+# optimizada suma en otro orden (un paso de redondeo)
+ROUNDING_TOLERANCE = 0.01 + 1e-9
+
+
+def time_stage(fn, repeat):
+    """Ejecuta fn repeat veces; retorna estadísticas de tiempo en segundos"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {
+        'repeticiones': repeat,
+        'min_s': round(min(times), 6),
+        'mediana_s': round(float(np.median(times)), 6),
+        'media_s': round(float(np.mean(times)), 6),
+        'max_s': round(max(times), 6)
+    }
+
+
+def workbook_path(workdir, num_zones, days, date_format):
+    return os.path.join(workdir, f'bench_{num_zones}z_{days}d_{date_format}.xlsx')
+
+
+def build_workbook(workdir, num_zones, days, date_format, seed):
+    """Crea (o reutiliza) el libro sintético; retorna (ruta, segundos de generación)"""
+    path = workbook_path(workdir, num_zones, days, date_format)
+    if os.path.exists(path):
+        return path, None
+    start = time.perf_counter()
+    create_sample_excel(path, num_zones, days, date_format, seed, verbose=False)
+    return path, round(time.perf_counter() - start, 6)
+
+
+def remove_cache(path):
+    cache = zone_cache.cache_path(path)
+    if os.path.exists(cache):
+        os.remove(cache)
+
+
+def check(condition, message):
+    """Falla la verificación (no usa assert, que python -O desactiva)"""
+    if not condition:
+        raise AssertionError(message)
+
+
+def reference_risk_level(excess):
+    """Nivel de riesgo con los umbrales escritos a mano, como el modelo original"""
+    if excess == 0:
+        return 'Normal'
+    elif excess < 5:
+        return 'Precaución'
+    elif excess < 15:
+        return 'Alerta'
+    elif excess < 30:
+        return 'Peligro'
+    else:
+        return 'Emergencia'
+
+
+def reference_drainage_excess(rainfall_data, drainage_capacity=10.0, area_m2=1000):
+    """Bucle hora por hora original de calculate_drainage_excess"""
+    results = []
+    accumulated_excess = 0
+    for hour, rainfall in enumerate(rainfall_data):
+        excess = max(0, rainfall - drainage_capacity)
+        accumulated_excess += excess
+        results.append({
+            'hora': hour + 1,
+            'lluvia_mm': round(rainfall, 2),
+            'capacidad_drenaje_mm': drainage_capacity,
+            'excedente_mm': round(excess, 2),
+            'excedente_acumulado_mm': round(accumulated_excess, 2),
+            'volumen_agua_litros': round((rainfall * area_m2) / 1000, 2),
+            'excedente_volumen_litros': round((excess * area_m2) / 1000, 2),
+            'estado': reference_risk_level(excess)
+        })
+    return pd.DataFrame(results)
+
+
+def reference_load_zones(path, parse_location):
+    """
+    Lector original: libro completo en memoria, encabezados buscados con
+    ws.cell y fechas convertidas fila a fila
+    """
+    zones = {}
+    wb = openpyxl.load_workbook(path, data_only=True)
+    try:
+        for sheet_name in wb.sheetnames:
+            ws = wb[sheet_name]
+            lat, lon = parse_location(ws['A1'].value)
+
+            header_row = fecha_col = lluvia_col = None
+            for r in range(1, min(10, ws.max_row) + 1):
+                found_fecha = found_lluvia = None
+                for c in range(1, min(10, ws.max_column) + 1):
+                    val = ws.cell(row=r, column=c).value
+                    if not val:
+                        continue
+                    text = str(val).strip().lower()
+                    if 'fecha' in text:
+                        found_fecha = c
+                    if 'lluv' in text:
+                        found_lluvia = c
+                if found_fecha or found_lluvia:
+                    header_row, fecha_col, lluvia_col = r, found_fecha or 1, found_lluvia or 2
+                    break
+            if not header_row:
+                header_row, fecha_col, lluvia_col = 2, 1, 2
+
+            data = []
+            for row in ws.iter_rows(min_row=header_row + 1, max_row=ws.max_row, values_only=True):
+                fecha_val = row[fecha_col - 1] if len(row) >= fecha_col else None
+                lluvia_val = row[lluvia_col - 1] if len(row) >= lluvia_col else None
+                if fecha_val is None and (lluvia_val is None or str(lluvia_val).strip() == ''):
+                    continue
+
+                fecha = None
+                if isinstance(fecha_val, datetime):
+                    fecha = fecha_val
+                elif fecha_val is not None:
+                    text = str(fecha_val).strip()
+                    for fmt in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y'):
+                        try:
+                            fecha = datetime.strptime(text, fmt)
+                            break
+                        except ValueError:
+                            continue
+                    else:
+                        try:
+                            fecha = openpyxl.utils.datetime.from_excel(float(text))
+                        except Exception:
+                            fecha = None
+
+                try:
+                    lluvia = float(lluvia_val) if lluvia_val not in (None, '') else 0.0
+                except Exception:
+                    lluvia = 0.0
+                data.append({'fecha': fecha, 'lluvia_mm': lluvia})
+
+            df = pd.DataFrame(data)
+            zones[sheet_name] = {
+                'latitude': lat,
+                'longitude': lon,
+                'historical_data': df,
+                'total_days': len(df),
+                'total_rainfall': float(df['lluvia_mm'].sum()) if len(df) else 0.0,
+                'max_rainfall': float(df['lluvia_mm'].max()) if len(df) else 0.0,
+                'avg_rainfall': float(df['lluvia_mm'].mean()) if len(df) else 0.0
+            }
+    finally:
+        wb.close()
+    return zones
+
+
+def build_serial_date_workbook(path):
+    """
+    Libro de una hoja cuyas primeras fechas son números de serie de Excel
+    menores a 1 (0 y 0.5, que se leen como hora del día y no como fecha),
+    seguidas de cuatro años de registros diarios
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'Fechas Serie'
+    ws['A1'] = 'lon="-87.2" lat="14.1"'
+    ws.append(['fecha', 'lluvia (mm)'])
+    ws.append([0, 3.5])
+    ws.append([0.5, 0.0])
+    rng = np.random.default_rng(0)
+    start = datetime(2015, 1, 1)
+    for day in range(4 * 365):
+        ws.append([start + timedelta(days=day), round(float(rng.gamma(0.5, 12) * (rng.random() < 0.4)), 1)])
+    wb.save(path)
+
+
+def reference_route_storage(inflow, storage_max, initial=0.0):
+    """Almacenamiento hora por hora: s = min(max(s + entrada, 0), máximo)"""
+    out = np.empty_like(inflow)
+    level = initial
+    for t, value in enumerate(inflow):
+        level = min(max(level + value, 0.0), storage_max)
+        out[t] = level
+    return out
+
+
+def verify_workbook(path, seed):
+    """
+    Compara las versiones optimizadas con sus referencias sobre un libro;
+    lanza AssertionError en la primera diferencia. Retorna los nombres de
+    las verificaciones superadas.
+    """
+    model = DrainageSimulationModel(path)
+    zone = next(iter(model.zone_index))
+    rng = np.random.default_rng(seed)
+    passed = []
+
+    # Motor vectorizado de excedentes frente al bucle por hora original
+    for capacity, area in ((10.0, 1000), (0.0, 250), (7.5, 5000)):
+        rainfall = rng.gamma(0.8, 9.0, 2000) * (rng.random(2000) < 0.6)
+        expected = reference_drainage_excess(rainfall, capacity, area)
+        got = model.calculate_drainage_excess(zone, rainfall, capacity, area)
+        pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_exact=True)
+    passed.append('excedentes_vs_bucle')
+
+    # Lector en una pasada con fechas vectorizadas frente al lector original
+    expected = reference_load_zones(path, model.parse_location)
+    check(list(model.zone_index) == list(expected), "Las hojas leídas no coinciden con el lector original")
+    for name, reference in expected.items():
+        zone_data = model.zones_data[name]
+        pd.testing.assert_frame_equal(zone_data['historical_data'], reference['historical_data'], check_exact=True)
+        for key, value in reference.items():
+            if key != 'historical_data':
+                check(zone_data[key] == value, f"{name}: '{key}' = {zone_data[key]!r}, lector original {value!r}")
+    passed.append('lectura_vs_lector_original')
+
+    # Números de serie menores a 1 en la columna fecha: el libro se carga (con
+    # y sin caché, y en modo perezoso) igual que con el lector original
+    serial_path = os.path.join(os.path.dirname(path), 'verificacion_fechas_serie.xlsx')
+    if not os.path.exists(serial_path):
+        build_serial_date_workbook(serial_path)
+    reference = reference_load_zones(serial_path, model.parse_location)
+    for options in ({}, {'use_cache': False}, {'lazy': True}):
+        serial_model = DrainageSimulationModel(serial_path, **options)
+        for name, expected_zone in reference.items():
+            pd.testing.assert_frame_equal(serial_model._get_zone(name)['historical_data'],
+                                          expected_zone['historical_data'], check_exact=True)
+            check(serial_model.get_idf(name) is not None, f"{name} ({options}): sin curva IDF")
+        serial_model.replay_historical()
+    passed.append('lectura_fechas_serie')
+
+    # Simulación por bloques frente a la simulación completa
+    intensities = list(VERIFY_INTENSITIES)
+    try:
+        model.get_idf(zone)
+    except ValueError:
+        # Historial demasiado corto para la curva IDF
+        intensities.remove('idf')
+    for intensity in intensities:
+        for storage_mm in (None, 20.0):
+            config = {'hours': 500, 'intensity': intensity, 'seed': seed, 'month': 7,
+                      'storage_mm': storage_mm, 'return_period': 25}
+            results, summary = model.evaluate_scenario(zone, config)
+            for chunk_hours in (1, 37, 720):
+                events = list(model.iter_scenario(zone, config, chunk_hours=chunk_hours))
+                streamed = pd.concat([frame for kind, frame in events[:-1]], ignore_index=True)
+                pd.testing.assert_frame_equal(streamed, results.reset_index(drop=True), check_exact=True)
+                check(events[-1][1] == summary,
+                      f"{intensity} (bloques de {chunk_hours} h): el resumen difiere de evaluate_scenario")
+    passed.append('bloques_vs_escenario')
+
+    # Barrido de capacidad frente a evaluate_scenario por capacidad
+    capacities = [0.0, 2.5, 10.0, 17.3, 45.0]
+    intensities = ['light', 'heavy', 'historical', 'stochastic']
+    config = {'hours': 240, 'area_m2': 3000}
+    sweep = model.evaluate_sweep(zone, capacities, intensities, config, seed=seed)
+    for row in sweep.itertuples():
+        _, summary = model.evaluate_scenario(
+            zone, {**config, 'intensity': row.intensidad, 'drainage_capacity': row.capacidad_drenaje_mm}, seed=seed)
+        sim = summary['simulacion']
+        point = f"barrido {row.intensidad} / {row.capacidad_drenaje_mm} mm/h"
+        check(row.horas_con_excedente == sim['horas_con_excedente'], f"{point}: horas con excedente")
+        check(row.max_nivel_riesgo == sim['max_nivel_riesgo'], f"{point}: nivel de riesgo")
+        # El barrido suma excedente y volumen en el mismo orden que
+        # evaluate_scenario: las cifras redondeadas deben ser idénticas
+        check(row.excedente_total_mm == sim['excedente_total_mm'], f"{point}: excedente total")
+        check(row.volumen_excedente_litros == sim['volumen_excedente_litros'], f"{point}: volumen excedente")
+        check(row.total_lluvia_mm == sim['total_lluvia_mm'], f"{point}: lluvia total")
+    passed.append('barrido_vs_escenarios')
+
+    # Ruteo por almacenamiento (suma prefija) frente al bucle por hora
+    for storage_max in (0.0, 5.0, 60.0):
+        inflow = rng.normal(-1.0, 8.0, (8, 1000))
+        initial = rng.uniform(0, storage_max, 8)
+        got = route_storage(inflow, storage_max, initial)
+        for row, start in enumerate(initial):
+            expected = reference_route_storage(inflow[row], storage_max, start)
+            check(np.allclose(got[row], expected, rtol=0, atol=1e-9),
+                  f"route_storage difiere del bucle (máximo {storage_max} mm)")
+    passed.append('almacenamiento_vs_bucle')
+
+    # Reproducción del historial frente a la expansión explícita a horas
+    for disaggregation in (None, 'uniform', 'scs_type2'):
+        profile = np.array([1.0]) if disaggregation is None else DISAGGREGATION_PROFILES[disaggregation]
+        for capacity in (0.5, 3.0, 12.0):
+            config = {'drainage_capacity': capacity, 'disaggregation': disaggregation}
+            events, table = model.replay_historical(scenario_config=config)
+            expected_events = []
+            for name in model.zone_index:
+                rain = model.zones_data[name]['historical_data']['lluvia_mm'].to_numpy(dtype=float)
+                excess = np.maximum(rain[:, None] * profile[None, :] - capacity, 0)
+                hours_over = (excess > 0).sum(axis=1)
+                for day in np.flatnonzero(hours_over):
+                    expected_events.append((name, int(hours_over[day]), excess[day].sum(), excess[day].max()))
+                zone_row = table[table['zona'] == name].iloc[0]
+                case = f"reproducción {name} ({disaggregation}, {capacity} mm/h)"
+                check(zone_row['dias_con_excedente'] == (hours_over > 0).sum(), f"{case}: días con excedente")
+                check(zone_row['horas_con_excedente'] == hours_over.sum(), f"{case}: horas con excedente")
+                check(abs(zone_row['excedente_total_mm'] - round(excess.sum(), 2)) <= ROUNDING_TOLERANCE,
+                      f"{case}: excedente total")
+                peak = excess.max() if len(rain) else 0.0
+                check(zone_row['max_nivel_riesgo'] == reference_risk_level(peak), f"{case}: nivel de riesgo")
+            check(len(events) == len(expected_events),
+                  f"reproducción ({disaggregation}, {capacity} mm/h): {len(events)} eventos, "
+                  f"expansión por hora {len(expected_events)}")
+            for event, (name, hours_over, total, peak) in zip(events.itertuples(), expected_events):
+                case = f"reproducción {name} ({disaggregation}, {capacity} mm/h)"
+                check(event.zona == name and event.horas_con_excedente == hours_over, f"{case}: eventos")
+                check(abs(event.excedente_mm - round(total, 2)) <= ROUNDING_TOLERANCE, f"{case}: excedente")
+                check(abs(event.excedente_maximo_mm - round(peak, 2)) <= ROUNDING_TOLERANCE,
+                      f"{case}: excedente máximo")
+                check(event.nivel_riesgo == reference_risk_level(peak), f"{case}: nivel de riesgo")
+    passed.append('reproduccion_vs_horas')
+
+    return passed
+
+
+def run_workbook(path, args, web):
+    """Mide todas las etapas sobre un libro"""
+    stages = {}
+    repeat = args.repeticiones
+
+    def cold_load():
+        remove_cache(path)
+        DrainageSimulationModel(path)
+
+    stages['carga_fria'] = time_stage(cold_load, repeat)
+    stages['carga_caliente'] = time_stage(lambda: DrainageSimulationModel(path), repeat)
+    stages['indexado_perezoso'] = time_stage(lambda: DrainageSimulationModel(path, lazy=True), repeat)
+
+    model = DrainageSimulationModel(path)
+    zone = next(iter(model.zone_index))
+
+    rainfall = model.simulate_rainfall(zone, hours=8760, rng=np.random.default_rng(0))
+    stages['excedentes_8760h'] = time_stage(
+        lambda: model.calculate_drainage_excess(zone, rainfall), repeat)
+
+    for hours in args.horas:
+        config = {'hours': hours, 'intensity': 'historical', 'seed': 0}
+        stages[f'simulacion_{hours}h'] = time_stage(
+            lambda: model.evaluate_scenario(zone, config), repeat)
+
+    ensemble = {'hours': 72, 'intensity': 'heavy', 'n_realizations': args.realizaciones, 'seed': 0}
+    stages[f'ensamble_{args.realizaciones}x72h'] = time_stage(
+        lambda: model.evaluate_scenario(zone, ensemble), repeat)
+
+    stages['lote_24h'] = time_stage(
+        lambda: model.evaluate_scenarios(scenario_config={'hours': 24, 'seed': 0}), repeat)
+    stages['reproduccion_historial'] = time_stage(
+        lambda: model.replay_historical(scenario_config={'disaggregation': 'scs_type2'}), repeat)
+
+    results, summary = model.evaluate_scenario(zone, {'hours': 72, 'seed': 0})
+    export_file = os.path.join(args.directorio, 'bench_export.xlsx')
+    stages['exportacion_72h'] = time_stage(
+        lambda: model.export_results(results, summary, export_file), repeat)
+    stages['exportacion_72h_csv'] = time_stage(
+        lambda: model.export_results(results, summary, export_file, fmt='csv'), repeat)
+
+    # Ida y vuelta HTTP (sin red) a través del cliente de prueba de Flask
+    web.modelo = model
+    web.simulation_cache.clear()
+    client = web.app.test_client()
+    body = {'zone': zone, 'config': {'hours': 72, 'intensity': 'heavy'}}
+
+    def request(method, url, **kwargs):
+        response = getattr(client, method)(url, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: HTTP {response.status_code}")
+        response.get_data()
+
+    stages['http_zonas'] = time_stage(lambda: request('get', '/api/zones'), repeat)
+    stages['http_simular_72h'] = time_stage(lambda: request('post', '/api/simulate', json=body), repeat)
+    stages['http_simular_72h_columnar'] = time_stage(
+        lambda: request('post', '/api/simulate?format=columnar', json=body), repeat)
+    stages['http_exportar_72h'] = time_stage(lambda: request('post', '/api/export', json=body), repeat)
+
+    return stages
+
+
+def import_web_app(data_file):
+    """Importa la aplicación web apuntando a un libro de benchmark (sin recarga en caliente)"""
+    os.environ['DATA_FILE'] = data_file
+    os.environ['DATA_RELOAD_INTERVAL'] = '0'
+    import web_drainage_app
+    return web_drainage_app
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline_file):
+    """Imprime la razón de tiempos (mediana) respecto a una corrida anterior"""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)
+    base = {(w['zonas'], w['dias'], w['formato_fecha']): w['etapas'] for w in baseline['libros']}
+
+    print(f"\nComparación con {baseline_file} (commit {baseline['meta'].get('commit')}):")
+    for book in current['libros']:
+        key = (book['zonas'], book['dias'], book['formato_fecha'])
+        if key not in base:
+            continue
+        print(f"  {key[0]} zonas, {key[1]} días, fechas '{key[2]}':")
+        for stage, stats in book['etapas'].items():
+            if stage not in base[key]:
+                continue
+            before, after = base[key][stage]['mediana_s'], stats['mediana_s']
+            ratio = after / before if before else float('nan')
+            print(f"    {stage:<32} {before * 1e3:10.2f} ms -> {after * 1e3:10.2f} ms  ({ratio:5.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del modelo de drenaje y de la aplicación web")
+    parser.add_argument('--zonas', type=int, nargs='+', default=[5, 50],
+                        help="Números de hojas de los libros a generar (5 a 5000)")
+    parser.add_argument('--dias', type=int, default=365, help="Días de historial por zona")
+    parser.add_argument('--formato-fecha', choices=sorted(DATE_FORMATS), default='texto')
+    parser.add_argument('--horas', type=int, nargs='+', default=[24, 72, 8760])
+    parser.add_argument('--realizaciones', type=int, default=1000, help="Realizaciones del ensamble")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--directorio', default=None,
+                        help="Dónde guardar los libros generados (se reutilizan entre corridas)")
+    parser.add_argument('--salida', default=None, help="Archivo JSON de resultados (por defecto, stdout)")
+    parser.add_argument('--comparar', default=None, help="JSON de una corrida anterior")
+    parser.add_argument('--sin-verificacion', action='store_true',
+                        help="No comparar con las implementaciones de referencia antes de medir")
+    args = parser.parse_args()
+
+    keep_dir = args.directorio is not None
+    args.directorio = args.directorio or tempfile.mkdtemp(prefix='bench_drenaje_')
+    os.makedirs(args.directorio, exist_ok=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar', 'directorio')}
+        },
+        'libros': []
+    }
+
+    try:
+        web = None
+        for num_zones in args.zonas:
+            path, generation = build_workbook(args.directorio, num_zones, args.dias,
+                                              args.formato_fecha, args.semilla)
+            if web is None:
+                web = import_web_app(path)
+            verified = None
+            if not args.sin_verificacion:
+                print(f"Verificando {num_zones} zonas x {args.dias} días...", file=sys.stderr)
+                verified = verify_workbook(path, args.semilla)
+            print(f"Midiendo {num_zones} zonas x {args.dias} días...", file=sys.stderr)
+            report['libros'].append({
+                'zonas': num_zones,
+                'dias': args.dias,
+                'formato_fecha': args.formato_fecha,
+                'tamano_bytes': os.path.getsize(path),
+                'generacion_s': generation,
+                'verificacion': verified,
+                'etapas': run_workbook(path, args, web)
+            })
+    finally:
+        if not keep_dir:
+            shutil.rmtree(args.directorio, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.comparar:
+        compare(report, args.comparar)
+
+
+if __name__ == '__main__':
+    main()
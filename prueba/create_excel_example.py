@@ -1,19 +1,40 @@
+import argparse
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
 import random
 from datetime import datetime, timedelta
 
-def create_sample_excel():
+# Formatos de la columna de fechas: texto dd/mm/aaaa, texto ISO o fecha nativa de Excel
+DATE_FORMATS = {
+    'texto': '%d/%m/%Y',
+    'iso': '%Y-%m-%d',
+    'excel': None
+}
+
+def create_sample_excel(filename='datos_zonas.xlsx', num_zones=None, days=None,
+                        date_format='texto', seed=None, verbose=True):
     """
     Crea un archivo Excel con el formato exacto:
     - A1: lon="..." lat="..."
     - A2: fecha | B2: Lluvia (mm)
     - A3+: Fechas y datos de lluvia
+    
+    Args:
+        filename: Archivo a crear
+        num_zones: Número de hojas (None = las 5 zonas de ejemplo; si es mayor
+                   se agregan zonas sintéticas alrededor de Tegucigalpa)
+        days: Días de historial por zona (None = entre 30 y 60 al azar)
+        date_format: 'texto' (dd/mm/aaaa), 'iso' (aaaa-mm-dd) o 'excel' (fecha nativa)
+        seed: Semilla para generar siempre el mismo archivo
+        verbose: Si True, imprime un resumen del archivo creado
     """
-    wb = openpyxl.Workbook()
+    if date_format not in DATE_FORMATS:
+        raise ValueError(f"Formato de fecha desconocido: {date_format}")
+    rng = random.Random(seed)
     
-    # Eliminar hoja por defecto
-    wb.remove(wb.active)
+    # Modo de solo escritura: memoria constante aunque el libro tenga miles de hojas
+    wb = openpyxl.Workbook(write_only=True)
     
     # Zonas de ejemplo en Honduras con coordenadas reales
     zones = [
@@ -44,66 +65,84 @@ def create_sample_excel():
         }
     ]
     
+    if num_zones is not None:
+        zones = zones[:num_zones]
+        # Zonas sintéticas adicionales dispersas alrededor de Tegucigalpa
+        for i in range(len(zones), num_zones):
+            zones.append({
+                'name': f'Zona {i + 1:05d}',
+                'lat': round(14.0 + rng.uniform(-1.0, 1.5), 6),
+                'lon': round(-87.2 + rng.uniform(-1.5, 1.5), 6)
+            })
+    
     # Generar fechas desde mayo 2024
     start_date = datetime(2024, 5, 10)
+    date_pattern = DATE_FORMATS[date_format]
+    
+    def styled(ws, value, **style):
+        cell = WriteOnlyCell(ws, value=value)
+        for name, attr in style.items():
+            setattr(cell, name, attr)
+        return cell
     
     for zone in zones:
         # Crear hoja
         ws = wb.create_sheet(title=zone['name'])
         
+        # Ajustar anchos de columna
+        ws.column_dimensions['A'].width = 15
+        ws.column_dimensions['B'].width = 12
+        
         # A1: Ubicación en formato lon="..." lat="..."
         location_text = f'lon="{zone["lon"]}" lat="{zone["lat"]}"'
-        ws['A1'] = location_text
-        ws['A1'].font = Font(bold=True, size=11)
-        
-        # A2, B2: Encabezados
-        ws['A2'] = "fecha"
-        ws['B2'] = "Lluvia (mm)"
+        ws.append([styled(ws, location_text, font=Font(bold=True, size=11))])
         
-        # Estilo para encabezados
-        for cell in ['A2', 'B2']:
-            ws[cell].font = Font(bold=True)
-            ws[cell].alignment = Alignment(horizontal="center", vertical="center")
+        # A2, B2: Encabezados (con estilo)
+        header_style = {
+            'font': Font(bold=True),
+            'alignment': Alignment(horizontal="center", vertical="center")
+        }
+        ws.append([styled(ws, "fecha", **header_style), styled(ws, "Lluvia (mm)", **header_style)])
         
         # Generar datos de lluvia (similar a tu imagen: mayoría son 0, algunos valores)
-        num_days = random.randint(30, 60)  # Entre 1-2 meses de datos
+        num_days = days if days is not None else rng.randint(30, 60)  # Entre 1-2 meses de datos
         
         for i in range(num_days):
-            row = 3 + i
             current_date = start_date + timedelta(days=i)
             
             # 80% de días sin lluvia, 20% con lluvia
-            if random.random() < 0.2:
+            if rng.random() < 0.2:
                 # Días con lluvia: valores entre 0.1 y 30 mm
-                rainfall = round(random.choice([
-                    random.uniform(0.1, 2),    # Llovizna
-                    random.uniform(2, 10),     # Lluvia moderada
-                    random.uniform(10, 30)     # Lluvia fuerte
+                rainfall = round(rng.choice([
+                    rng.uniform(0.1, 2),    # Llovizna
+                    rng.uniform(2, 10),     # Lluvia moderada
+                    rng.uniform(10, 30)     # Lluvia fuerte
                 ]), 1)
             else:
                 rainfall = 0
             
-            # Escribir fecha y lluvia
-            ws[f'A{row}'] = current_date.strftime('%d/%m/%Y')
-            ws[f'B{row}'] = rainfall
-            
-            # Formato de número para lluvia
-            ws[f'B{row}'].number_format = '0.0'
-        
-        # Ajustar anchos de columna
-        ws.column_dimensions['A'].width = 15
-        ws.column_dimensions['B'].width = 12
+            # Escribir fecha y lluvia (con formato de número para lluvia)
+            if date_pattern is None:
+                date_cell = styled(ws, current_date, number_format='DD/MM/YYYY')
+            else:
+                date_cell = current_date.strftime(date_pattern)
+            ws.append([date_cell, styled(ws, rainfall, number_format='0.0')])
     
     # Guardar archivo
-    filename = 'datos_zonas.xlsx'
     wb.save(filename)
+    if not verbose:
+        return filename
+    
     print(f"✅ Archivo '{filename}' creado exitosamente")
     print(f"📊 Se crearon {len(zones)} hojas con datos históricos de lluvia")
     print("\nEstructura de cada hoja:")
     print('  A1: lon="..." lat="..."')
     print("  A2: fecha | B2: Lluvia (mm)")
     print("  A3+: Fechas y datos diarios de lluvia")
-    print(f"\nCada zona tiene entre 30-60 días de datos históricos")
+    if days is None:
+        print(f"\nCada zona tiene entre 30-60 días de datos históricos")
+    else:
+        print(f"\nCada zona tiene {days} días de datos históricos")
     print("Formato de ejemplo:")
     print("  10/5/2024    0.3")
     print("  11/5/2024    0")
@@ -112,4 +151,12 @@ def create_sample_excel():
     return filename
 
 if __name__ == "__main__":
-    create_sample_excel()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Crea un libro Excel de ejemplo con datos de lluvia por zona")
+    parser.add_argument('--archivo', default='datos_zonas.xlsx', help="Archivo a crear")
+    parser.add_argument('--zonas', type=int, default=None, help="Número de hojas (zonas)")
+    parser.add_argument('--dias', type=int, default=None, help="Días de historial por zona")
+    parser.add_argument('--formato-fecha', choices=sorted(DATE_FORMATS), default='texto',
+                        help="Formato de la columna de fechas")
+    parser.add_argument('--semilla', type=int, default=None, help="Semilla aleatoria")
+    args = parser.parse_args()
+    create_sample_excel(args.archivo, args.zonas, args.dias, args.formato_fecha, args.semilla)
\ No newline at end of file
@@ -1,126 +1,1117 @@
 import re
 import os
+import time
+import zlib
+import threading
+from collections import OrderedDict, namedtuple
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
 import openpyxl
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+import zone_cache
+import result_export
+import metrics
+from spatial_index import ZoneGridIndex, ZoneClusterHierarchy
+
+# Niveles de riesgo y umbrales de excedente (mm) que los separan:
+# 0 -> Normal, (0, 5) -> Precaución, [5, 15) -> Alerta, [15, 30) -> Peligro, >= 30 -> Emergencia
+RISK_LEVELS = ['Normal', 'Precaución', 'Alerta', 'Peligro', 'Emergencia']
+RISK_THRESHOLDS = [5, 15, 30]
+
+# Área donde se buscan los encabezados "fecha" / "lluvia" en cada hoja
+HEADER_SEARCH_ROWS = 10
+HEADER_SEARCH_COLS = 10
+# Formatos de fecha en texto aceptados (en orden de prueba)
+DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y')
+# Números de serie de Excel (sistema 1900) que se convierten de forma vectorizada;
+# los menores (horas del día, época) se convierten fila a fila
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'ms')
+EXCEL_SERIAL_RANGE = (1, 2958466)  # 1900-01-01 .. 9999-12-31
+_SERIAL_TYPES = frozenset({int, float})
+_NONE_TYPES = frozenset({type(None)})
+
+# Parámetros por defecto de lluvia "histórica" cuando la zona no tiene días con lluvia
+DEFAULT_RAIN_STATS = {'wet_mean': 5, 'wet_std': 3, 'wet_max': 15}
+# Duración media por defecto (en pasos) de las rachas lluviosas y secas del modo 'stochastic'
+DEFAULT_SPELL_STATS = {'wet_spell_mean': 2.0, 'dry_spell_mean': 3.0}
+# Pasos generados por bloque interno del modo 'stochastic' (ver StochasticRainStream)
+STOCHASTIC_BLOCK_HOURS = 8760
+# Estaciones de Honduras por mes: lluviosa (mayo-octubre) y seca (noviembre-abril)
+SEASONS = {
+    'lluviosa': [5, 6, 7, 8, 9, 10],
+    'seca': [11, 12, 1, 2, 3, 4]
+}
+
+# Percentiles reportados por hora en el modo ensamble (Monte Carlo)
+ENSEMBLE_PERCENTILES = [10, 50, 90]
+# Límite de celdas (realizaciones x horas) para proteger la memoria del servidor
+MAX_ENSEMBLE_CELLS = 2_000_000
+
+# Horas por bloque en la simulación por bloques (iter_scenario)
+DEFAULT_STREAM_CHUNK_HOURS = 720
+
+# Límite por defecto de zonas procesadas en memoria en modo perezoso
+DEFAULT_MAX_CACHED_ZONES = 256
+
+# Por debajo de este número de zonas evaluate_scenarios no levanta procesos
+BATCH_PARALLEL_MIN_ZONES = 8
+
+# Máximo de puntos (capacidades x intensidades) de un barrido de capacidad
+MAX_SWEEP_POINTS = 100_000
+
+# Celdas (capacidades x horas con excedente) por bloque al sumar los totales
+# de un barrido
+SWEEP_BLOCK_CELLS = 1 << 16
+
+# Realizaciones por defecto del cálculo de capacidad de diseño
+DEFAULT_DESIGN_REALIZATIONS = 10_000
+# Niveles de confianza reportados junto a la capacidad de diseño
+DESIGN_CONFIDENCES = [0.5, 0.8, 0.9, 0.95, 0.99]
+
+# Curvas intensidad-duración-frecuencia (IDF): duraciones (horas) y periodos
+# de retorno (años) de las tablas precalculadas por zona
+IDF_DURATIONS = [1, 2, 3, 6, 12, 24, 48, 72]
+IDF_RETURN_PERIODS = [2, 5, 10, 25, 50, 100]
+# Años con al menos esta fracción de días registrados entran al ajuste; con
+# menos de IDF_MIN_YEARS años así la zona no tiene curva IDF
+IDF_MIN_YEARS = 3
+IDF_MIN_YEAR_COVERAGE = 0.8
+# Factores de intervalo fijo (Weiss): máximo de 1, 2 o 3 registros diarios ->
+# máximo en 24, 48 o 72 horas móviles
+IDF_FIXED_INTERVAL_FACTORS = {24: 1.13, 48: 1.04, 72: 1.02}
+# Duraciones menores a 24 horas (Dick-Peschke): P_d = P_24 * (d / 24) ** 0.25
+IDF_SUBDAILY_EXPONENT = 0.25
+# Periodo de retorno por defecto del modo 'idf' (tormenta de diseño)
+DEFAULT_RETURN_PERIOD = 10
+EULER_GAMMA = 0.5772156649015329
+
+# Lluvia acumulada (fracción del total diario) al final de cada hora de la
+# tormenta de diseño de 24 horas SCS Tipo II
+SCS_TYPE2_CUMULATIVE = [0.0, 0.011, 0.022, 0.034, 0.048, 0.063, 0.080, 0.098, 0.120, 0.147, 0.181, 0.235,
+                        0.663, 0.772, 0.820, 0.850, 0.880, 0.898, 0.916, 0.934, 0.952, 0.964, 0.976, 0.988, 1.0]
+# Perfiles para desagregar cada registro diario en horas (fracción del día por hora)
+DISAGGREGATION_PROFILES = {
+    'uniform': np.full(24, 1 / 24),
+    'scs_type2': np.diff(SCS_TYPE2_CUMULATIVE)
+}
+
+
+def fecha_datetime64(fecha):
+    """
+    Columna fecha de historical_data como datetime64[us]. Los valores que
+    no son fechas (celdas sin fecha, o números de serie de Excel menores a
+    1, que se leen como hora del día) quedan NaT
+    """
+    if fecha.dtype.kind == 'M':
+        return fecha.to_numpy(dtype='datetime64[us]')
+    dates = fecha.where(fecha.map(lambda value: isinstance(value, datetime)))
+    return pd.to_datetime(dates, errors='coerce').to_numpy(dtype='datetime64[us]')
+
+
+def risk_level_indices(excess):
+    """Índice en RISK_LEVELS para cada valor de excedente (vectorizado)"""
+    excess = np.asarray(excess)
+    levels = np.searchsorted(RISK_THRESHOLDS, excess, side='right') + 1
+    return np.where(excess > 0, levels, 0)
+
+
+def route_storage(inflow, storage_max, initial=0.0):
+    """
+    Nivel de un almacenamiento acotado tras cada paso (vectorizado sobre el
+    último eje):
+    
+        S[t] = min(max(S[t-1] + inflow[t], 0), storage_max)
+    
+    Cada paso es un recorte f(x) = clamp(x + A, L, H), y la composición de
+    dos recortes es otro recorte:
+    
+        f2(f1(x)) = clamp(x + A1 + A2, clamp(L1 + A2, L2, H2), clamp(H1 + A2, L2, H2))
+    
+    así que el prefijo de todas las composiciones se obtiene con un barrido
+    por duplicación en log2(horas) operaciones de arreglos, sin bucle por hora.
+    """
+    inflow = np.asarray(inflow, dtype=float)
+    A = inflow.copy()
+    L = np.zeros_like(A)
+    H = np.full_like(A, storage_max)
+    
+    hours = A.shape[-1]
+    shift = 1
+    while shift < hours:
+        # El paso t absorbe la composición que termina en t - shift
+        A2, L2, H2 = A[..., shift:], L[..., shift:], H[..., shift:]
+        new_A = A[..., :-shift] + A2
+        new_L = np.clip(L[..., :-shift] + A2, L2, H2)
+        new_H = np.clip(H[..., :-shift] + A2, L2, H2)
+        A[..., shift:], L[..., shift:], H[..., shift:] = new_A, new_L, new_H
+        shift *= 2
+    
+    return np.clip(np.asarray(initial, dtype=float)[..., None] + A, L, H)
+
+
+# Modelo de cada proceso del pool de evaluate_scenarios (se transfiere una
+# sola vez por proceso en el inicializador, no en cada tarea)
+_batch_model = None
+
+
+def _bisect_first(n, lo, predicate):
+    """
+    Primer índice de [lo, n) en que predicate es verdadero (n si en ninguno),
+    para varias búsquedas a la vez: lo es un arreglo y predicate recibe un
+    arreglo de índices del mismo largo. predicate debe ser monótono (falso y
+    luego verdadero) en cada búsqueda.
+    """
+    lo = np.array(lo)
+    hi = np.full_like(lo, n)
+    while np.any(lo < hi):
+        active = lo < hi
+        mid = (lo + hi) // 2
+        hit = predicate(np.minimum(mid, n - 1))
+        lo = np.where(active & ~hit, mid + 1, lo)
+        hi = np.where(active & hit, mid, hi)
+    return lo
+
+
+def _init_batch_worker(model):
+    global _batch_model
+    _batch_model = model
+    model._reset_process_state()
+
+
+def _evaluate_zone_task(args):
+    zone_name, scenario_config, include_hourly = args
+    return _batch_model._evaluate_zone_row(zone_name, scenario_config, include_hourly)
+
+
+def scenario_rng(zone_name, seed=None):
+    """
+    Generador aleatorio de una simulación
+    
+    Sin semilla se usa entropía del sistema (cada llamada es distinta). Con
+    semilla, el resultado es reproducible y depende también de la zona, de
+    modo que la misma semilla en varias zonas no produce la misma lluvia.
+    """
+    if seed is None:
+        return np.random.default_rng()
+    seed = int(seed)
+    if seed < 0:
+        raise ValueError(f"La semilla debe ser un entero no negativo: {seed}")
+    return np.random.default_rng([seed, zlib.crc32(str(zone_name).encode('utf-8'))])
+
+
+class ZoneLRU:
+    """
+    Caché LRU acotada de zonas ya procesadas (modo perezoso)
+    
+    Expone la misma interfaz de lectura que un dict (get, in, len, items)
+    y es segura para hilos. Se limita por número de zonas y, opcionalmente,
+    por memoria aproximada de sus DataFrames históricos.
+    """
+    
+    def __init__(self, max_zones=DEFAULT_MAX_CACHED_ZONES, max_bytes=None):
+        self.max_zones = max_zones
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, name, default=None):
+        with self._lock:
+            zone = self._items.get(name)
+            if zone is None:
+                return default
+            self._items.move_to_end(name)
+            return zone
+    
+    def peek(self, name, default=None):
+        """Como get, pero sin alterar el orden de uso"""
+        return self._items.get(name, default)
+    
+    def put(self, name, zone):
+        size = int(zone['historical_data'].memory_usage(index=True).sum())
+        with self._lock:
+            if name in self._items:
+                self._total_bytes -= self._sizes.pop(name)
+            self._items[name] = zone
+            self._sizes[name] = size
+            self._total_bytes += size
+            # Desalojar las menos usadas (siempre se conserva la recién agregada)
+            while len(self._items) > 1 and (
+                    len(self._items) > self.max_zones or
+                    (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+                old_name, _ = self._items.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_name)
+    
+    def pop(self, name, default=None):
+        with self._lock:
+            if name in self._sizes:
+                self._total_bytes -= self._sizes.pop(name)
+            return self._items.pop(name, default)
+    
+    def __contains__(self, name):
+        return name in self._items
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def __iter__(self):
+        return iter(list(self._items))
+    
+    def items(self):
+        with self._lock:
+            return list(self._items.items())
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class StochasticRainStream:
+    """
+    Serie de lluvia del modo 'stochastic', generada por tramos
+    
+    Alterna rachas lluviosas y secas con duraciones geométricas de las
+    medias de stats (cadena de Markov de dos estados) y asigna a cada hora
+    lluviosa una intensidad gamma. La serie se genera en bloques internos
+    de STOCHASTIC_BLOCK_HOURS pasos y entre bloques se conserva el estado
+    de la racha en curso y los pasos que le faltan, así que con el mismo
+    generador take(a) seguido de take(b) da lo mismo que take(a + b): las
+    rachas no se cortan entre tramos y el resultado no depende de cómo se
+    pida la serie.
+    """
+    
+    def __init__(self, stats, rng, block_hours=STOCHASTIC_BLOCK_HOURS):
+        self.wet_spell_mean = stats['wet_spell_mean']
+        self.dry_spell_mean = stats['dry_spell_mean']
+        self.gamma_shape = stats['gamma_shape']
+        self.gamma_scale = stats['gamma_scale']
+        self.max_rain = stats['wet_max'] * 1.5
+        self.block_hours = int(block_hours)
+        self.rng = rng
+        # El estado inicial sigue la proporción estacionaria de horas
+        # lluviosas; por la falta de memoria de la geométrica, la primera
+        # racha no necesita un tratamiento aparte
+        self._wet = bool(rng.random() < self.wet_spell_mean / (self.wet_spell_mean + self.dry_spell_mean))
+        self._left = 0  # Pasos que restan de la racha en curso (0 = empieza una nueva)
+        self._buffer = np.empty(0)
+        self._pos = 0
+    
+    def _next_block(self):
+        """Siguiente bloque de block_hours pasos, continuando la racha en curso"""
+        size = self.block_hours
+        rng = self.rng
+        # Estado de la primera racha nueva del bloque
+        start = not self._wet if self._left else self._wet
+        first_mean, second_mean = ((self.wet_spell_mean, self.dry_spell_mean) if start
+                                   else (self.dry_spell_mean, self.wet_spell_mean))
+        
+        blocks = [np.array([self._left], dtype=np.int64)] if self._left else []
+        covered = self._left
+        while covered < size:
+            # Pares de rachas suficientes para cubrir lo que falta, con margen
+            pairs = int((size - covered) / (first_mean + second_mean) * 1.1) + 16
+            block = np.empty(2 * pairs, dtype=np.int64)
+            block[0::2] = rng.geometric(1 / first_mean, pairs)
+            block[1::2] = rng.geometric(1 / second_mean, pairs)
+            blocks.append(block)
+            covered += int(block.sum())
+        
+        lengths = np.concatenate(blocks)
+        states = np.empty(len(lengths), dtype=bool)
+        offset = 1 if self._left else 0
+        states[:offset] = self._wet
+        states[offset::2] = start
+        states[offset + 1::2] = not start
+        
+        # Racha que cruza el final del bloque: lo que sobra pasa al siguiente
+        ends = np.cumsum(lengths)
+        last = int(np.searchsorted(ends, size))
+        rest = int(ends[last]) - size
+        self._wet = bool(states[last]) if rest else not states[last]
+        self._left = rest
+        
+        wet = np.repeat(states[:last + 1], lengths[:last + 1])[:size]
+        rainfall = np.zeros(size)
+        rainfall[wet] = np.clip(rng.gamma(self.gamma_shape, self.gamma_scale, int(wet.sum())),
+                                0, self.max_rain)
+        return rainfall
+    
+    def take(self, size):
+        """Los siguientes size pasos de la serie"""
+        parts = []
+        while size > 0:
+            if self._pos == len(self._buffer):
+                self._buffer = self._next_block()
+                self._pos = 0
+            part = self._buffer[self._pos:self._pos + size]
+            parts.append(part)
+            self._pos += len(part)
+            size -= len(part)
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+
+# Datos publicados del modelo: las zonas, su índice de ubicaciones y los
+# índices derivados de él. Cada carga o recarga arma uno completo y lo publica
+# con una sola asignación; quien lo toma una vez ve todo de una misma versión.
+# Solo cambian en sitio la caché LRU del modo perezoso y los riesgos
+# registrados en cluster_index, nunca qué zonas existen
+ZoneState = namedtuple('ZoneState', ['zones_data', 'zone_index', 'spatial_index', 'cluster_index',
+                                     'zone_positions', 'data_version'])
+
+
 class DrainageSimulationModel:
     """
     Modelo para simular lluvia horaria y evaluar excedentes de drenaje
     Compatible con datos históricos reales de lluvia
     """
     
-    def __init__(self, excel_file):
+    def __init__(self, excel_file, use_cache=True, lazy=False,
+                 max_cached_zones=DEFAULT_MAX_CACHED_ZONES, max_cache_bytes=None, mmap_cache=False):
+        """
+        Args:
+            excel_file: Libro Excel con una hoja por zona
+            use_cache: Si True, reutiliza/genera la caché columnar junto al
+                       archivo (ver zone_cache) para evitar re-leer el Excel
+            lazy: Si True, al iniciar solo se indexan los nombres de hoja y la
+                  ubicación (A1); cada zona se procesa la primera vez que se usa
+                  y se guarda en una caché LRU acotada (no usa la caché en disco)
+            max_cached_zones: Máximo de zonas procesadas en memoria (modo perezoso)
+            max_cache_bytes: Memoria aproximada máxima de esas zonas (modo perezoso)
+            mmap_cache: Si True, las series se mapean en memoria desde la caché
+                        en disco en lugar de copiarse (solo lectura; los
+                        procesos que cargan el mismo libro comparten las
+                        páginas). Si la caché no es válida se genera primero
+        """
         self.excel_file = excel_file
-        self.zones_data = {}
+        self.use_cache = use_cache
+        self.lazy = lazy
+        self.max_cached_zones = max_cached_zones
+        self.max_cache_bytes = max_cache_bytes
+        self.mmap_cache = mmap_cache
+        # Índice espacial y jerarquía de agrupamiento de zone_index (ver
+        # spatial_index), reconstruidos en cada carga; data_version se
+        # incrementa con cada recarga que cambia los datos
+        self._state = ZoneState({}, {}, ZoneGridIndex([], [], []), ZoneClusterHierarchy([], [], []), {}, 0)
+        self._fingerprint = None
+        self._lazy_wb = None
+        self._lazy_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
         self.load_data()
     
+    def __getstate__(self):
+        # El libro abierto y los candados no se transfieren a otros procesos
+        state = self.__dict__.copy()
+        state['_lazy_wb'] = None
+        del state['_lazy_lock']
+        del state['_reload_lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lazy_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+    
+    def _reset_process_state(self):
+        """
+        Descarta recursos heredados del proceso padre (con fork el libro abierto
+        compartiría la posición del archivo con el padre)
+        """
+        self._lazy_wb = None
+        self._lazy_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+    
+    @property
+    def state(self):
+        """
+        ZoneState publicado; quien necesita más de una de sus partes lo toma
+        una vez y trabaja con esa copia aunque haya una recarga en medio
+        """
+        return self._state
+    
+    @property
+    def zones_data(self):
+        return self._state.zones_data
+    
+    @property
+    def zone_index(self):
+        return self._state.zone_index
+    
+    @property
+    def spatial_index(self):
+        return self._state.spatial_index
+    
+    @property
+    def cluster_index(self):
+        return self._state.cluster_index
+    
+    @property
+    def data_version(self):
+        return self._state.data_version
+    
     def load_data(self):
-        """Carga datos de todas las hojas del archivo Excel"""
+        """Carga datos de todas las hojas del archivo Excel (o de su caché si es válida)"""
+        start = time.perf_counter()
+        with metrics.stage('load'):
+            zones_data, zone_index = self._load_data()
+            self._state = self._build_state(zones_data, zone_index, self._state.data_version)
+        # Duración de la última carga completa (se expone en /metrics)
+        self.load_seconds = time.perf_counter() - start
+    
+    def _load_data(self):
+        """Retorna (zones_data, zone_index) del libro o de su caché"""
         if not os.path.isfile(self.excel_file):
             raise FileNotFoundError(f"Archivo no encontrado: {self.excel_file}")
 
-        wb = openpyxl.load_workbook(self.excel_file, data_only=True)
-
-        for sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-
-            # Leer ubicación de A1 (formato: lon="..." lat="...")
-            location_text = ws['A1'].value
-            lat, lon = self.parse_location(location_text)
-
-            # Buscar encabezados "fecha" y "lluvia" en las primeras filas y columnas
-            header_row = None
-            fecha_col = None
-            lluvia_col = None
-
-            max_search_rows = min(10, ws.max_row)
-            max_search_cols = min(10, ws.max_column)
-
-            for r in range(1, max_search_rows + 1):
-                found_fecha = None
-                found_lluvia = None
-                for c in range(1, max_search_cols + 1):
-                    val = ws.cell(row=r, column=c).value
-                    if not val:
-                        continue
-                    s = str(val).strip().lower()
-                    if 'fecha' in s:
-                        found_fecha = c
-                    if 'lluv' in s:  # detecta 'lluvia', 'lluvia (mm)', etc.
-                        found_lluvia = c
-                if found_fecha or found_lluvia:
-                    header_row = r
-                    fecha_col = found_fecha or 1
-                    lluvia_col = found_lluvia or 2
-                    break
+        # Huella por hoja tomada antes de leer: si el archivo cambia durante la
+        # carga, la siguiente recarga detectará la diferencia
+        self._fingerprint = zone_cache.workbook_fingerprint(self.excel_file)
 
-            # Si no se encontraron encabezados, usar valores por defecto (A2/B2)
-            if not header_row:
-                header_row = 2
-                fecha_col = fecha_col or 1
-                lluvia_col = lluvia_col or 2
-
-            # Leer datos desde la fila siguiente a los encabezados
-            data = []
-            for row in ws.iter_rows(min_row=header_row + 1, max_row=ws.max_row, values_only=True):
-                # Protección por si las columnas no existen en la fila actual
-                fecha_val = row[fecha_col - 1] if fecha_col and len(row) >= fecha_col else None
-                lluvia_val = row[lluvia_col - 1] if lluvia_col and len(row) >= lluvia_col else None
-
-                # Ignorar filas vacías
-                if fecha_val is None and (lluvia_val is None or str(lluvia_val).strip() == ''):
-                    continue
+        if self.lazy:
+            return ZoneLRU(self.max_cached_zones, self.max_cache_bytes), self._index_workbook()
+
+        if self.use_cache:
+            cached = zone_cache.load_zones(self.excel_file, mmap=self.mmap_cache)
+            if cached is not None:
+                return cached, self._build_index(cached)
+
+        zones_data = self._parse_workbook()
+        zone_index = self._build_index(zones_data)
 
-                # Parsear fecha (varios formatos posibles)
-                fecha = None
-                if isinstance(fecha_val, datetime):
-                    fecha = fecha_val
-                else:
-                    if fecha_val is not None:
-                        s = str(fecha_val).strip()
-                        parsed = False
-                        for fmt in ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y'):
-                            try:
-                                fecha = datetime.strptime(s, fmt)
-                                parsed = True
-                                break
-                            except Exception:
-                                continue
-                        if not parsed:
-                            # intentar convertir número de Excel a fecha
-                            try:
-                                fecha = openpyxl.utils.datetime.from_excel(float(s))
-                            except Exception:
-                                fecha = None
-
-                # Parsear lluvia a float (si falla -> 0.0)
+        if self.use_cache:
+            try:
+                zone_cache.save_zones(self.excel_file, zones_data)
+            except (OSError, ValueError):
+                # Directorio de solo lectura o fechas que la caché no puede
+                # guardar (ver zone_cache.save_zones): se trabaja sin caché
+                return zones_data, zone_index
+            if self.mmap_cache:
+                # Se cambian las copias recién procesadas por el mapeo del archivo
+                zones_data = zone_cache.load_zones(self.excel_file, mmap=True) or zones_data
+        return zones_data, zone_index
+    
+    @metrics.timed('reload')
+    def reload_data(self):
+        """
+        Recarga incremental del libro: solo se re-procesan las hojas nuevas o
+        cuyo contenido cambió (según zone_cache.workbook_fingerprint); las
+        demás zonas se reutilizan tal cual.
+        
+        Las tablas nuevas se construyen aparte, sin bloquear las consultas, y
+        se publican juntas reemplazando una sola referencia (ZoneState): nunca
+        se modifican en sitio, así las peticiones en curso siguen trabajando
+        con el estado anterior completo.
+        
+        Retorna {'agregadas': [...], 'modificadas': [...], 'eliminadas': [...]}
+        """
+        with self._reload_lock:
+            previous = self._fingerprint
+            fingerprint = zone_cache.workbook_fingerprint(self.excel_file, previous)
+            state = self._state
+            old_index = state.zone_index
+            old_sheets = previous['sheets'] if previous else {}
+            names = list(fingerprint['sheets'])
+            
+            changed = [
+                name for name in names
+                if not (fingerprint['reusable'] and name in old_index and
+                        old_sheets.get(name) == fingerprint['sheets'][name])
+            ]
+            removed = [name for name in old_index if name not in fingerprint['sheets']]
+            report = {
+                'agregadas': [name for name in changed if name not in old_index],
+                'modificadas': [name for name in changed if name in old_index],
+                'eliminadas': removed
+            }
+            
+            if not changed and not removed and names == list(old_index):
+                self._fingerprint = fingerprint
+                return report
+            
+            if self.lazy:
+                new_locations = self._index_workbook(changed)
+                zone_index = {name: new_locations.get(name) or old_index[name] for name in names}
+                new_state = self._build_state(None, zone_index, state.data_version + 1)
+                # La caché de zonas se copia con el candado tomado para no
+                # perder las que se estén procesando; una zona recién agregada
+                # se cargará del libro nuevo y una eliminada dejará de existir
+                with self._lazy_lock:
+                    zones = ZoneLRU(self.max_cached_zones, self.max_cache_bytes)
+                    for name, zone in state.zones_data.items():
+                        if name in zone_index and name not in changed:
+                            zones.put(name, zone)
+                    self._close_lazy_workbook()
+                    self._state = new_state._replace(zones_data=zones)
+            else:
+                parsed = self._parse_workbook(changed)
+                zones = {name: parsed[name] if name in parsed else state.zones_data[name] for name in names}
+                
+                if self.use_cache:
+                    try:
+                        zone_cache.save_zones(self.excel_file, zones)
+                        if self.mmap_cache:
+                            zones = zone_cache.load_zones(self.excel_file, mmap=True) or zones
+                    except (OSError, ValueError):
+                        pass
+                self._state = self._build_state(zones, self._build_index(zones), state.data_version + 1)
+            
+            self._fingerprint = fingerprint
+            return report
+    
+    def _parse_workbook(self, sheet_names=None):
+        """
+        Lee las hojas del libro Excel (todas, o solo sheet_names) y retorna
+        el diccionario de zonas
+        
+        Usa el modo de solo lectura de openpyxl: cada hoja se recorre en una
+        sola pasada sin mantener el árbol completo del libro en memoria
+        """
+        zones_data = {}
+        wb = openpyxl.load_workbook(self.excel_file, read_only=True, data_only=True)
+        try:
+            for sheet_name in (wb.sheetnames if sheet_names is None else sheet_names):
+                zones_data[sheet_name] = self._parse_sheet(wb[sheet_name])
+        finally:
+            wb.close()
+        return zones_data
+    
+    def _index_workbook(self, sheet_names=None):
+        """Índice {zona: ubicación} leyendo solo la primera fila de cada hoja (o de sheet_names)"""
+        index = {}
+        wb = openpyxl.load_workbook(self.excel_file, read_only=True, data_only=True)
+        try:
+            for sheet_name in (wb.sheetnames if sheet_names is None else sheet_names):
+                first_row = next(wb[sheet_name].iter_rows(max_row=1, values_only=True), ())
+                lat, lon = self.parse_location(first_row[0] if first_row else None)
+                index[sheet_name] = {'latitude': lat, 'longitude': lon}
+        finally:
+            wb.close()
+        return index
+    
+    @staticmethod
+    def _build_index(zones_data):
+        return {name: {'latitude': zone['latitude'], 'longitude': zone['longitude']}
+                for name, zone in zones_data.items()}
+    
+    def _build_state(self, zones_data, zone_index, data_version):
+        """ZoneState completo (con los índices espaciales) listo para publicar"""
+        return ZoneState(
+            zones_data,
+            zone_index,
+            ZoneGridIndex.from_zone_index(zone_index),
+            # Se conservan los riesgos ya registrados de las zonas que siguen existiendo
+            ZoneClusterHierarchy.from_zone_index(zone_index, self._state.cluster_index),
+            {name: i for i, name in enumerate(zone_index)},
+            data_version
+        )
+    
+    def _get_zone(self, zone_name, state=None):
+        """
+        Retorna los datos de una zona, procesándola si aún no está en memoria
+        (modo perezoso). Lanza ValueError si la zona no existe.
+        
+        Con state, la zona se busca en ese ZoneState en lugar del publicado
+        """
+        state = state or self._state
+        zone = state.zones_data.get(zone_name)
+        if zone is not None:
+            return zone
+        if not self.lazy or zone_name not in state.zone_index:
+            raise ValueError(f"Zona '{zone_name}' no encontrada")
+        
+        # El libro se mantiene abierto en modo solo lectura entre cargas;
+        # openpyxl no es seguro para hilos, así que se serializa el acceso
+        with self._lazy_lock:
+            zone = state.zones_data.peek(zone_name)
+            if zone is None:
                 try:
-                    lluvia = float(lluvia_val) if lluvia_val not in (None, '') else 0.0
+                    zone = self._parse_sheet(self._open_lazy_workbook()[zone_name])
                 except Exception:
-                    lluvia = 0.0
-
-                data.append({'fecha': fecha, 'lluvia_mm': lluvia})
-
-            # Crear DataFrame y estadísticas básicas
-            df = pd.DataFrame(data)
-            total_days = len(df)
-            total_rainfall = float(df['lluvia_mm'].sum()) if total_days > 0 else 0.0
-            max_rainfall = float(df['lluvia_mm'].max()) if total_days > 0 else 0.0
-            avg_rainfall = float(df['lluvia_mm'].mean()) if total_days > 0 else 0.0
-
-            self.zones_data[sheet_name] = {
-                'latitude': lat,
-                'longitude': lon,
-                'historical_data': df,
-                'total_days': total_days,
-                'total_rainfall': total_rainfall,
-                'max_rainfall': max_rainfall,
-                'avg_rainfall': avg_rainfall
-            }
-
-        wb.close()
+                    # Si el archivo se sobrescribió en sitio, el libro abierto
+                    # quedó inválido: se reabre una vez antes de fallar
+                    self._close_lazy_workbook()
+                    zone = self._parse_sheet(self._open_lazy_workbook()[zone_name])
+                state.zones_data.put(zone_name, zone)
+        return zone
+    
+    def _open_lazy_workbook(self):
+        if self._lazy_wb is None:
+            self._lazy_wb = openpyxl.load_workbook(self.excel_file, read_only=True, data_only=True)
+        return self._lazy_wb
+    
+    def _close_lazy_workbook(self):
+        if self._lazy_wb is not None:
+            self._lazy_wb.close()
+            self._lazy_wb = None
+    
+    @metrics.timed('parse_sheet')
+    def _parse_sheet(self, ws):
+        """Procesa una hoja (zona) en una sola pasada sobre sus filas"""
+        # max_row proviene de la etiqueta de dimensiones del archivo: solo se usa
+        # como estimación para preasignar arreglos, ya que puede estar desactualizada
+        size_hint = ws.max_row or 0
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        
+        # Primeras filas: ubicación (A1) y búsqueda de encabezados
+        head = list(islice(rows, HEADER_SEARCH_ROWS))
+        
+        # Leer ubicación de A1 (formato: lon="..." lat="...")
+        location_text = head[0][0] if head and head[0] else None
+        lat, lon = self.parse_location(location_text)
+        
+        # Buscar encabezados "fecha" y "lluvia" en las primeras filas y columnas
+        header_row = None
+        fecha_col = None
+        lluvia_col = None
+        
+        for r, row in enumerate(head, start=1):
+            found_fecha = None
+            found_lluvia = None
+            for c, val in enumerate(row[:HEADER_SEARCH_COLS], start=1):
+                if not val:
+                    continue
+                s = str(val).strip().lower()
+                if 'fecha' in s:
+                    found_fecha = c
+                if 'lluv' in s:  # detecta 'lluvia', 'lluvia (mm)', etc.
+                    found_lluvia = c
+            if found_fecha or found_lluvia:
+                header_row = r
+                fecha_col = found_fecha or 1
+                lluvia_col = found_lluvia or 2
+                break
+        
+        # Si no se encontraron encabezados, usar valores por defecto (A2/B2)
+        if not header_row:
+            header_row = 2
+            fecha_col = 1
+            lluvia_col = 2
+        
+        # Arreglos preasignados; crecen al doble si la estimación se queda corta
+        capacity = max(size_hint - header_row, 16)
+        fechas = np.empty(capacity, dtype=object)
+        lluvias = np.empty(capacity, dtype=float)
+        n = 0
+        
+        # Leer datos desde la fila siguiente a los encabezados
+        for row in chain(head[header_row:], rows):
+            # Protección por si las columnas no existen en la fila actual
+            fecha_val = row[fecha_col - 1] if len(row) >= fecha_col else None
+            lluvia_val = row[lluvia_col - 1] if len(row) >= lluvia_col else None
+            
+            # Ignorar filas vacías
+            if fecha_val is None and (lluvia_val is None or str(lluvia_val).strip() == ''):
+                continue
+            
+            if n == capacity:
+                capacity *= 2
+                fechas = np.resize(fechas, capacity)
+                lluvias = np.resize(lluvias, capacity)
+            
+            fechas[n] = fecha_val
+            
+            # Parsear lluvia a float (si falla -> 0.0)
+            try:
+                lluvias[n] = float(lluvia_val) if lluvia_val not in (None, '') else 0.0
+            except Exception:
+                lluvias[n] = 0.0
+            n += 1
+        
+        # Crear DataFrame y estadísticas básicas
+        if n > 0:
+            df = pd.DataFrame({'fecha': self._parse_dates(fechas[:n]), 'lluvia_mm': lluvias[:n]})
+        else:
+            df = pd.DataFrame()
+        total_days = len(df)
+        total_rainfall = float(df['lluvia_mm'].sum()) if total_days > 0 else 0.0
+        max_rainfall = float(df['lluvia_mm'].max()) if total_days > 0 else 0.0
+        avg_rainfall = float(df['lluvia_mm'].mean()) if total_days > 0 else 0.0
+        
+        return {
+            'latitude': lat,
+            'longitude': lon,
+            'historical_data': df,
+            'total_days': total_days,
+            'total_rainfall': total_rainfall,
+            'max_rainfall': max_rainfall,
+            'avg_rainfall': avg_rainfall,
+            'rain_stats': self._compute_rain_stats(df),
+            'idf': self._compute_idf(df)
+        }
+    
+    @classmethod
+    def _compute_rain_stats(cls, df):
+        """
+        Índice de estadísticas de días con lluvia de una zona, calculado una
+        sola vez al cargar: momentos, parámetros gamma ajustados y desgloses
+        mensual ('1'..'12') y estacional (ver SEASONS)
+        """
+        if len(df) == 0:
+            rain = np.array([], dtype=float)
+            months = np.array([], dtype=float)
+        else:
+            rain = df['lluvia_mm'].to_numpy(dtype=float)
+            # Los registros sin fecha (NaT) no entran a los desgloses mensuales
+            months = pd.Series(fecha_datetime64(df['fecha'])).dt.month.to_numpy(dtype=float)
+        
+        # Rachas lluviosas/secas de la serie completa; en los desgloses cada
+        # racha cuenta para el mes en que empieza
+        starts, lengths, wet = cls._spells(rain > 0)
+        spell_months = months[starts]
+        
+        stats = cls._wet_day_stats(rain)
+        stats.update(cls._spell_stats(lengths, wet))
+        stats['monthly'] = {}
+        for month in range(1, 13):
+            in_month = spell_months == month
+            stats['monthly'][str(month)] = cls._wet_day_stats(rain[months == month])
+            stats['monthly'][str(month)].update(cls._spell_stats(lengths[in_month], wet[in_month]))
+        stats['seasonal'] = {}
+        for season, season_months in SEASONS.items():
+            in_season = np.isin(spell_months, season_months)
+            stats['seasonal'][season] = cls._wet_day_stats(rain[np.isin(months, season_months)])
+            stats['seasonal'][season].update(cls._spell_stats(lengths[in_season], wet[in_season]))
+        return stats
+    
+    @classmethod
+    def _compute_idf(cls, df):
+        """
+        Curva IDF de una zona, calculada una sola vez al cargar
+        
+        Ajusta una distribución de Gumbel (L-momentos) a los máximos anuales
+        de 1, 2 y 3 registros diarios consecutivos, llevados a 24, 48 y 72
+        horas móviles con IDF_FIXED_INTERVAL_FACTORS; las duraciones menores
+        a 24 horas se derivan de la de 24 (IDF_SUBDAILY_EXPONENT). Solo
+        cuentan los años con IDF_MIN_YEAR_COVERAGE de días registrados.
+        
+        Retorna None si no hay IDF_MIN_YEARS años así; si no, un diccionario
+        con los parámetros ajustados ('gumbel') y las tablas de profundidad
+        (mm) e intensidad (mm/h) por duración (filas) y periodo de retorno
+        (columnas)
+        """
+        if len(df) == 0:
+            return None
+        dates = fecha_datetime64(df['fecha']).astype('datetime64[D]')
+        rain = df['lluvia_mm'].to_numpy(dtype=float)
+        known = ~np.isnat(dates)
+        dates, rain = dates[known], rain[known]
+        
+        years = dates.astype('datetime64[Y]').astype(np.int64)
+        year_values, year_ids, year_counts = np.unique(years, return_inverse=True, return_counts=True)
+        complete = year_counts >= IDF_MIN_YEAR_COVERAGE * 365
+        if complete.sum() < IDF_MIN_YEARS:
+            return None
+        
+        gumbel = {}
+        for days, duration in enumerate((24, 48, 72), start=1):
+            # Suma de 'days' registros consecutivos, asignada al año del último
+            totals = np.convolve(rain, np.ones(days), mode='valid')
+            annual = np.full(len(year_values), -np.inf)
+            np.maximum.at(annual, year_ids[days - 1:], totals)
+            mu, beta = cls._gumbel_lmoments(annual[complete])
+            factor = IDF_FIXED_INTERVAL_FACTORS[duration]
+            gumbel[str(duration)] = {'mu': round(mu * factor, 4), 'beta': round(beta * factor, 4)}
+        
+        idf = {
+            'anios': int(complete.sum()),
+            'periodo': [int(year_values[complete].min()) + 1970, int(year_values[complete].max()) + 1970],
+            'duraciones_h': IDF_DURATIONS,
+            'periodos_retorno': IDF_RETURN_PERIODS,
+            'gumbel': gumbel
+        }
+        depths = np.array([cls.idf_depths(idf, T) for T in IDF_RETURN_PERIODS]).T
+        idf['profundidad_mm'] = np.round(depths, 2).tolist()
+        idf['intensidad_mm_h'] = np.round(depths / np.array(IDF_DURATIONS)[:, None], 2).tolist()
+        return idf
+    
+    @staticmethod
+    def _gumbel_lmoments(sample):
+        """Parámetros (mu, beta) de Gumbel por L-momentos"""
+        x = np.sort(sample)
+        n = len(x)
+        b0 = x.mean()
+        b1 = (np.arange(n) * x).sum() / (n * (n - 1))
+        beta = max(2 * b1 - b0, 0.0) / np.log(2)
+        return float(b0 - EULER_GAMMA * beta), float(beta)
+    
+    @staticmethod
+    def idf_depths(idf, return_period):
+        """
+        Profundidad (mm) para cada duración de IDF_DURATIONS con el periodo de
+        retorno indicado (años), a partir de los parámetros precalculados
+        """
+        return_period = float(return_period)
+        if not return_period > 1:
+            raise ValueError("El periodo de retorno debe ser mayor que 1 año")
+        # Variable reducida de Gumbel
+        y = -np.log(-np.log(1 - 1 / return_period))
+        fitted = {int(d): p['mu'] + p['beta'] * y for d, p in idf['gumbel'].items()}
+        depths = np.array([
+            fitted[d] if d in fitted else fitted[24] * (d / 24) ** IDF_SUBDAILY_EXPONENT
+            for d in IDF_DURATIONS
+        ])
+        # Una duración mayor nunca acumula menos lluvia
+        return np.maximum.accumulate(np.maximum(depths, 0))
+    
+    def get_idf(self, zone_name):
+        """Curva IDF precalculada de una zona (ver _compute_idf)"""
+        idf = self._get_zone(zone_name).get('idf')
+        if idf is None:
+            raise ValueError(
+                f"La zona '{zone_name}' no tiene registros suficientes para la curva IDF "
+                f"(mínimo {IDF_MIN_YEARS} años con {IDF_MIN_YEAR_COVERAGE:.0%} de días registrados)"
+            )
+        return idf
+    
+    def design_storm(self, zone_name, hours=24, return_period=DEFAULT_RETURN_PERIOD):
+        """
+        Hietograma horario de la tormenta de diseño (bloques alternos)
+        
+        La tormenta dura min(hours, max(IDF_DURATIONS)) horas: la profundidad
+        de cada duración de 1 a esa cantidad de horas se interpola (log-log)
+        de la curva IDF, y los incrementos horarios se ordenan de mayor a
+        menor alternando a cada lado del centro de la tormenta
+        """
+        depths = self.idf_depths(self.get_idf(zone_name), return_period)
+        storm_hours = min(int(hours), IDF_DURATIONS[-1])
+        durations = np.arange(1, storm_hours + 1)
+        cumulative = np.exp(np.interp(np.log(durations), np.log(IDF_DURATIONS), np.log(np.maximum(depths, 1e-9))))
+        # Duraciones sin lluvia en la curva (profundidad nula): sin tormenta
+        cumulative[np.interp(durations, IDF_DURATIONS, depths) <= 0] = 0
+        blocks = np.sort(np.diff(np.concatenate([[0.0], cumulative])))[::-1]
+        
+        k = np.arange(storm_hours)
+        positions = (storm_hours - 1) // 2 + np.where(k % 2 == 1, 1, -1) * ((k + 1) // 2)
+        storm = np.zeros(storm_hours)
+        storm[positions] = blocks
+        return storm
+    
+    def simulate_rainfall_idf(self, zone_name, hours=24, return_period=DEFAULT_RETURN_PERIOD, n_realizations=None):
+        """
+        Lluvia horaria de la tormenta de diseño del periodo de retorno
+        indicado (ver design_storm) seguida de horas secas hasta completar
+        hours; es determinista, así que en modo ensamble todas las filas son
+        iguales
+        """
+        rainfall = np.zeros(hours)
+        storm = self.design_storm(zone_name, hours, return_period)
+        rainfall[:len(storm)] = storm
+        return rainfall if n_realizations is None else np.tile(rainfall, (n_realizations, 1))
+    
+    @staticmethod
+    def _spells(wet):
+        """Inicio, duración y estado (True = lluviosa) de cada racha de la serie wet"""
+        if len(wet) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=bool)
+        starts = np.flatnonzero(np.r_[True, wet[1:] != wet[:-1]])
+        lengths = np.diff(np.append(starts, len(wet)))
+        return starts, lengths, wet[starts]
+    
+    @staticmethod
+    def _spell_stats(lengths, wet):
+        """
+        Persistencia lluvia/sequía: duración media y máxima de las rachas y
+        probabilidades de transición de la cadena de Markov equivalente
+        (duraciones geométricas)
+        """
+        wet_spells, dry_spells = lengths[wet], lengths[~wet]
+        stats = {
+            'wet_spell_mean': float(wet_spells.mean()) if len(wet_spells) else DEFAULT_SPELL_STATS['wet_spell_mean'],
+            'wet_spell_max': int(wet_spells.max()) if len(wet_spells) else 0,
+            'dry_spell_mean': float(dry_spells.mean()) if len(dry_spells) else DEFAULT_SPELL_STATS['dry_spell_mean'],
+            'dry_spell_max': int(dry_spells.max()) if len(dry_spells) else 0
+        }
+        stats['p_wet_after_wet'] = 1 - 1 / stats['wet_spell_mean']
+        stats['p_wet_after_dry'] = 1 / stats['dry_spell_mean']
+        return stats
+    
+    @staticmethod
+    def _wet_day_stats(rain):
+        """Momentos de los días con lluvia y parámetros gamma (método de momentos)"""
+        wet = rain[rain > 0]  # Solo días con lluvia
+        stats = {
+            'days': int(len(rain)),
+            'wet_days': int(len(wet)),
+            'wet_fraction': float(len(wet) / len(rain)) if len(rain) > 0 else 0.0
+        }
+        if len(wet) > 0:
+            stats.update(wet_mean=float(wet.mean()), wet_std=float(wet.std()), wet_max=float(wet.max()))
+        else:
+            stats.update(DEFAULT_RAIN_STATS)
+        
+        if stats['wet_std'] > 0:
+            stats['gamma_shape'] = (stats['wet_mean'] / stats['wet_std']) ** 2
+            stats['gamma_scale'] = stats['wet_std'] ** 2 / stats['wet_mean']
+        else:
+            stats['gamma_shape'] = 2
+            stats['gamma_scale'] = stats['wet_mean'] / 2
+        return stats
+    
+    def get_rain_stats(self, zone_name, month=None):
+        """
+        Estadísticas precalculadas de lluvia de una zona
+        
+        Args:
+            month: Mes (1-12) para obtener el desglose mensual; si ese mes no
+                   tiene días con lluvia registrados se usan las globales
+        """
+        stats = self._get_zone(zone_name)['rain_stats']
+        if month is not None:
+            month = int(month)
+            if not 1 <= month <= 12:
+                raise ValueError(f"Mes inválido: {month}")
+            monthly = stats['monthly'][str(month)]
+            if monthly['wet_days'] > 0:
+                return monthly
+        return stats
+    
+    @classmethod
+    def _parse_dates(cls, values):
+        """
+        Convierte la columna fecha completa de una hoja; equivale a aplicar
+        _parse_date a cada valor (retorna un arreglo de datetime / None)
+        
+        Los textos se convierten en bloque con el primer formato de
+        DATE_FORMATS que acepte el primer texto de la hoja y los números de
+        serie de Excel con aritmética de fechas de NumPy. Solo las celdas
+        que no encajan se procesan fila a fila con _parse_date.
+        """
+        n = len(values)
+        result = np.empty(n, dtype=object)
+        pending = np.ones(n, dtype=bool)
+        
+        # Clasificación con map (sin bucle de Python por celda). Solo int/float
+        # exactos se tratan como número de serie: bool, tipos NumPy, etc. siguen
+        # el camino de texto y, si no encajan, el de _parse_date
+        is_datetime = np.fromiter(map(datetime.__instancecheck__, values), dtype=bool, count=n)
+        is_missing = np.fromiter(map(_NONE_TYPES.__contains__, map(type, values)), dtype=bool, count=n)
+        is_number = np.fromiter(map(_SERIAL_TYPES.__contains__, map(type, values)), dtype=bool, count=n)
+        result[is_datetime] = values[is_datetime]
+        pending &= ~(is_datetime | is_missing)
+        
+        # Números de serie de Excel (mismo cálculo que openpyxl.utils.datetime.from_excel)
+        idx = np.flatnonzero(is_number)
+        if len(idx):
+            serial = values[idx].astype(float)
+            ok = (serial >= EXCEL_SERIAL_RANGE[0]) & (serial < EXCEL_SERIAL_RANGE[1])
+            serial = serial[ok]
+            day = np.floor(serial)
+            millis = np.round((serial - day) * 86400 * 1000)
+            day += serial < 60  # Excel considera 1900 bisiesto
+            dates = EXCEL_EPOCH + day.astype('timedelta64[D]') + millis.astype('timedelta64[ms]')
+            result[idx[ok]] = dates.astype('datetime64[us]').astype(object)
+            pending[idx[ok]] = False
+        
+        # Textos: formato detectado una vez por hoja
+        idx = np.flatnonzero(pending & ~is_number)
+        if len(idx):
+            texts = np.array(list(map(str.strip, map(str, values[idx]))), dtype=object)
+            fmt = cls._detect_date_format(texts)
+            if fmt is not None:
+                dates = cls._parse_fixed_width_dates(texts, fmt)
+                rest = np.isnat(dates)
+                if rest.any():
+                    # Campos sin ceros a la izquierda y otras variantes del formato
+                    dates[rest] = pd.to_datetime(pd.Series(texts[rest]), format=fmt, errors='coerce').to_numpy()
+                ok = ~np.isnat(dates)
+                result[idx[ok]] = dates[ok].astype(object)
+                pending[idx[ok]] = False
+        
+        # Resto (otros formatos, horas del día, números de serie en texto, ...)
+        for i in np.flatnonzero(pending):
+            result[i] = cls._parse_date(values[i])
+        
+        return result
+    
+    @staticmethod
+    def _parse_fixed_width_dates(texts, fmt):
+        """
+        Convierte textos con el formato fmt escritos con ancho fijo (ceros a la
+        izquierda, p.ej. '05/01/2024') operando sobre los códigos de carácter.
+        Retorna datetime64[us] con NaT en los textos que no encajan o no son
+        fechas válidas, que quedan para los pasos siguientes.
+        """
+        # Posición de cada campo y de los separadores según fmt
+        widths = {'d': 2, 'm': 2, 'Y': 4}
+        fields, literals = {}, []
+        width = i = 0
+        while i < len(fmt):
+            if fmt[i] == '%':
+                fields[fmt[i + 1]] = width
+                width += widths[fmt[i + 1]]
+                i += 2
+            else:
+                literals.append((width, ord(fmt[i])))
+                width += 1
+                i += 1
+        
+        dates = np.full(len(texts), np.datetime64('NaT'), dtype='datetime64[us]')
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        sel = np.flatnonzero(lengths == width)
+        if not len(sel):
+            return dates
+        
+        codes = np.array(texts[sel].tolist(), dtype=f'U{width}').view(np.uint32).reshape(-1, width).astype(np.int64)
+        ok = np.ones(len(sel), dtype=bool)
+        for pos, char in literals:
+            ok &= codes[:, pos] == char
+        
+        numbers = {}
+        for name, start in fields.items():
+            digits = codes[:, start:start + widths[name]] - ord('0')
+            ok &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+            numbers[name] = digits @ 10 ** np.arange(widths[name] - 1, -1, -1)
+        year, month, day = numbers['Y'], numbers['m'], numbers['d']
+        ok &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+        
+        month_start = np.where(ok, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]').astype('datetime64[D]')
+        month_days = ((month_start.astype('datetime64[M]') + 1).astype('datetime64[D]') - month_start).astype(np.int64)
+        ok &= day <= month_days
+        
+        dates[sel[ok]] = month_start[ok] + (day[ok] - 1)
+        return dates
+    
+    @staticmethod
+    def _detect_date_format(texts):
+        """Formato de DATE_FORMATS que acepta el primer texto interpretable como fecha"""
+        for s in texts:
+            for fmt in DATE_FORMATS:
+                try:
+                    datetime.strptime(s, fmt)
+                    return fmt
+                except ValueError:
+                    continue
+        return None
+    
+    @staticmethod
+    def _parse_date(value):
+        """Convierte el valor de la columna fecha a datetime (varios formatos posibles)"""
+        if isinstance(value, datetime):
+            return value
+        if value is None:
+            return None
+        
+        s = str(value).strip()
+        for fmt in DATE_FORMATS:
+            try:
+                return datetime.strptime(s, fmt)
+            except Exception:
+                continue
+        
+        # intentar convertir número de Excel a fecha
+        try:
+            return openpyxl.utils.datetime.from_excel(float(s))
+        except Exception:
+            return None
     
     def parse_location(self, location_text):
         """Extrae latitud y longitud del texto"""
@@ -153,63 +1144,86 @@ class DrainageSimulationModel:
         
         return 0.0, 0.0
     
-    def simulate_rainfall_from_historical(self, zone_name, hours=24, use_historical_pattern=True):
+    def simulate_rainfall_from_historical(self, zone_name, hours=24, use_historical_pattern=True,
+                                          n_realizations=None, month=None, rng=None):
         """
         Simula lluvia horaria basada en patrones históricos o sintéticos
         
+        Usa el índice de estadísticas precalculado al cargar la zona, por lo
+        que el costo es proporcional a las horas simuladas y no al historial
+        
         Args:
             zone_name: Nombre de la zona
             hours: Número de horas a simular
             use_historical_pattern: Si True, usa estadísticas de datos históricos
+            n_realizations: Si se indica, retorna una matriz (n_realizations, hours)
+            month: Mes (1-12) para condicionar la simulación a ese mes
+            rng: numpy.random.Generator a usar (por defecto uno nuevo sin semilla)
         """
-        if zone_name not in self.zones_data:
-            raise ValueError(f"Zona '{zone_name}' no encontrada")
-        
-        zone = self.zones_data[zone_name]
-        
-        if use_historical_pattern and len(zone['historical_data']) > 0:
-            # Usar estadísticas de datos históricos
-            historical_rain = zone['historical_data']['lluvia_mm'].values
-            historical_rain = historical_rain[historical_rain > 0]  # Solo días con lluvia
-            
-            if len(historical_rain) > 0:
-                mean_rain = historical_rain.mean()
-                std_rain = historical_rain.std()
-                max_rain = historical_rain.max()
-            else:
-                mean_rain = 5
-                std_rain = 3
-                max_rain = 15
+        rng = rng or np.random.default_rng()
+        if use_historical_pattern:
+            stats = self.get_rain_stats(zone_name, month)
         else:
-            # Valores por defecto
-            mean_rain = 5
-            std_rain = 3
-            max_rain = 15
+            self._get_zone(zone_name)
+            stats = self._wet_day_stats(np.array([]))  # Valores por defecto
         
         # Generar lluvia con distribución gamma
-        if std_rain > 0:
-            shape = (mean_rain / std_rain) ** 2
-            scale = std_rain ** 2 / mean_rain
-        else:
-            shape = 2
-            scale = mean_rain / 2
-        
-        rainfall = np.random.gamma(shape, scale, hours)
-        rainfall = np.clip(rainfall, 0, max_rain * 1.5)
+        size = hours if n_realizations is None else (n_realizations, hours)
+        rainfall = rng.gamma(stats['gamma_shape'], stats['gamma_scale'], size)
+        rainfall = np.clip(rainfall, 0, stats['wet_max'] * 1.5)
         
         return rainfall
     
-    def simulate_rainfall(self, zone_name, hours=24, intensity='moderate'):
+    def simulate_rainfall_stochastic(self, zone_name, hours=24, n_realizations=None, month=None, rng=None):
+        """
+        Simula lluvia horaria con persistencia de rachas lluviosas y secas
+        
+        Alterna rachas lluviosas y secas con duraciones geométricas cuyas
+        medias son las del historial de la zona (cadena de Markov de dos
+        estados) y asigna a cada hora lluviosa una intensidad gamma como el
+        modo 'historical'. Como en ese modo, cada registro del historial
+        equivale a un paso (una hora) de la simulación.
+        
+        Las rachas se muestrean en bloque (sin bucle por hora), así que
+        series de cientos de años toman segundos. Con n_realizations, las
+        filas son tramos consecutivos de una misma serie larga. La serie no
+        depende de cómo se pida: iter_scenario la toma por bloques de un
+        mismo StochasticRainStream y obtiene lo mismo que una sola llamada.
+        """
+        rng = rng or np.random.default_rng()
+        size = hours if n_realizations is None else n_realizations * hours
+        rainfall = self.stochastic_stream(zone_name, month, rng).take(size)
+        
+        return rainfall if n_realizations is None else rainfall.reshape(n_realizations, hours)
+    
+    def stochastic_stream(self, zone_name, month=None, rng=None):
+        """Serie del modo 'stochastic' de la zona para pedir por tramos (ver StochasticRainStream)"""
+        return StochasticRainStream(self.get_rain_stats(zone_name, month), rng or np.random.default_rng())
+    
+    @metrics.timed('simulate')
+    def simulate_rainfall(self, zone_name, hours=24, intensity='moderate', n_realizations=None,
+                          month=None, rng=None, return_period=None):
         """
         Simula lluvia horaria con intensidad predefinida
         
         Args:
             zone_name: Nombre de la zona
             hours: Número de horas a simular
-            intensity: 'light', 'moderate', 'heavy', 'extreme', 'historical'
+            intensity: 'light', 'moderate', 'heavy', 'extreme', 'historical', 'stochastic', 'idf'
+            n_realizations: Si se indica, retorna una matriz (n_realizations, hours)
+            month: Mes (1-12) para condicionar los modos 'historical' y 'stochastic'
+            rng: numpy.random.Generator a usar (por defecto uno nuevo sin semilla)
+            return_period: Periodo de retorno (años) del modo 'idf'
+                           (por defecto DEFAULT_RETURN_PERIOD)
         """
+        rng = rng or np.random.default_rng()
+        if intensity == 'idf':
+            return self.simulate_rainfall_idf(zone_name, hours, return_period or DEFAULT_RETURN_PERIOD,
+                                              n_realizations)
         if intensity == 'historical':
-            return self.simulate_rainfall_from_historical(zone_name, hours, True)
+            return self.simulate_rainfall_from_historical(zone_name, hours, True, n_realizations, month, rng)
+        if intensity == 'stochastic':
+            return self.simulate_rainfall_stochastic(zone_name, hours, n_realizations, month, rng)
         
         # Patrones de intensidad de lluvia (mm/hora)
         intensity_patterns = {
@@ -225,80 +1239,823 @@ class DrainageSimulationModel:
         shape = (pattern['mean'] / pattern['std']) ** 2
         scale = pattern['std'] ** 2 / pattern['mean']
         
-        rainfall = np.random.gamma(shape, scale, hours)
+        size = hours if n_realizations is None else (n_realizations, hours)
+        rainfall = rng.gamma(shape, scale, size)
         rainfall = np.clip(rainfall, 0, pattern['max'])
         
         return rainfall
     
+    @metrics.timed('excess')
+    def compute_excess_arrays(self, rainfall_data, drainage_capacity=10.0, area_m2=1000,
+                              initial_accumulated=0.0, storage_mm=None, initial_storage=0.0):
+        """
+        Motor vectorizado de excedentes: opera sobre el último eje (horas),
+        por lo que acepta una serie (horas,) o una matriz (realizaciones, horas)
+        
+        Args:
+            initial_accumulated: Excedente acumulado antes de la primera hora
+                                 (para continuar una simulación por bloques)
+            storage_mm: Capacidad de almacenamiento (encharcamiento) en mm sobre
+                        el área de la zona. Si se indica, la lluvia sobre la
+                        capacidad de drenaje llena el almacenamiento, la
+                        capacidad sobrante de horas posteriores lo vacía y lo
+                        que no cabe se desborda (ver route_storage)
+            initial_storage: Nivel del almacenamiento antes de la primera hora
+        
+        Retorna un diccionario de arreglos sin redondear; 'nivel_riesgo'
+        contiene índices en RISK_LEVELS
+        """
+        rainfall = np.asarray(rainfall_data, dtype=float)
+        excess = np.maximum(rainfall - drainage_capacity, 0)
+        
+        if np.any(initial_accumulated):
+            # Sumar el arrastre como primer término conserva el mismo orden de
+            # suma que un único cumsum sobre toda la serie
+            start = np.broadcast_to(initial_accumulated, excess.shape[:-1] + (1,))
+            accumulated = np.cumsum(np.concatenate([start, excess], axis=-1), axis=-1)[..., 1:]
+        else:
+            accumulated = np.cumsum(excess, axis=-1)
+        
+        arrays = {
+            'lluvia_mm': rainfall,
+            'excedente_mm': excess,
+            'excedente_acumulado_mm': accumulated,
+            'volumen_agua_litros': (rainfall * area_m2) / 1000,
+            'excedente_volumen_litros': (excess * area_m2) / 1000,
+            'nivel_riesgo': risk_level_indices(excess)
+        }
+        if storage_mm is not None:
+            inflow = rainfall - drainage_capacity
+            storage = route_storage(inflow, storage_mm, initial_storage)
+            previous = np.concatenate(
+                [np.broadcast_to(initial_storage, storage.shape[:-1] + (1,)), storage[..., :-1]], axis=-1)
+            overflow = np.maximum(previous + inflow - storage_mm, 0)
+            arrays.update({
+                'almacenamiento_mm': storage,
+                'desborde_mm': overflow,
+                'desborde_volumen_litros': (overflow * area_m2) / 1000,
+                # Horas para vaciar el almacenamiento si dejara de llover
+                'horas_para_drenar': np.ceil(storage / drainage_capacity)
+            })
+        return arrays
+    
     def calculate_drainage_excess(self, zone_name, rainfall_data, 
-                                  drainage_capacity=10.0, area_m2=1000):
+                                  drainage_capacity=10.0, area_m2=1000, storage_mm=None):
         """
         Calcula el excedente de agua respecto a la capacidad de drenaje
+        
+        Con storage_mm agrega el ruteo por almacenamiento (ver compute_excess_arrays)
         """
-        results = []
-        accumulated_excess = 0
+        arrays = self.compute_excess_arrays(rainfall_data, drainage_capacity, area_m2,
+                                            storage_mm=storage_mm)
+        return self._hourly_frame(arrays, drainage_capacity)
+    
+    @staticmethod
+    @metrics.timed('frame')
+    def _hourly_frame(arrays, drainage_capacity, first_hour=1):
+        """DataFrame horario (redondeado) a partir de compute_excess_arrays"""
+        hours = len(arrays['lluvia_mm'])
         
-        for hour, rainfall in enumerate(rainfall_data):
-            # Calcular excedente por hora
-            excess = max(0, rainfall - drainage_capacity)
-            accumulated_excess += excess
-            
-            # Volumen de agua en litros
-            volume_liters = (rainfall * area_m2) / 1000
-            excess_volume = (excess * area_m2) / 1000
-            
-            results.append({
-                'hora': hour + 1,
-                'lluvia_mm': round(rainfall, 2),
-                'capacidad_drenaje_mm': drainage_capacity,
-                'excedente_mm': round(excess, 2),
-                'excedente_acumulado_mm': round(accumulated_excess, 2),
-                'volumen_agua_litros': round(volume_liters, 2),
-                'excedente_volumen_litros': round(excess_volume, 2),
-                'estado': self.get_risk_level(excess)
-            })
+        columns = {
+            'hora': np.arange(first_hour, first_hour + hours),
+            'lluvia_mm': np.round(arrays['lluvia_mm'], 2),
+            'capacidad_drenaje_mm': np.full(hours, drainage_capacity),
+            'excedente_mm': np.round(arrays['excedente_mm'], 2),
+            'excedente_acumulado_mm': np.round(arrays['excedente_acumulado_mm'], 2),
+            'volumen_agua_litros': np.round(arrays['volumen_agua_litros'], 2),
+            'excedente_volumen_litros': np.round(arrays['excedente_volumen_litros'], 2),
+            'estado': np.array(RISK_LEVELS, dtype=object)[arrays['nivel_riesgo']]
+        }
+        if 'almacenamiento_mm' in arrays:
+            columns['almacenamiento_mm'] = np.round(arrays['almacenamiento_mm'], 2)
+            columns['desborde_mm'] = np.round(arrays['desborde_mm'], 2)
+            columns['desborde_volumen_litros'] = np.round(arrays['desborde_volumen_litros'], 2)
+            columns['horas_para_drenar'] = arrays['horas_para_drenar'].astype(np.int64)
         
-        return pd.DataFrame(results)
+        return pd.DataFrame(columns)
+    
+    @staticmethod
+    def _storage_config(scenario_config):
+        """storage_mm del escenario (None = sin ruteo por almacenamiento), validado"""
+        storage_mm = scenario_config.get('storage_mm')
+        if storage_mm is None:
+            return None
+        storage_mm = float(storage_mm)
+        if not np.isfinite(storage_mm) or storage_mm < 0:
+            raise ValueError("'storage_mm' debe ser un número no negativo")
+        if not scenario_config.get('drainage_capacity', 10) > 0:
+            raise ValueError("El ruteo por almacenamiento requiere 'drainage_capacity' mayor que cero")
+        return storage_mm
+    
+    @staticmethod
+    def _running_sum(values, start=0.0):
+        """
+        Suma de values en orden, a partir de start. Continuar la suma bloque a
+        bloque da exactamente lo mismo que sumar la serie completa, lo que no
+        ocurre con la suma por pares de NumPy/pandas (iter_scenario debe
+        coincidir con evaluate_scenario para cualquier tamaño de bloque)
+        """
+        return float(np.cumsum(np.concatenate([[start], np.asarray(values, dtype=float)]))[-1])
+    
+    @staticmethod
+    def _storage_summary(storage_mm, max_storage, final_storage, overflow_mm, overflow_hours,
+                         drainage_capacity, area_m2):
+        """Sección 'almacenamiento' del resumen"""
+        return {
+            'capacidad_almacenamiento_mm': round(storage_mm, 2),
+            'almacenamiento_maximo_mm': round(float(max_storage), 2),
+            'almacenamiento_final_mm': round(float(final_storage), 2),
+            'desborde_total_mm': round(float(overflow_mm), 2),
+            'desborde_volumen_litros': round(float(overflow_mm) * area_m2 / 1000, 2),
+            'horas_con_desborde': int(overflow_hours),
+            'horas_para_drenar_final': int(np.ceil(final_storage / drainage_capacity))
+        }
     
     def get_risk_level(self, excess):
         """Determina nivel de riesgo según excedente"""
-        if excess == 0:
-            return 'Normal'
-        elif excess < 5:
-            return 'Precaución'
-        elif excess < 15:
-            return 'Alerta'
-        elif excess < 30:
-            return 'Peligro'
-        else:
-            return 'Emergencia'
+        return RISK_LEVELS[int(risk_level_indices(excess))]
     
-    def evaluate_scenario(self, zone_name, scenario_config):
+    def evaluate_scenario(self, zone_name, scenario_config, seed=None):
         """
         Evalúa un escenario preventivo
+        
+        Si scenario_config incluye 'n_realizations' > 1 se ejecuta en modo
+        ensamble (Monte Carlo): ver evaluate_ensemble
+        
+        Args:
+            seed: Semilla para obtener resultados reproducibles (también se
+                  acepta como scenario_config['seed']); ver scenario_rng
         """
-        if zone_name not in self.zones_data:
-            raise ValueError(f"Zona '{zone_name}' no encontrada")
+        zone = self._get_zone(zone_name)
+        if seed is None:
+            seed = scenario_config.get('seed')
+        
+        if int(scenario_config.get('n_realizations') or 1) > 1:
+            return self.evaluate_ensemble(zone_name, scenario_config, seed)
         
         # Simular lluvia
         rainfall = self.simulate_rainfall(
             zone_name,
             hours=scenario_config.get('hours', 24),
-            intensity=scenario_config.get('intensity', 'moderate')
+            intensity=scenario_config.get('intensity', 'moderate'),
+            month=scenario_config.get('month'),
+            rng=scenario_rng(zone_name, seed),
+            return_period=scenario_config.get('return_period')
         )
         
         # Calcular excedentes
-        results = self.calculate_drainage_excess(
+        storage_mm = self._storage_config(scenario_config)
+        drainage_capacity = scenario_config.get('drainage_capacity', 10)
+        arrays = self.compute_excess_arrays(rainfall, drainage_capacity, scenario_config.get('area_m2', 1000),
+                                            storage_mm=storage_mm)
+        results = self._hourly_frame(arrays, drainage_capacity)
+        
+        # Resumen del escenario (sumas secuenciales: ver _running_sum)
+        with metrics.stage('summary'):
+            summary = self._scenario_header(zone_name, zone)
+            summary['simulacion'] = {
+                'total_lluvia_mm': round(self._running_sum(rainfall), 2),
+                'lluvia_maxima_mm': round(rainfall.max(), 2),
+                'excedente_total_mm': round(results['excedente_acumulado_mm'].iloc[-1], 2),
+                'horas_con_excedente': len(results[results['excedente_mm'] > 0]),
+                'max_nivel_riesgo': results.loc[results['excedente_mm'].idxmax(), 'estado'] if len(results) > 0 else 'Normal',
+                'volumen_total_litros': round(self._running_sum(results['volumen_agua_litros']), 2),
+                'volumen_excedente_litros': round(self._running_sum(results['excedente_volumen_litros']), 2)
+            }
+            if storage_mm is not None and len(results) > 0:
+                storage = results['almacenamiento_mm']
+                summary['almacenamiento'] = self._storage_summary(
+                    storage_mm, storage.max(), storage.iloc[-1], self._running_sum(arrays['desborde_mm']),
+                    (results['desborde_mm'] > 0).sum(), drainage_capacity,
+                    scenario_config.get('area_m2', 1000))
+        self.record_zone_risk(zone_name, summary['simulacion']['max_nivel_riesgo'])
+        
+        return results, summary
+    
+    def iter_scenario(self, zone_name, scenario_config, seed=None,
+                      chunk_hours=DEFAULT_STREAM_CHUNK_HOURS):
+        """
+        Evalúa un escenario por bloques de horas, para horizontes largos
+        
+        Genera ('hourly', DataFrame) por cada bloque de chunk_hours horas y,
+        al final, ('summary', resumen). La memoria usada depende de
+        chunk_hours y no de la duración total. Con la misma semilla, los
+        bloques concatenados y el resumen coinciden con evaluate_scenario
+        para todas las intensidades y cualquier chunk_hours: la tormenta de
+        'idf' se calcula una vez y se reparte entre los bloques, y la serie
+        de 'stochastic' continúa sus rachas de un bloque al siguiente.
+        
+        Solo admite una realización (sin modo ensamble).
+        """
+        zone = self._get_zone(zone_name)
+        if seed is None:
+            seed = scenario_config.get('seed')
+        
+        hours = int(scenario_config.get('hours', 24))
+        chunk_hours = int(chunk_hours)
+        if hours < 1 or chunk_hours < 1:
+            raise ValueError("'hours' y el tamaño de bloque deben ser mayores que cero")
+        if int(scenario_config.get('n_realizations') or 1) > 1:
+            raise ValueError("La simulación por bloques no admite el modo ensamble")
+        
+        intensity = scenario_config.get('intensity', 'moderate')
+        month = scenario_config.get('month')
+        drainage_capacity = scenario_config.get('drainage_capacity', 10)
+        area_m2 = scenario_config.get('area_m2', 1000)
+        storage_mm = self._storage_config(scenario_config)
+        rng = scenario_rng(zone_name, seed)
+        
+        accumulated = 0.0
+        stored = 0.0
+        max_stored = 0.0
+        overflow = 0.0
+        overflow_hours = 0
+        total_rain = 0.0
+        max_rain = -np.inf
+        hours_over = 0
+        max_excess = -np.inf
+        max_level = 'Normal'
+        total_volume = 0.0
+        excess_volume = 0.0
+        
+        # La tormenta de diseño es una sola para todo el escenario, no una por
+        # bloque, y la serie 'stochastic' continúa sus rachas de un bloque al otro
+        storm = (self.design_storm(zone_name, hours, scenario_config.get('return_period') or DEFAULT_RETURN_PERIOD)
+                 if intensity == 'idf' else None)
+        stream = self.stochastic_stream(zone_name, month, rng) if intensity == 'stochastic' else None
+        
+        for first in range(0, hours, chunk_hours):
+            size = min(chunk_hours, hours - first)
+            if storm is not None:
+                rainfall = np.zeros(size)
+                part = storm[first:first + size]
+                rainfall[:len(part)] = part
+            elif stream is not None:
+                rainfall = stream.take(size)
+            else:
+                # Un mismo generador produce la misma secuencia que una única llamada
+                rainfall = self.simulate_rainfall(zone_name, size, intensity, month=month, rng=rng)
+            arrays = self.compute_excess_arrays(rainfall, drainage_capacity, area_m2, accumulated,
+                                                storage_mm, stored)
+            results = self._hourly_frame(arrays, drainage_capacity, first + 1)
+            accumulated = arrays['excedente_acumulado_mm'][-1]
+            if storage_mm is not None:
+                stored = arrays['almacenamiento_mm'][-1]
+                max_stored = max(max_stored, results['almacenamiento_mm'].max())
+                # Desborde sin redondear: el volumen se redondea una vez, al final
+                overflow = self._running_sum(arrays['desborde_mm'], overflow)
+                overflow_hours += int((results['desborde_mm'] > 0).sum())
+            
+            total_rain = self._running_sum(rainfall, total_rain)
+            max_rain = max(max_rain, rainfall.max())
+            excess = results['excedente_mm'].to_numpy()
+            hours_over += int((excess > 0).sum())
+            peak = int(excess.argmax())
+            if excess[peak] > max_excess:
+                max_excess = excess[peak]
+                max_level = results['estado'].iloc[peak]
+            total_volume = self._running_sum(results['volumen_agua_litros'], total_volume)
+            excess_volume = self._running_sum(results['excedente_volumen_litros'], excess_volume)
+            
+            yield 'hourly', results
+        
+        summary = self._scenario_header(zone_name, zone)
+        summary['simulacion'] = {
+            'total_lluvia_mm': round(total_rain, 2),
+            'lluvia_maxima_mm': round(max_rain, 2),
+            'excedente_total_mm': round(results['excedente_acumulado_mm'].iloc[-1], 2),
+            'horas_con_excedente': hours_over,
+            'max_nivel_riesgo': max_level,
+            'volumen_total_litros': round(total_volume, 2),
+            'volumen_excedente_litros': round(excess_volume, 2)
+        }
+        if storage_mm is not None:
+            summary['almacenamiento'] = self._storage_summary(
+                storage_mm, max_stored, results['almacenamiento_mm'].iloc[-1], overflow, overflow_hours,
+                drainage_capacity, area_m2)
+        self.record_zone_risk(zone_name, max_level)
+        yield 'summary', summary
+    
+    def evaluate_ensemble(self, zone_name, scenario_config, seed=None):
+        """
+        Evalúa un escenario en modo ensamble (Monte Carlo)
+        
+        Genera una matriz de lluvia (n_realizations x horas) en una sola llamada
+        y calcula los excedentes de todas las realizaciones a la vez.
+        
+        Retorna:
+            results: DataFrame horario con la mediana (columnas habituales),
+                     percentiles ENSEMBLE_PERCENTILES y la probabilidad de
+                     alcanzar cada nivel de riesgo en esa hora
+            summary: resumen habitual (medianas) más la sección 'ensamble'
+        """
+        zone = self._get_zone(zone_name)
+        if seed is None:
+            seed = scenario_config.get('seed')
+        
+        hours = int(scenario_config.get('hours', 24))
+        n_realizations = int(scenario_config.get('n_realizations') or 1)
+        if n_realizations < 1 or hours < 1:
+            raise ValueError("'hours' y 'n_realizations' deben ser mayores que cero")
+        if n_realizations * hours > MAX_ENSEMBLE_CELLS:
+            raise ValueError(
+                f"Ensamble demasiado grande: {n_realizations} x {hours} horas "
+                f"(máximo {MAX_ENSEMBLE_CELLS} celdas)"
+            )
+        
+        drainage_capacity = scenario_config.get('drainage_capacity', 10)
+        area_m2 = scenario_config.get('area_m2', 1000)
+        
+        rainfall = self.simulate_rainfall(
             zone_name,
-            rainfall,
-            drainage_capacity=scenario_config.get('drainage_capacity', 10),
-            area_m2=scenario_config.get('area_m2', 1000)
+            hours=hours,
+            intensity=scenario_config.get('intensity', 'moderate'),
+            n_realizations=n_realizations,
+            month=scenario_config.get('month'),
+            rng=scenario_rng(zone_name, seed),
+            return_period=scenario_config.get('return_period')
         )
+        storage_mm = self._storage_config(scenario_config)
+        arrays = self.compute_excess_arrays(rainfall, drainage_capacity, area_m2, storage_mm=storage_mm)
+        levels = arrays['nivel_riesgo']
+        
+        with metrics.stage('frame'):
+            # Estadísticas horarias a través de las realizaciones
+            rain_pct = np.percentile(rainfall, ENSEMBLE_PERCENTILES, axis=0)
+            acc_pct = np.percentile(arrays['excedente_acumulado_mm'], ENSEMBLE_PERCENTILES, axis=0)
+            median_index = ENSEMBLE_PERCENTILES.index(50)
+        
+            columns = {
+                'hora': np.arange(1, hours + 1),
+                'lluvia_mm': np.round(rain_pct[median_index], 2),
+                'capacidad_drenaje_mm': np.full(hours, drainage_capacity),
+                'excedente_mm': np.round(np.median(arrays['excedente_mm'], axis=0), 2),
+                'excedente_acumulado_mm': np.round(acc_pct[median_index], 2)
+            }
+            # La mediana ya ocupa las columnas habituales
+            other_pct = [(i, p) for i, p in enumerate(ENSEMBLE_PERCENTILES) if p != 50]
+            for i, p in other_pct:
+                columns[f'lluvia_p{p}_mm'] = np.round(rain_pct[i], 2)
+            for i, p in other_pct:
+                columns[f'excedente_acumulado_p{p}_mm'] = np.round(acc_pct[i], 2)
+            for k, level in enumerate(RISK_LEVELS[1:], start=1):
+                columns[f'prob_{self._risk_slug(level)}'] = np.round((levels >= k).mean(axis=0), 4)
+            if storage_mm is not None:
+                columns['almacenamiento_mm'] = np.round(np.median(arrays['almacenamiento_mm'], axis=0), 2)
+                columns['desborde_mm'] = np.round(np.median(arrays['desborde_mm'], axis=0), 2)
+                columns['prob_desborde'] = np.round((arrays['desborde_mm'] > 0).mean(axis=0), 4)
+            results = pd.DataFrame(columns)
+        
+        with metrics.stage('summary'):
+            # Distribuciones por realización
+            total_rain = rainfall.sum(axis=1)
+            max_rain = rainfall.max(axis=1)
+            total_excess = arrays['excedente_acumulado_mm'][:, -1]
+            max_excess = arrays['excedente_mm'].max(axis=1)
+            hours_over = (arrays['excedente_mm'] > 0).sum(axis=1)
+            max_levels = levels.max(axis=1)
+        
+            counts, edges = np.histogram(total_excess, bins=20)
+            level_counts = np.bincount(max_levels, minlength=len(RISK_LEVELS))
+        
+            summary = self._scenario_header(zone_name, zone)
+            summary['simulacion'] = {
+                'total_lluvia_mm': round(float(np.median(total_rain)), 2),
+                'lluvia_maxima_mm': round(float(np.median(max_rain)), 2),
+                'excedente_total_mm': round(float(np.median(total_excess)), 2),
+                'horas_con_excedente': int(np.median(hours_over)),
+                'max_nivel_riesgo': self.get_risk_level(np.median(max_excess)),
+                'volumen_total_litros': round(float(np.median(arrays['volumen_agua_litros'].sum(axis=1))), 2),
+                'volumen_excedente_litros': round(float(np.median(arrays['excedente_volumen_litros'].sum(axis=1))), 2)
+            }
+            summary['ensamble'] = {
+                'realizaciones': n_realizations,
+                'excedente_total_mm': {
+                    **{f'p{p}': round(float(v), 2)
+                       for p, v in zip(ENSEMBLE_PERCENTILES, np.percentile(total_excess, ENSEMBLE_PERCENTILES))},
+                    'media': round(float(total_excess.mean()), 2),
+                    'maximo': round(float(total_excess.max()), 2)
+                },
+                'distribucion_excedente_total': {
+                    'bordes_mm': [round(float(e), 2) for e in edges],
+                    'frecuencias': [int(c) for c in counts]
+                },
+                # Probabilidad de que el nivel máximo del evento sea exactamente / al menos cada nivel
+                'probabilidad_nivel_maximo': {
+                    level: round(float(c) / n_realizations, 4) for level, c in zip(RISK_LEVELS, level_counts)
+                },
+                'probabilidad_alcanzar_nivel': {
+                    level: round(float(level_counts[k:].sum()) / n_realizations, 4)
+                    for k, level in enumerate(RISK_LEVELS)
+                }
+            }
+            if storage_mm is not None:
+                # Medianas por realización, como en 'simulacion'
+                overflow = arrays['desborde_mm']
+                summary['almacenamiento'] = self._storage_summary(
+                    storage_mm, np.median(arrays['almacenamiento_mm'].max(axis=1)),
+                    np.median(arrays['almacenamiento_mm'][:, -1]), np.median(overflow.sum(axis=1)),
+                    np.median((overflow > 0).sum(axis=1)), drainage_capacity, area_m2)
+                summary['almacenamiento']['probabilidad_desborde'] = round(float((overflow > 0).any(axis=1).mean()), 4)
+        self.record_zone_risk(zone_name, summary['simulacion']['max_nivel_riesgo'])
+        
+        return results, summary
+    
+    def evaluate_scenarios(self, zones=None, scenario_config=None, include_hourly=False, processes=None,
+                           progress=None):
+        """
+        Evalúa el mismo escenario en varias zonas repartiéndolas en un pool de procesos
+        
+        Args:
+            zones: Lista de nombres de zona (None = todas)
+            scenario_config: Configuración como en evaluate_scenario
+            include_hourly: Si True, retorna también el detalle horario de cada zona
+            processes: Número de procesos (None = núcleos disponibles, 1 = secuencial)
+            progress: Función progress(hechas, total) llamada tras cada zona; si
+                      lanza una excepción se abandonan las zonas restantes
+        
+        Retorna:
+            table: DataFrame con una fila por zona, ordenado de mayor a menor riesgo
+            hourly: {zona: DataFrame horario} (vacío si include_hourly es False)
+        """
+        scenario_config = scenario_config or {}
+        zone_index = self.zone_index
+        zones = list(zone_index) if zones is None else list(zones)
+        missing = [z for z in zones if z not in zone_index]
+        if missing:
+            raise ValueError(f"Zonas no encontradas: {', '.join(missing)}")
+        
+        processes = processes or os.cpu_count() or 1
+        tasks = [(zone, scenario_config, include_hourly) for zone in zones]
+        
+        def collect(evaluated):
+            rows = []
+            for row in evaluated:
+                rows.append(row)
+                if progress is not None:
+                    progress(len(rows), len(tasks))
+            return rows
+        
+        if processes <= 1 or len(zones) < BATCH_PARALLEL_MIN_ZONES:
+            rows = collect(self._evaluate_zone_row(*task) for task in tasks)
+        else:
+            processes = min(processes, len(zones))
+            chunksize = max(1, len(zones) // (processes * 4))
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_batch_worker,
+                                     initargs=(self,)) as pool:
+                try:
+                    rows = collect(pool.map(_evaluate_zone_task, tasks, chunksize=chunksize))
+                except BaseException:
+                    # Abandonar (p. ej. cancelación desde progress) sin esperar
+                    # a las zonas que aún no empezaron
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+        
+        hourly = {row['zona']: row.pop('hourly') for row in rows if 'hourly' in row}
+        # Los procesos del pool registran el riesgo en su propia copia del modelo
+        for row in rows:
+            self.record_zone_risk(row['zona'], row['max_nivel_riesgo'])
+        
+        table = pd.DataFrame(rows)
+        if len(table) > 0:
+            table = table.sort_values(['nivel_riesgo', 'excedente_total_mm'],
+                                      ascending=False, kind='stable').reset_index(drop=True)
+            table.insert(0, 'ranking', np.arange(1, len(table) + 1))
+        
+        return table, hourly
+    
+    def _evaluate_zone_row(self, zone_name, scenario_config, include_hourly=False):
+        """Fila resumen de una zona para evaluate_scenarios"""
+        results, summary = self.evaluate_scenario(zone_name, scenario_config)
+        sim = summary['simulacion']
+        row = {
+            'zona': zone_name,
+            'latitud': summary['latitud'],
+            'longitud': summary['longitud'],
+            'max_nivel_riesgo': sim['max_nivel_riesgo'],
+            'nivel_riesgo': RISK_LEVELS.index(sim['max_nivel_riesgo']),
+            'excedente_total_mm': float(sim['excedente_total_mm']),
+            'horas_con_excedente': int(sim['horas_con_excedente']),
+            'total_lluvia_mm': float(sim['total_lluvia_mm']),
+            'lluvia_maxima_mm': float(sim['lluvia_maxima_mm']),
+            'volumen_excedente_litros': float(sim['volumen_excedente_litros'])
+        }
+        if 'ensamble' in summary:
+            for level, p in summary['ensamble']['probabilidad_alcanzar_nivel'].items():
+                if level != 'Normal':
+                    row[f'prob_{self._risk_slug(level)}'] = p
+        if include_hourly:
+            row['hourly'] = results
+        return row
+    
+    @metrics.timed('sweep')
+    def evaluate_sweep(self, zone_name, capacities, intensities=None, scenario_config=None, seed=None):
+        """
+        Barrido de capacidad de drenaje: excedentes de una zona para cada
+        combinación de capacidad e intensidad
+        
+        Se simula una sola serie de lluvia por intensidad (con la misma semilla
+        que evaluate_scenario) y se evalúan todas las capacidades a la vez:
+        con la lluvia ordenada, las horas con excedente y el excedente máximo
+        se buscan por bisección, y los totales se suman solo sobre las horas
+        con lluvia > c. Cada fila coincide exactamente con el resumen de
+        evaluate_scenario para esa capacidad.
+        
+        Args:
+            capacities: Capacidades de drenaje (mm/h) a evaluar
+            intensities: Intensidades a evaluar (None = la de scenario_config)
+            scenario_config: Como en evaluate_scenario ('hours', 'month',
+                             'area_m2'); se ignora 'drainage_capacity'
+        
+        Retorna un DataFrame con una fila por (intensidad, capacidad), en el
+        orden recibido
+        """
+        scenario_config = scenario_config or {}
+        self._get_zone(zone_name)
+        if seed is None:
+            seed = scenario_config.get('seed')
+        if int(scenario_config.get('n_realizations') or 1) > 1:
+            raise ValueError("El barrido de capacidad no admite el modo ensamble")
+        
+        capacities = np.asarray(capacities, dtype=float).ravel()
+        if intensities is None:
+            intensities = [scenario_config.get('intensity', 'moderate')]
+        intensities = list(dict.fromkeys(intensities))
+        if len(capacities) == 0 or len(intensities) == 0:
+            raise ValueError("El barrido requiere al menos una capacidad y una intensidad")
+        if not np.all(np.isfinite(capacities)) or np.any(capacities < 0):
+            raise ValueError("Las capacidades deben ser números no negativos")
+        if len(capacities) * len(intensities) > MAX_SWEEP_POINTS:
+            raise ValueError(f"El barrido excede {MAX_SWEEP_POINTS} puntos (capacidades x intensidades)")
+        
+        hours = int(scenario_config.get('hours', 24))
+        area_m2 = scenario_config.get('area_m2', 1000)
+        
+        frames = []
+        for intensity in intensities:
+            rainfall = self.simulate_rainfall(zone_name, hours, intensity,
+                                              month=scenario_config.get('month'),
+                                              rng=scenario_rng(zone_name, seed),
+                                              return_period=scenario_config.get('return_period'))
+            order = np.argsort(rainfall, kind='stable')
+            ordered = rainfall[order]
+            n = len(ordered)
+            # Horas con lluvia <= capacidad (sin excedente)
+            dry = np.searchsorted(ordered, capacities, side='right')
+            
+            # evaluate_scenario trabaja con el excedente horario redondeado a 2
+            # decimales: cuenta las horas en que es positivo (0.004 mm no
+            # cuenta) y toma el nivel de la primera hora en que es máximo.
+            # El redondeo es monótono en la lluvia ordenada, así que ambas
+            # fronteras se buscan por bisección para todas las capacidades
+            def rounded(idx):
+                return np.round(np.maximum(ordered[idx] - capacities, 0.0), 2)
+            
+            hours_over = n - _bisect_first(n, dry, lambda idx: rounded(idx) > 0)
+            if n:
+                max_excess = rounded(np.full(len(capacities), n - 1))
+                top = _bisect_first(n, np.zeros_like(dry), lambda idx: rounded(idx) == max_excess)
+                # Primera hora (en el tiempo) entre las de mayor lluvia desde top
+                first_hour = np.minimum.accumulate(order[::-1])[::-1][top]
+                levels = risk_level_indices(np.maximum(rainfall[first_hour] - capacities, 0.0))
+            else:
+                max_excess = np.zeros_like(capacities)
+                levels = risk_level_indices(max_excess)
+            
+            # Excedente y volumen totales sumados como en evaluate_scenario:
+            # las horas sin excedente suman 0 y no cambian la suma, así que
+            # basta recorrer en orden temporal las horas con lluvia > capacidad.
+            # El volumen es la suma de los volúmenes horarios ya redondeados a
+            # 2 decimales (enteros de centésimas de litro). Se calcula por
+            # bloques de capacidades, de menor a mayor, de unas SWEEP_BLOCK_CELLS
+            # celdas cada uno
+            total_excess = np.zeros(len(capacities))
+            excess_cents = np.zeros(len(capacities))
+            by_capacity = np.argsort(capacities, kind='stable')
+            start = 0
+            while start < len(by_capacity):
+                wet = rainfall[rainfall > capacities[by_capacity[start]]]
+                if len(wet) == 0:
+                    break
+                block = by_capacity[start:start + max(1, SWEEP_BLOCK_CELLS // len(wet))]
+                start += len(block)
+                excess = np.maximum(wet - capacities[block, None], 0)
+                total_excess[block] = np.cumsum(excess, axis=1)[:, -1]
+                volume = np.round((excess * area_m2) / 1000, 2)
+                excess_cents[block] = np.rint(volume * 100).sum(axis=1)
+            
+            frames.append(pd.DataFrame({
+                'intensidad': intensity,
+                'capacidad_drenaje_mm': capacities,
+                'excedente_total_mm': np.round(total_excess, 2),
+                'horas_con_excedente': hours_over,
+                'excedente_maximo_mm': max_excess,
+                'nivel_riesgo': levels,
+                'max_nivel_riesgo': np.array(RISK_LEVELS, dtype=object)[levels],
+                'volumen_excedente_litros': np.round(excess_cents / 100, 2),
+                'total_lluvia_mm': round(self._running_sum(rainfall), 2)
+            }))
+        
+        return pd.concat(frames, ignore_index=True)
+    
+    @metrics.timed('design')
+    def design_capacity(self, zone_name, intensity='heavy', hours=24, risk_level='Alerta',
+                        confidence=0.95, n_realizations=None,
+                        month=None, seed=None, return_period=None):
+        """
+        Capacidad de drenaje mínima para que la zona no alcance risk_level
+        con probabilidad confidence
+        
+        El nivel de riesgo de una realización depende solo de su excedente
+        horario máximo, es decir de su lluvia máxima M menos la capacidad c.
+        No alcanzar risk_level equivale a M - c < umbral del nivel (para
+        'Precaución', a M <= c), así que basta ordenar las lluvias máximas del
+        ensamble y tomar el estadístico de orden de la confianza pedida: no
+        se vuelve a simular cada capacidad candidata.
+        
+        Sin n_realizations se usan DEFAULT_DESIGN_REALIZATIONS, o menos si
+        el horizonte es largo (hasta MAX_ENSEMBLE_CELLS celdas). Con
+        intensity='idf', return_period elige la tormenta de diseño (por
+        defecto DEFAULT_RETURN_PERIOD).
+        
+        Retorna un diccionario con la capacidad requerida (mm/h, redondeada
+        hacia arriba a 0.01), la probabilidad lograda en el ensamble y la
+        capacidad para cada nivel de DESIGN_CONFIDENCES
+        """
+        self._get_zone(zone_name)
+        if risk_level not in RISK_LEVELS[1:]:
+            raise ValueError(f"Nivel de riesgo inválido: {risk_level} "
+                             f"(opciones: {', '.join(RISK_LEVELS[1:])})")
+        confidence = float(confidence)
+        if not 0 < confidence <= 1:
+            raise ValueError("La confianza debe estar entre 0 y 1")
+        hours = int(hours)
+        if n_realizations is None:
+            n_realizations = min(DEFAULT_DESIGN_REALIZATIONS, MAX_ENSEMBLE_CELLS // max(hours, 1))
+        n_realizations = int(n_realizations)
+        if n_realizations < 1 or hours < 1:
+            raise ValueError("'hours' y 'n_realizations' deben ser mayores que cero")
+        if n_realizations * hours > MAX_ENSEMBLE_CELLS:
+            raise ValueError(
+                f"Ensamble demasiado grande: {n_realizations} x {hours} horas "
+                f"(máximo {MAX_ENSEMBLE_CELLS} celdas)"
+            )
+        
+        rainfall = self.simulate_rainfall(zone_name, hours, intensity, n_realizations=n_realizations,
+                                          month=month, rng=scenario_rng(zone_name, seed),
+                                          return_period=return_period)
+        max_rain = np.sort(rainfall.max(axis=1))
+        level = RISK_LEVELS.index(risk_level)
+        
+        def required(q):
+            # Menor lluvia máxima que cubre al menos q * n realizaciones
+            rank = max(int(np.ceil(q * n_realizations - 1e-9)), 1)
+            covered = float(max_rain[rank - 1])
+            if level == 1:
+                # Sin excedente alguno: c >= M
+                return max(float(np.ceil(covered * 100)) / 100, 0.0)
+            # Excedente por debajo del umbral: c > M - umbral
+            return max(float(np.floor((covered - RISK_THRESHOLDS[level - 2]) * 100)) / 100 + 0.01, 0.0)
+        
+        capacity = required(confidence)
+        reached = risk_level_indices(np.maximum(max_rain - capacity, 0)) >= level
+        return {
+            'zona': zone_name,
+            'intensidad': intensity,
+            'horas': hours,
+            'nivel_riesgo': risk_level,
+            'confianza': confidence,
+            'realizaciones': n_realizations,
+            'capacidad_requerida_mm_h': round(capacity, 2),
+            'probabilidad_lograda': round(1 - float(reached.mean()), 4),
+            'lluvia_maxima_mm': {
+                f'p{int(q * 100)}': round(float(np.quantile(max_rain, q)), 2)
+                for q in DESIGN_CONFIDENCES
+            },
+            'capacidad_por_confianza': {
+                f'p{int(q * 100)}': round(required(q), 2) for q in DESIGN_CONFIDENCES
+            }
+        }
+    
+    @metrics.timed('replay')
+    def replay_historical(self, zones=None, scenario_config=None):
+        """
+        Reproduce el historial registrado de las zonas: excedente de drenaje
+        de cada registro (día) con la lluvia real en lugar de lluvia simulada
+        
+        Args:
+            zones: Lista de nombres de zona (None = todas)
+            scenario_config: 'drainage_capacity', 'area_m2' como en
+                             evaluate_scenario y 'disaggregation':
+                             - None: cada registro es un paso contra la
+                               capacidad, como en los modos de simulación
+                             - 'uniform' o 'scs_type2': el total diario se
+                               reparte en 24 horas según DISAGGREGATION_PROFILES
         
-        zone = self.zones_data[zone_name]
+        Todas las zonas se evalúan a la vez sobre una sola serie concatenada.
+        Con un perfil fijo, las horas de un día que superan la capacidad c son
+        las de mayor fracción p con lluvia * p > c, así que el excedente del
+        día sale del perfil ordenado y sus sumas acumuladas sin expandir los
+        días a horas.
         
-        # Resumen del escenario
-        summary = {
+        Retorna:
+            events: DataFrame con los registros con excedente (zona, fecha,
+                    lluvia, horas con excedente, excedente total y máximo
+                    horario, nivel de riesgo), en el orden del historial
+            table: DataFrame con una fila por zona, ordenado de mayor a menor
+                   riesgo como en evaluate_scenarios
+        """
+        scenario_config = scenario_config or {}
+        state = self._state
+        zones = list(state.zone_index) if zones is None else list(zones)
+        missing = [z for z in zones if z not in state.zone_index]
+        if missing:
+            raise ValueError(f"Zonas no encontradas: {', '.join(missing)}")
+        
+        drainage_capacity = float(scenario_config.get('drainage_capacity', 10))
+        area_m2 = scenario_config.get('area_m2', 1000)
+        disaggregation = scenario_config.get('disaggregation')
+        if disaggregation is None:
+            profile = np.array([1.0])
+        elif disaggregation in DISAGGREGATION_PROFILES:
+            profile = DISAGGREGATION_PROFILES[disaggregation]
+        else:
+            raise ValueError(f"Desagregación desconocida: {disaggregation} "
+                             f"(disponibles: {', '.join(DISAGGREGATION_PROFILES)})")
+        
+        # Serie concatenada de todas las zonas (en modo perezoso cada zona se procesa aquí)
+        frames = [self._get_zone(zone, state)['historical_data'] for zone in zones]
+        counts = np.array([len(df) for df in frames], dtype=np.int64)
+        rain = np.concatenate([np.zeros(0)] + [df['lluvia_mm'].to_numpy(dtype=float) for df in frames if len(df)])
+        dates = np.concatenate([np.zeros(0, dtype='datetime64[us]')] +
+                               [fecha_datetime64(df['fecha']) for df in frames if len(df)])
+        zone_ids = np.repeat(np.arange(len(zones)), counts)
+        
+        # Horas del día sobre la capacidad: fracciones > c / lluvia del perfil
+        ascending = np.sort(profile)
+        top_sums = np.concatenate([[0.0], np.cumsum(ascending[::-1])])
+        wet = rain > 0
+        threshold = np.divide(drainage_capacity, rain, out=np.full_like(rain, np.inf), where=wet)
+        hours_over = len(profile) - np.searchsorted(ascending, threshold, side='right')
+        excess = np.maximum(rain * top_sums[hours_over] - hours_over * drainage_capacity, 0)
+        peak_excess = np.maximum(rain * ascending[-1] - drainage_capacity, 0)
+        levels = risk_level_indices(peak_excess)
+        
+        flagged = np.flatnonzero(hours_over > 0)
+        names = np.array(zones, dtype=object)
+        events = pd.DataFrame({
+            'zona': names[zone_ids[flagged]],
+            'fecha': dates[flagged],
+            'lluvia_mm': np.round(rain[flagged], 2),
+            'horas_con_excedente': hours_over[flagged],
+            'excedente_mm': np.round(excess[flagged], 2),
+            'excedente_maximo_mm': np.round(peak_excess[flagged], 2),
+            'nivel_riesgo': np.array(RISK_LEVELS, dtype=object)[levels[flagged]],
+            'volumen_excedente_litros': np.round(excess[flagged] * area_m2 / 1000, 2)
+        })
+        
+        # Agregados por zona (las zonas vienen en bloques contiguos de la serie)
+        n = len(zones)
+        zone_peak = np.zeros(n)
+        has_data = counts > 0
+        if has_data.any():
+            zone_peak[has_data] = np.maximum.reduceat(peak_excess, (np.cumsum(counts) - counts)[has_data])
+        zone_levels = risk_level_indices(zone_peak)
+        # Primer registro de cada zona con su excedente máximo
+        at_peak = np.flatnonzero((peak_excess == zone_peak[zone_ids]) & (peak_excess > 0))
+        peak_dates = np.full(n, np.datetime64('NaT'), dtype='datetime64[us]')
+        first = np.unique(zone_ids[at_peak], return_index=True)
+        peak_dates[first[0]] = dates[at_peak[first[1]]]
+        level_days = np.bincount(zone_ids * len(RISK_LEVELS) + levels,
+                                 minlength=n * len(RISK_LEVELS)).reshape(n, len(RISK_LEVELS))
+        excess_total = np.bincount(zone_ids, weights=excess, minlength=n)
+        
+        table = pd.DataFrame({
+            'zona': names,
+            'latitud': [state.zone_index[z]['latitude'] for z in zones],
+            'longitud': [state.zone_index[z]['longitude'] for z in zones],
+            'max_nivel_riesgo': np.array(RISK_LEVELS, dtype=object)[zone_levels],
+            'nivel_riesgo': zone_levels,
+            'registros': counts,
+            'dias_con_excedente': np.bincount(zone_ids, weights=hours_over > 0, minlength=n).astype(np.int64),
+            'horas_con_excedente': np.bincount(zone_ids, weights=hours_over, minlength=n).astype(np.int64),
+            'excedente_total_mm': np.round(excess_total, 2),
+            'excedente_maximo_mm': np.round(zone_peak, 2),
+            'fecha_excedente_maximo': peak_dates,
+            'total_lluvia_mm': np.round(np.bincount(zone_ids, weights=rain, minlength=n), 2),
+            'volumen_excedente_litros': np.round(excess_total * area_m2 / 1000, 2),
+            **{f'dias_{self._risk_slug(level)}': level_days[:, k] for k, level in enumerate(RISK_LEVELS) if k > 0}
+        })
+        if len(table) > 0:
+            table = table.sort_values(['nivel_riesgo', 'excedente_total_mm'],
+                                      ascending=False, kind='stable').reset_index(drop=True)
+            table.insert(0, 'ranking', np.arange(1, len(table) + 1))
+        
+        return events, table
+    
+    def _scenario_header(self, zone_name, zone):
+        """Encabezado común de los resúmenes: ubicación y datos históricos de la zona"""
+        return {
             'zona': zone_name,
             'latitud': zone['latitude'],
             'longitud': zone['longitude'],
@@ -307,24 +2064,103 @@ class DrainageSimulationModel:
                 'lluvia_total_historica': round(zone.get('total_rainfall', 0), 2),
                 'lluvia_maxima_historica': round(zone.get('max_rainfall', 0), 2),
                 'lluvia_promedio_historica': round(zone.get('avg_rainfall', 0), 2)
-            },
-            'simulacion': {
-                'total_lluvia_mm': round(rainfall.sum(), 2),
-                'lluvia_maxima_mm': round(rainfall.max(), 2),
-                'excedente_total_mm': round(results['excedente_acumulado_mm'].iloc[-1], 2),
-                'horas_con_excedente': len(results[results['excedente_mm'] > 0]),
-                'max_nivel_riesgo': results.loc[results['excedente_mm'].idxmax(), 'estado'] if len(results) > 0 else 'Normal',
-                'volumen_total_litros': round(results['volumen_agua_litros'].sum(), 2),
-                'volumen_excedente_litros': round(results['excedente_volumen_litros'].sum(), 2)
             }
         }
+    
+    @staticmethod
+    def _risk_slug(level):
+        """Nombre de nivel sin tildes ni mayúsculas (p.ej. 'Precaución' -> 'precaucion')"""
+        return level.lower().replace('ó', 'o')
+    
+    def find_nearest_zones(self, lat, lon, k=5):
+        """
+        Las k zonas más cercanas a un punto (distancia de gran círculo)
         
-        return results, summary
+        Retorna una lista de {'nombre', 'latitud', 'longitud', 'distancia_km'}
+        ordenada de menor a mayor distancia
+        """
+        lat, lon, k = float(lat), float(lon), int(k)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Coordenadas inválidas: {lat}, {lon}")
+        if k < 1:
+            raise ValueError("'k' debe ser mayor que cero")
+        return [
+            {'nombre': name, 'latitud': zlat, 'longitud': zlon, 'distancia_km': round(dist, 3)}
+            for name, zlat, zlon, dist in self.spatial_index.nearest(lat, lon, k)
+        ]
+    
+    def get_zones_in_bbox(self, min_lon, min_lat, max_lon, max_lat, state=None):
+        """
+        Nombres de las zonas dentro de un rectángulo de coordenadas (bordes
+        incluidos), del ZoneState indicado o del publicado
+        """
+        spatial_index = (state or self._state).spatial_index
+        return spatial_index.bbox(float(min_lon), float(min_lat), float(max_lon), float(max_lat))
+    
+    def record_zone_risk(self, zone_name, level):
+        """Registra el nivel de riesgo (nombre) de la simulación más reciente de una zona"""
+        self.cluster_index.set_risk(zone_name, RISK_LEVELS.index(level))
+    
+    def get_zone_clusters(self, min_lon, min_lat, max_lon, max_lat, zoom):
+        """
+        Zonas agrupadas para mostrar en el mapa con el nivel de zoom indicado
+        
+        Retorna una lista de grupos {'latitud', 'longitud', 'zonas' (cantidad),
+        'nivel_riesgo' (peor riesgo simulado entre sus zonas, o None) y 'zona'
+        (nombre, solo si el grupo tiene una única zona)}, cuyo centroide está
+        dentro del rectángulo
+        """
+        clusters = []
+        for lat, lon, count, risk, name in self.cluster_index.clusters(
+                float(min_lon), float(min_lat), float(max_lon), float(max_lat), zoom):
+            cluster = {
+                'latitud': lat,
+                'longitud': lon,
+                'zonas': count,
+                'nivel_riesgo': RISK_LEVELS[risk] if risk >= 0 else None
+            }
+            if name is not None:
+                cluster['zona'] = name
+            clusters.append(cluster)
+        return clusters
     
-    def get_zones_list(self):
-        """Retorna lista de zonas disponibles con sus estadísticas"""
+    def iter_zone_names(self, after=None, names=None, state=None):
+        """
+        Nombres de zona en el orden del libro, empezando después de after
+        (paginación por cursor). Si se pasa names (en ese mismo orden), solo
+        se recorren esos. Lanza ValueError si after ya no existe.
+        
+        Con state, se recorre ese ZoneState en lugar del publicado
+        """
+        state = state or self._state
+        if names is None:
+            names = state.zone_index
+        if after is None:
+            return iter(names)
+        start = state.zone_positions.get(after)
+        if start is None:
+            raise ValueError(f"Cursor inválido: la zona '{after}' ya no existe")
+        if names is state.zone_index:
+            return islice(names, start + 1, None)
+        positions = state.zone_positions
+        return (name for name in names if positions[name] > start)
+    
+    def get_zones_list(self, after=None, limit=None):
+        """
+        Retorna lista de zonas disponibles con sus estadísticas
+        
+        En modo perezoso, las zonas aún no procesadas se reportan con 0 días
+        
+        Args:
+            after: Nombre de la última zona de la página anterior (cursor)
+            limit: Máximo de zonas a retornar (None = todas)
+        """
         zones_info = []
-        for name, data in self.zones_data.items():
+        state = self._state
+        names = islice(self.iter_zone_names(after, state=state), limit)
+        for name in names:
+            index = state.zone_index[name]
+            data = state.zones_data.peek(name, index) if self.lazy else state.zones_data[name]
             zones_info.append({
                 'nombre': name,
                 'latitud': data['latitude'],
@@ -334,31 +2170,48 @@ class DrainageSimulationModel:
             })
         return zones_info
     
-    def export_results(self, results, summary, output_file='resultados_simulacion.xlsx'):
-        """Exporta resultados a Excel"""
-        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-            # Hoja de resumen
-            summary_flat = {
-                'zona': summary['zona'],
-                'latitud': summary['latitud'],
-                'longitud': summary['longitud'],
-                'dias_historicos': summary['datos_historicos']['total_dias'],
-                'lluvia_historica_total': summary['datos_historicos']['lluvia_total_historica'],
-                'lluvia_historica_max': summary['datos_historicos']['lluvia_maxima_historica'],
-                'lluvia_simulada_total': summary['simulacion']['total_lluvia_mm'],
-                'excedente_total': summary['simulacion']['excedente_total_mm'],
-                'nivel_riesgo_max': summary['simulacion']['max_nivel_riesgo']
-            }
-            summary_df = pd.DataFrame([summary_flat])
-            summary_df.to_excel(writer, sheet_name='Resumen', index=False)
-            
-            # Hoja de resultados detallados
-            results.to_excel(writer, sheet_name='Detalle_Horario', index=False)
-            
-            # Hoja de datos históricos
-            if summary['zona'] in self.zones_data:
-                historical = self.zones_data[summary['zona']]['historical_data']
-                historical.to_excel(writer, sheet_name='Datos_Historicos', index=False)
+    def export_tables(self, results, summary, include_history=True):
+        """
+        Tablas (nombre, DataFrame) de la exportación: resumen, detalle horario
+        y, si include_history es True, los datos históricos de la zona
+        """
+        summary_flat = {
+            'zona': summary['zona'],
+            'latitud': summary['latitud'],
+            'longitud': summary['longitud'],
+            'dias_historicos': summary['datos_historicos']['total_dias'],
+            'lluvia_historica_total': summary['datos_historicos']['lluvia_total_historica'],
+            'lluvia_historica_max': summary['datos_historicos']['lluvia_maxima_historica'],
+            'lluvia_simulada_total': summary['simulacion']['total_lluvia_mm'],
+            'excedente_total': summary['simulacion']['excedente_total_mm'],
+            'nivel_riesgo_max': summary['simulacion']['max_nivel_riesgo']
+        }
+        tables = [
+            ('Resumen', pd.DataFrame([summary_flat])),
+            ('Detalle_Horario', results)
+        ]
+        state = self._state
+        if include_history and summary['zona'] in state.zone_index:
+            tables.append(('Datos_Historicos', self._get_zone(summary['zona'], state)['historical_data']))
+        return tables
+    
+    def iter_export(self, results, summary, fmt='xlsx', include_history=True):
+        """
+        Genera el archivo de exportación por bloques de bytes, para enviarlo
+        sin armarlo completo en memoria
+        
+        Args:
+            fmt: 'xlsx', 'csv' (ZIP de CSV) o 'parquet' (ZIP de Parquet, requiere pyarrow)
+            include_history: Si False, se omite la hoja de datos históricos
+        """
+        return result_export.iter_tables(self.export_tables(results, summary, include_history), fmt)
+    
+    @metrics.timed('export')
+    def export_results(self, results, summary, output_file='resultados_simulacion.xlsx',
+                       fmt='xlsx', include_history=True):
+        """Exporta resultados a un archivo (Excel por defecto; ver iter_export)"""
+        result_export.write_tables(self.export_tables(results, summary, include_history),
+                                   output_file, fmt)
 
 
 # Ejemplo de uso
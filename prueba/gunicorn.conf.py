@@ -0,0 +1,39 @@
+"""
+Configuración de gunicorn (ver Procfile)
+
+El proceso maestro prepara los datos una sola vez, antes de crear los
+workers: descarga DATA_FILE si es una URL y procesa el libro en la caché
+columnar (o valida la existente). Los workers heredan DATA_FILE apuntando
+al libro local y DATA_MMAP=1, de modo que al importar web_drainage_app
+mapean la caché en memoria en lugar de procesar el Excel: cada worker
+arranca casi de inmediato y las series de lluvia ocupan memoria una sola
+vez, compartida por todos (ver zone_cache.read_columnar).
+
+El número de workers se toma de WEB_CONCURRENCY (o --workers), como de
+costumbre en gunicorn. Con DATA_LAZY=1 no se genera la caché (cada worker
+procesa las hojas bajo demanda) y con DATA_MMAP=0 cada worker carga su
+propia copia de los datos.
+"""
+
+import os
+
+
+def on_starting(server):
+    # Importar aquí mantiene la lectura de este archivo independiente del
+    # directorio de la aplicación (--chdir se aplica después de leerlo)
+    import zone_cache
+    from drainage_model import DrainageSimulationModel
+
+    data_file = zone_cache.fetch_workbook(os.environ.get('DATA_FILE', 'datos.xlsx'))
+    os.environ['DATA_FILE'] = os.path.abspath(data_file)
+
+    if os.environ.get('DATA_LAZY', '0') == '1':
+        return
+    os.environ.setdefault('DATA_MMAP', '1')
+    if os.environ['DATA_MMAP'] != '1':
+        return
+
+    # El modelo del maestro solo genera o valida la caché; se descarta al terminar
+    model = DrainageSimulationModel(data_file, mmap_cache=True)
+    server.log.info(f"Caché de {len(model.zone_index)} zonas lista en {model.load_seconds:.2f} s "
+                    f"({zone_cache.cache_path(data_file)})")
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Estados de un trabajo
+PENDING = 'pendiente'
+RUNNING = 'en_progreso'
+DONE = 'completado'
+FAILED = 'error'
+CANCELLED = 'cancelado'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    result BLOB,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner INTEGER NOT NULL,
+    cancel INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Columnas que se leen para un trabajo (el resultado se lee aparte)
+_COLUMNS = 'id, kind, params, status, progress, error, created_at, started_at, finished_at, owner'
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro de un trabajo en curso cuando se solicitó su cancelación"""
+
+
+class QueueFull(Exception):
+    """No se aceptan más trabajos hasta que terminen los pendientes"""
+
+
+def _process_alive(pid):
+    """Indica si existe un proceso con ese pid en esta máquina"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Existe pero pertenece a otro usuario
+        return True
+    return True
+
+
+class Job:
+    """
+    Estado de un trabajo en segundo plano
+
+    La función del trabajo recibe la instancia y llama a report(fracción)
+    para informar el avance; report lanza JobCancelled si se pidió cancelar,
+    de modo que la cancelación de un trabajo en curso es cooperativa.
+
+    El estado vive en el almacén de la cola (ver JobQueue): las instancias
+    que retornan get y list son una foto del trabajo en ese momento.
+    """
+
+    def __init__(self, kind, params=None, queue=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = PENDING
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.owner = os.getpid()
+        self._queue = queue
+
+    @classmethod
+    def _from_row(cls, queue, row, result=None):
+        job = cls.__new__(cls)
+        (job.id, job.kind, params, job.status, job.progress, job.error,
+         job.created_at, job.started_at, job.finished_at, job.owner) = row
+        job.params = json.loads(params)
+        job.result = result
+        job._queue = queue
+        return job
+
+    def report(self, progress):
+        """Actualiza el avance (0-1) y comprueba si el trabajo fue cancelado"""
+        progress = min(max(float(progress), 0.0), 1.0)
+        if not self._queue._report(self.id, progress):
+            raise JobCancelled()
+        self.progress = progress
+
+    @property
+    def cancel_requested(self):
+        return self._queue._cancel_requested(self.id)
+
+    def to_dict(self, include_result=True):
+        info = {
+            'id': self.id,
+            'tipo': self.kind,
+            'estado': self.status,
+            'progreso': round(self.progress, 4),
+            'creado': self.created_at,
+            'iniciado': self.started_at,
+            'finalizado': self.finished_at
+        }
+        if self.error is not None:
+            info['error'] = self.error
+        if include_result and self.status == DONE:
+            info['resultado'] = self.result
+        return info
+
+
+class JobQueue:
+    """
+    Cola de trabajos sin intermediarios externos
+
+    Los trabajos se ejecutan en un pool de max_workers hilos del proceso que
+    los recibe (concurrencia acotada por proceso). Su estado, avance y
+    resultado se guardan en una base SQLite (path) que comparten todos los
+    procesos que la abren: con varios workers de gunicorn cualquiera de ellos
+    puede consultar o cancelar un trabajo. Como mucho se admiten max_pending
+    trabajos sin terminar entre todos; los terminados se conservan
+    ttl_seconds para consultar su resultado y luego se descartan. Los
+    trabajos de un proceso que terminó sin completarlos quedan como fallidos.
+
+    Sin path se usa un archivo temporal propio de la instancia.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, ttl_seconds=3600, path=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='jobs-', suffix='.sqlite')
+            os.close(fd)
+        self.path = path
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            # WAL: las consultas de otros procesos no esperan a las escrituras
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+        # Futuros de los trabajos que ejecuta este proceso
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    def submit(self, kind, fn, *args, params=None):
+        """
+        Encola fn(job, *args); su valor de retorno queda en job.result
+
+        Lanza QueueFull si ya hay max_pending trabajos sin terminar.
+        """
+        job = Job(kind, params, self)
+        with self._connect() as conn:
+            with self._transaction(conn):
+                self._maintain(conn)
+                active = conn.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)',
+                                      (PENDING, RUNNING)).fetchone()[0]
+                if active >= self.max_pending:
+                    raise QueueFull(f"Cola llena: {active} trabajos sin terminar (máximo {self.max_pending})")
+                conn.execute('INSERT INTO jobs (id, kind, params, status, created_at, owner) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (job.id, kind, json.dumps(job.params, default=str), PENDING,
+                              job.created_at, job.owner))
+        with self._lock:
+            self._futures[job.id] = self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            self._maintain(conn)
+            row = conn.execute(f'SELECT {_COLUMNS}, result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        result = pickle.loads(row[-1]) if row[-1] is not None else None
+        return Job._from_row(self, row[:-1], result)
+
+    def cancel(self, job_id):
+        """
+        Cancela un trabajo, lo ejecute este proceso u otro. Los pendientes no
+        llegan a ejecutarse; los que están en curso se detienen en su
+        siguiente llamada a report.
+        Retorna el trabajo, o None si no existe.
+        """
+        with self._connect() as conn:
+            with self._transaction(conn):
+                conn.execute('UPDATE jobs SET cancel = 1 WHERE id = ? AND status IN (?, ?)',
+                             (job_id, PENDING, RUNNING))
+                conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+                             (CANCELLED, time.time(), job_id, PENDING))
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            # Libera el lugar en el pool si aún no empezó
+            future.cancel()
+        return self.get(job_id)
+
+    def list(self):
+        with self._connect() as conn:
+            self._maintain(conn)
+            rows = conn.execute(f'SELECT {_COLUMNS} FROM jobs ORDER BY created_at').fetchall()
+        return [Job._from_row(self, row) for row in rows]
+
+    def stats(self):
+        """Cantidad de trabajos por estado"""
+        counts = {state: 0 for state in (PENDING, RUNNING) + FINISHED_STATES}
+        for job in self.list():
+            counts[job.status] += 1
+        return {'trabajadores': self.max_workers, 'max_pendientes': self.max_pending,
+                'ttl_segundos': self.ttl_seconds, 'trabajos': counts}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job, fn, args):
+        try:
+            with self._connect() as conn:
+                started = conn.execute(
+                    'UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ? AND cancel = 0',
+                    (RUNNING, time.time(), job.id, PENDING)).rowcount
+            if not started:
+                # Cancelado (o dado por fallido) antes de empezar
+                return
+            job.status = RUNNING
+            try:
+                result = pickle.dumps(fn(job, *args), protocol=pickle.HIGHEST_PROTOCOL)
+            except JobCancelled:
+                self._finish(job.id, CANCELLED)
+            except Exception as e:
+                self._finish(job.id, FAILED, error=str(e))
+            else:
+                self._finish(job.id, DONE, result=result)
+        finally:
+            with self._lock:
+                self._futures.pop(job.id, None)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        now = time.time()
+        with self._connect() as conn:
+            if status == DONE:
+                done = conn.execute(
+                    'UPDATE jobs SET status = ?, progress = 1, result = ?, finished_at = ? '
+                    'WHERE id = ? AND cancel = 0', (DONE, result, now, job_id)).rowcount
+                if done:
+                    return
+                # Se pidió cancelar después del último report: se descarta el resultado
+                status = CANCELLED
+            conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?',
+                         (status, error, now, job_id))
+
+    def _report(self, job_id, progress):
+        """Guarda el avance; retorna False si se pidió cancelar el trabajo"""
+        with self._connect() as conn:
+            return conn.execute('UPDATE jobs SET progress = ? WHERE id = ? AND cancel = 0',
+                                (progress, job_id)).rowcount > 0
+
+    def _cancel_requested(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT cancel FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def _maintain(self, conn):
+        """
+        Descarta los trabajos terminados hace más de ttl_seconds y da por
+        fallidos los que quedaron sin terminar en procesos que ya no existen
+        """
+        now = time.time()
+        conn.execute('DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?',
+                     FINISHED_STATES + (now - self.ttl_seconds,))
+        owners = conn.execute('SELECT DISTINCT owner FROM jobs WHERE status IN (?, ?) AND owner != ?',
+                              (PENDING, RUNNING, os.getpid())).fetchall()
+        for (owner,) in owners:
+            if not _process_alive(owner):
+                conn.execute('UPDATE jobs SET status = ?, error = ?, finished_at = ? '
+                             'WHERE owner = ? AND status IN (?, ?)',
+                             (FAILED, "El proceso que ejecutaba el trabajo terminó", now,
+                              owner, PENDING, RUNNING))
+
+    @contextmanager
+    def _connect(self):
+        # Una conexión por operación: se usan desde varios hilos y procesos
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
@@ -0,0 +1,222 @@
+"""
+Métricas de rendimiento en formato de texto de Prometheus
+
+Histogramas de latencia, contadores y medidores en memoria del proceso.
+Mientras las métricas están desactivadas (por defecto), stage() y timed()
+solo comprueban una bandera global, de modo que instrumentar el código
+de uso frecuente no tiene un costo apreciable.
+
+    import metrics
+    metrics.enable()
+
+    with metrics.stage('summary'):
+        ...
+
+    @metrics.timed('simulate')
+    def simulate_rainfall(...):
+        ...
+
+    metrics.render()  # texto para el endpoint /metrics
+"""
+
+import math
+import time
+import bisect
+import threading
+import functools
+
+# Límites (segundos) de los histogramas de latencia
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_enabled = False
+_lock = threading.Lock()
+_metrics = {}
+
+
+def enable(flag=True):
+    """Activa (o desactiva) la recolección de métricas"""
+    global _enabled
+    _enabled = bool(flag)
+
+
+def is_enabled():
+    return _enabled
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, labels, value):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # etiquetas -> [conteos por cubeta..., +Inf, suma]
+
+    def observe(self, labels, value):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for labels, counts in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', _format_value(bound)),), cumulative
+            yield f'{self.name}_sum', labels, counts[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+
+def _metric(cls, name, help_text):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = cls(name, help_text)
+    return metric
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, help_text='', **labels):
+    """Registra una duración en el histograma name"""
+    if not _enabled:
+        return
+    with _lock:
+        _metric(Histogram, name, help_text).observe(_labels(labels), seconds)
+
+
+def inc(name, amount=1, help_text='', **labels):
+    """Incrementa el contador name"""
+    if not _enabled:
+        return
+    with _lock:
+        _metric(Counter, name, help_text).inc(_labels(labels), amount)
+
+
+def set_gauge(name, value, help_text='', **labels):
+    """Fija el valor del medidor name"""
+    if not _enabled:
+        return
+    with _lock:
+        _metric(Gauge, name, help_text).set(_labels(labels), value)
+
+
+STAGE_METRIC = 'drainage_stage_seconds'
+STAGE_HELP = 'Duración de cada etapa del modelo de drenaje'
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(STAGE_METRIC, time.perf_counter() - self.start, STAGE_HELP, stage=self.name)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """Context manager que mide un bloque como etapa name de drainage_stage_seconds"""
+    return _Stage(name) if _enabled else _NULL_STAGE
+
+
+def timed(name):
+    """Decorador: mide cada llamada a la función como etapa name"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(STAGE_METRIC, time.perf_counter() - start, STAGE_HELP, stage=name)
+        return wrapper
+    return decorator
+
+
+def reset():
+    """Descarta todas las métricas registradas"""
+    with _lock:
+        _metrics.clear()
+
+
+def render():
+    """Todas las métricas en el formato de texto de exposición de Prometheus"""
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Caché LRU con expiración (TTL) para respuestas de simulación
+
+    Segura para hilos. Lleva la cuenta de aciertos, fallos, desalojos y
+    expiraciones para poder dimensionarla (ver stats).
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < now:
+                del self._items[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Contadores de uso de la caché"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entradas': len(self._items),
+                'max_entradas': self.max_entries,
+                'ttl_segundos': self.ttl_seconds,
+                'aciertos': self.hits,
+                'fallos': self.misses,
+                'tasa_aciertos': round(self.hits / lookups, 4) if lookups else 0.0,
+                'desalojos': self.evictions,
+                'expiraciones': self.expirations
+            }
@@ -0,0 +1,254 @@
+"""
+Exportación de resultados de simulación en varios formatos
+
+Cada formato se genera por bloques de bytes (iter_tables), de modo que
+puede escribirse a disco o enviarse al cliente sin armar el archivo
+completo en memoria:
+
+- 'xlsx': libro de Excel con una hoja por tabla. El XML de las hojas se
+  escribe directamente por bloques de filas (como zone_cache lo lee),
+  sin pasar por las celdas de openpyxl.
+- 'csv': ZIP con un CSV (UTF-8) por tabla.
+- 'parquet': ZIP con un archivo Parquet por tabla (requiere pyarrow).
+
+Los ZIP se escriben en forma secuencial (tamaños y CRC al final de cada
+entrada), así cada bloque puede enviarse apenas se genera. Las tablas se
+pasan como pares (nombre, DataFrame) en el orden en que deben aparecer.
+"""
+
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional
+    pyarrow = None
+
+# Filas por bloque al convertir y escribir cada tabla
+EXPORT_CHUNK_ROWS = 20000
+# Nivel de compresión de los ZIP: se prioriza la velocidad sobre el tamaño
+EXPORT_COMPRESS_LEVEL = 1
+
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+    'csv': ('application/zip', '.zip'),
+    'parquet': ('application/zip', '.zip'),
+}
+
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'us')
+ONE_DAY = np.timedelta64(1, 'D')
+
+
+def check_format(fmt):
+    """Valida el formato; retorna (tipo MIME, extensión del archivo)"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt} "
+                         f"(disponibles: {', '.join(EXPORT_FORMATS)})")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("La exportación a Parquet requiere el paquete pyarrow")
+    return EXPORT_FORMATS[fmt]
+
+
+def iter_tables(tables, fmt='xlsx'):
+    """Genera el archivo de tables en el formato fmt como bloques de bytes"""
+    check_format(fmt)
+    tables = list(tables)
+    if fmt == 'xlsx':
+        return _iter_zip(_xlsx_entries(tables), zipfile.ZIP_DEFLATED)
+    if fmt == 'csv':
+        return _iter_zip([(name + '.csv', _write_csv, frame) for name, frame in tables],
+                         zipfile.ZIP_DEFLATED)
+    # Parquet ya viene comprimido
+    return _iter_zip([(name + '.parquet', _write_parquet, frame) for name, frame in tables],
+                     zipfile.ZIP_STORED)
+
+
+def write_tables(tables, output_file, fmt='xlsx'):
+    """Escribe el archivo de tables en output_file"""
+    with open(output_file, 'wb') as f:
+        for block in iter_tables(tables, fmt):
+            f.write(block)
+
+
+class _ByteSink:
+    """Destino sin posicionamiento para zipfile: acumula lo escrito hasta drain()"""
+
+    def __init__(self):
+        self.blocks = []
+
+    def write(self, data):
+        self.blocks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.blocks)
+        self.blocks.clear()
+        return data
+
+
+def _iter_zip(entries, compression):
+    """
+    ZIP con una entrada por (nombre, escritor, datos); el escritor es un
+    generador que escribe datos en la entrada y cede tras cada bloque
+    """
+    sink = _ByteSink()
+    with zipfile.ZipFile(sink, 'w', compression=compression, compresslevel=EXPORT_COMPRESS_LEVEL) as archive:
+        for name, write_entry, data in entries:
+            with archive.open(name, 'w') as entry:
+                for _ in write_entry(data, entry):
+                    block = sink.drain()
+                    if block:
+                        yield block
+    yield sink.drain()
+
+
+def _chunks(frame):
+    for start in range(0, max(len(frame), 1), EXPORT_CHUNK_ROWS):
+        yield start, frame.iloc[start:start + EXPORT_CHUNK_ROWS]
+
+
+def _write_csv(frame, entry):
+    for start, chunk in _chunks(frame):
+        entry.write(chunk.to_csv(header=start == 0, index=False, lineterminator='\n').encode('utf-8'))
+        yield
+
+
+def _write_parquet(frame, entry):
+    schema = pyarrow.Schema.from_pandas(frame, preserve_index=False)
+    with pq.ParquetWriter(entry, schema) as writer:
+        for _, chunk in _chunks(frame):
+            writer.write_table(pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield
+
+
+def _write_bytes(data, entry):
+    entry.write(data)
+    yield
+
+
+# --- XLSX ---
+
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Estilos: 0 = normal, 1 = fecha y hora, 2 = encabezado en negrita
+_STYLE_DATETIME = 1
+_STYLE_HEADER = 2
+_STYLES_XML = (
+    _XML_DECL +
+    f'<styleSheet xmlns="{_MAIN_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _xlsx_entries(tables):
+    """Partes del paquete XLSX: las hojas primero y luego las que las enumeran"""
+    entries = [(f'xl/worksheets/sheet{i}.xml', _write_sheet, frame)
+               for i, (_, frame) in enumerate(tables, 1)]
+
+    sheets = ''.join(f'<sheet name={quoteattr(name[:31])} sheetId="{i}" r:id="rId{i}"/>'
+                     for i, (name, _) in enumerate(tables, 1))
+    workbook = f'{_XML_DECL}<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheets>{sheets}</sheets></workbook>'
+
+    rels = ''.join(f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                   for i in range(1, len(tables) + 1))
+    rels += f'<Relationship Id="rId{len(tables) + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+    workbook_rels = f'{_XML_DECL}<Relationships xmlns="{_PKG_REL_NS}">{rels}</Relationships>'
+
+    package_rels = (f'{_XML_DECL}<Relationships xmlns="{_PKG_REL_NS}">'
+                    f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+                    '</Relationships>')
+
+    ct = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+    overrides = ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{ct}.worksheet+xml"/>'
+                        for i in range(1, len(tables) + 1))
+    content_types = (
+        f'{_XML_DECL}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/xl/workbook.xml" ContentType="{ct}.sheet.main+xml"/>'
+        f'<Override PartName="/xl/styles.xml" ContentType="{ct}.styles+xml"/>'
+        f'{overrides}</Types>'
+    )
+
+    parts = [
+        ('xl/workbook.xml', workbook),
+        ('xl/_rels/workbook.xml.rels', workbook_rels),
+        ('xl/styles.xml', _STYLES_XML),
+        ('_rels/.rels', package_rels),
+        ('[Content_Types].xml', content_types),
+    ]
+    return entries + [(name, _write_bytes, xml.encode('utf-8')) for name, xml in parts]
+
+
+def _column_letter(index):
+    """Letra de columna de Excel (0 -> A, 26 -> AA)"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _sheet_cells(column, letter, first_row):
+    """Celdas XML (sin la fila) de una columna; las vacías quedan como ''"""
+    kind = column.dtype.kind
+    rows = range(first_row, first_row + len(column))
+    if kind == 'M':
+        serials = (column.to_numpy().astype('datetime64[us]') - EXCEL_EPOCH) / ONE_DAY
+        return [f'<c r="{letter}{r}" s="{_STYLE_DATETIME}"><v>{v!r}</v></c>' if v == v else ''
+                for r, v in zip(rows, serials.tolist())]
+    if kind == 'b':
+        return [f'<c r="{letter}{r}" t="b"><v>{int(v)}</v></c>' for r, v in zip(rows, column.tolist())]
+    if kind in 'iu':
+        return [f'<c r="{letter}{r}"><v>{v}</v></c>' for r, v in zip(rows, column.tolist())]
+    if kind == 'f':
+        # NaN e infinitos no son valores válidos de Excel: la celda queda vacía
+        return [f'<c r="{letter}{r}"><v>{v!r}</v></c>' if v - v == 0 else ''
+                for r, v in zip(rows, column.tolist())]
+    return [_text_cell(letter, r, v) for r, v in zip(rows, column.tolist())]
+
+
+def _text_cell(letter, row, value):
+    if value is None or value != value:
+        return ''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{letter}{row}"><v>{value!r}</v></c>'
+    return f'<c r="{letter}{row}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _write_sheet(frame, entry):
+    letters = [_column_letter(i) for i in range(len(frame.columns))]
+    header = ''.join(f'<c r="{letter}1" s="{_STYLE_HEADER}" t="inlineStr"><is><t>{escape(str(name))}</t></is></c>'
+                     for letter, name in zip(letters, frame.columns))
+    entry.write(f'{_XML_DECL}<worksheet xmlns="{_MAIN_NS}"><sheetData>'
+                f'<row r="1">{header}</row>'.encode('utf-8'))
+    for start, chunk in _chunks(frame):
+        first_row = start + 2
+        columns = [_sheet_cells(column, letter, first_row)
+                   for letter, (_, column) in zip(letters, chunk.items())]
+        rows = (f'<row r="{r}">{"".join(cells)}</row>'
+                for r, cells in enumerate(zip(*columns), first_row))
+        entry.write(''.join(rows).encode('utf-8'))
+        yield
+    entry.write(b'</sheetData></worksheet>')
@@ -0,0 +1,348 @@
+"""
+Índice espacial de zonas en una rejilla regular de latitud/longitud
+
+Cada zona se asigna a una celda de cell_deg x cell_deg grados; las zonas se
+guardan ordenadas por celda, de modo que cada celda es un tramo contiguo de
+los arreglos. Las búsquedas recorren solo las celdas cercanas:
+
+- nearest: anillos de celdas alrededor del punto hasta que ninguna zona
+  fuera de los anillos revisados pueda estar más cerca (cota con haversine);
+  si el punto está lejos de los datos (muchos anillos vacíos), se ordenan
+  directamente las celdas ocupadas por su distancia mínima posible
+- bbox: las celdas que cubren el rectángulo, o un filtro vectorizado sobre
+  todas las zonas si el rectángulo abarca más celdas de las que hay ocupadas
+
+No considera el cruce del antimeridiano (longitud ±180).
+"""
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+# Zonas por celda buscadas al elegir el tamaño de la rejilla
+TARGET_ZONES_PER_CELL = 4
+MIN_CELL_DEG = 1e-4
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distancia de gran círculo en km (acepta arreglos NumPy)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class ZoneGridIndex:
+    """
+    Índice de vecinos más cercanos y de rectángulos sobre las zonas
+
+    Args:
+        names: Nombres de zona
+        lats, lons: Coordenadas en grados (mismo orden que names)
+        cell_deg: Tamaño de celda en grados (None = automático según la densidad)
+    """
+
+    def __init__(self, names, lats, lons, cell_deg=None):
+        names = np.asarray(list(names), dtype=object)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        self.size = len(names)
+
+        if cell_deg is None:
+            cell_deg = self._auto_cell_size(lats, lons)
+        self.cell_deg = float(cell_deg)
+
+        if self.size:
+            self.lat0 = float(lats.min())
+            self.lon0 = float(lons.min())
+            # Mayor |latitud| de los datos: cota para el factor cos(lat) de haversine
+            self.max_abs_lat = float(np.abs(lats).max())
+        else:
+            self.lat0 = self.lon0 = self.max_abs_lat = 0.0
+
+        rows = np.floor((lats - self.lat0) / self.cell_deg).astype(np.int64)
+        cols = np.floor((lons - self.lon0) / self.cell_deg).astype(np.int64)
+        self.n_rows = int(rows.max()) + 1 if self.size else 0
+        self.n_cols = int(cols.max()) + 1 if self.size else 0
+
+        keys = rows * max(self.n_cols, 1) + cols
+        order = np.argsort(keys, kind='stable')
+        self.names = names[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.positions = order  # posición original de cada zona
+
+        # Tramo [inicio, fin) de cada celda ocupada
+        keys = keys[order]
+        cell_keys, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], self.size)
+        self.cells = {int(k): (int(s), int(e)) for k, s, e in zip(cell_keys, starts, ends)}
+        # Celdas ocupadas como arreglos, para la búsqueda por cotas
+        self.cell_rows, self.cell_cols = np.divmod(cell_keys, max(self.n_cols, 1))
+        self.cell_starts = starts
+        self.cell_ends = ends
+
+    @classmethod
+    def from_zone_index(cls, zone_index, cell_deg=None):
+        """Construye el índice desde DrainageSimulationModel.zone_index"""
+        names = list(zone_index)
+        lats = np.fromiter((zone_index[n]['latitude'] for n in names), dtype=float, count=len(names))
+        lons = np.fromiter((zone_index[n]['longitude'] for n in names), dtype=float, count=len(names))
+        return cls(names, lats, lons, cell_deg)
+
+    @staticmethod
+    def _auto_cell_size(lats, lons):
+        if len(lats) < 2:
+            return 1.0
+        area = max(np.ptp(lats), MIN_CELL_DEG) * max(np.ptp(lons), MIN_CELL_DEG)
+        return max(float(np.sqrt(area * TARGET_ZONES_PER_CELL / len(lats))), MIN_CELL_DEG)
+
+    def __len__(self):
+        return self.size
+
+    def _cell_of(self, lat, lon):
+        return (int(np.floor((lat - self.lat0) / self.cell_deg)),
+                int(np.floor((lon - self.lon0) / self.cell_deg)))
+
+    def _ring_slices(self, row, col, radius):
+        """Tramos de las celdas ocupadas en el anillo de radio radius"""
+        n_cols = self.n_cols
+        r_lo, r_hi = max(row - radius, 0), min(row + radius, self.n_rows - 1)
+        c_lo, c_hi = max(col - radius, 0), min(col + radius, n_cols - 1)
+        cells = self.cells
+        for r in range(r_lo, r_hi + 1):
+            if radius and r - row not in (-radius, radius):
+                # Filas intermedias: solo las columnas de los bordes del anillo
+                for c in (col - radius, col + radius):
+                    if 0 <= c < n_cols and (r * n_cols + c) in cells:
+                        yield cells[r * n_cols + c]
+                continue
+            for c in range(c_lo, c_hi + 1):
+                span = cells.get(r * n_cols + c)
+                if span is not None:
+                    yield span
+
+    def _outside_bound_km(self, lat, lon, row, col, radius):
+        """
+        Cota inferior de la distancia desde (lat, lon) a cualquier zona fuera
+        de las celdas a distancia <= radius de (row, col)
+        """
+        lat_lo = self.lat0 + (row - radius) * self.cell_deg
+        lat_hi = self.lat0 + (row + radius + 1) * self.cell_deg
+        lon_lo = self.lon0 + (col - radius) * self.cell_deg
+        lon_hi = self.lon0 + (col + radius + 1) * self.cell_deg
+        gap_lat = np.radians(min(lat - lat_lo, lat_hi - lat))
+        gap_lon = np.radians(min(lon - lon_lo, lon_hi - lon))
+        # hav(d) >= hav(dlat) y hav(d) >= cos(lat1) cos(lat2) hav(dlon)
+        cos_factor = np.cos(np.radians(lat)) * np.cos(np.radians(self.max_abs_lat))
+        hav = min(np.sin(gap_lat / 2) ** 2, cos_factor * np.sin(gap_lon / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(min(max(hav, 0.0), 1.0)))
+
+    def nearest(self, lat, lon, k=5):
+        """
+        Las k zonas más cercanas a (lat, lon)
+
+        Retorna una lista de (nombre, latitud, longitud, distancia_km) ordenada
+        por distancia
+        """
+        k = min(int(k), self.size)
+        if k <= 0:
+            return []
+
+        row, col = self._cell_of(lat, lon)
+        # Radio desde el que los anillos ya cubren toda la rejilla
+        max_radius = max(abs(row), abs(row - self.n_rows + 1), abs(col), abs(col - self.n_cols + 1))
+
+        spans = []
+        found = 0
+        radius = 0
+        while True:
+            if (2 * radius + 1) ** 2 > len(self.cells):
+                # Más celdas por revisar que celdas ocupadas
+                return self._nearest_by_cell_bounds(lat, lon, k)
+            for span in self._ring_slices(row, col, radius):
+                spans.append(span)
+                found += span[1] - span[0]
+            if found >= k:
+                idx = np.concatenate([np.arange(s, e) for s, e in spans])
+                dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+                kth = np.partition(dist, k - 1)[k - 1]
+                if radius >= max_radius or kth <= self._outside_bound_km(lat, lon, row, col, radius):
+                    break
+            radius += 1
+
+        return self._closest(idx, dist, k)
+
+    def _nearest_by_cell_bounds(self, lat, lon, k):
+        """nearest recorriendo las celdas ocupadas en orden de distancia mínima posible"""
+        lat_lo = self.lat0 + self.cell_rows * self.cell_deg
+        lon_lo = self.lon0 + self.cell_cols * self.cell_deg
+        gap_lat = np.radians(np.maximum(np.maximum(lat_lo - lat, lat - (lat_lo + self.cell_deg)), 0))
+        gap_lon = np.radians(np.maximum(np.maximum(lon_lo - lon, lon - (lon_lo + self.cell_deg)), 0))
+        # hav(d) = hav(dlat) + cos(lat1) cos(lat2) hav(dlon), con cos(lat2) >= cos(max |lat|)
+        cos_factor = np.cos(np.radians(lat)) * np.cos(np.radians(self.max_abs_lat))
+        hav = np.sin(gap_lat / 2) ** 2 + cos_factor * np.sin(gap_lon / 2) ** 2
+        bounds = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(hav, 1.0)))
+
+        order = np.argsort(bounds, kind='stable')
+        counts = np.cumsum(self.cell_ends[order] - self.cell_starts[order])
+        # Primeras celdas que juntan k zonas; luego, todas las que podrían mejorar la k-ésima
+        first = int(np.searchsorted(counts, k)) + 1
+        for _ in range(2):
+            cells = order[:first]
+            idx = np.concatenate([np.arange(s, e) for s, e in zip(self.cell_starts[cells], self.cell_ends[cells])])
+            dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+            kth = np.partition(dist, k - 1)[k - 1]
+            first = max(first, int(np.searchsorted(bounds[order], kth, side='right')))
+            if first == len(cells):
+                break
+        return self._closest(idx, dist, k)
+
+    def _closest(self, idx, dist, k):
+        best = np.argsort(dist, kind='stable')[:k]
+        return [(self.names[idx[i]], float(self.lats[idx[i]]), float(self.lons[idx[i]]), float(dist[i]))
+                for i in best]
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Nombres de las zonas dentro del rectángulo (bordes incluidos), en el orden original"""
+        if not self.size or min_lat > max_lat or min_lon > max_lon:
+            return []
+        r_lo, c_lo = self._cell_of(min_lat, min_lon)
+        r_hi, c_hi = self._cell_of(max_lat, max_lon)
+        r_lo, c_lo = max(r_lo, 0), max(c_lo, 0)
+        r_hi, c_hi = min(r_hi, self.n_rows - 1), min(c_hi, self.n_cols - 1)
+        if r_lo > r_hi or c_lo > c_hi:
+            return []
+
+        if (r_hi - r_lo + 1) * (c_hi - c_lo + 1) > len(self.cells):
+            # Rectángulo grande: un filtro vectorizado es más barato que recorrer celdas
+            idx = np.arange(self.size)
+        else:
+            spans = [self.cells[r * self.n_cols + c]
+                     for r in range(r_lo, r_hi + 1) for c in range(c_lo, c_hi + 1)
+                     if r * self.n_cols + c in self.cells]
+            if not spans:
+                return []
+            idx = np.concatenate([np.arange(s, e) for s, e in spans])
+
+        lats, lons = self.lats[idx], self.lons[idx]
+        inside = idx[(lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)]
+        inside = inside[np.argsort(self.positions[inside], kind='stable')]
+        return self.names[inside].tolist()
+
+
+# Jerarquía de agrupamiento de marcadores (proyección Web Mercator de Leaflet)
+MAX_CLUSTER_ZOOM = 18
+# Lado de la celda de agrupamiento en píxeles de pantalla (potencia de 2, <= 256)
+CLUSTER_CELL_PX = 64
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def mercator_xy(lat, lon):
+    """Coordenadas Web Mercator normalizadas a [0, 1) (y crece hacia el sur)"""
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+
+def _spread_bits(v):
+    """Intercala un 0 entre los bits de v (para códigos de Morton)"""
+    v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+class ZoneClusterHierarchy:
+    """
+    Agrupamiento de zonas precalculado para cada nivel de zoom del mapa
+
+    En el zoom z se agrupan las zonas que caen en la misma celda de
+    CLUSTER_CELL_PX píxeles. Como las celdas de cada nivel se dividen en
+    cuatro en el siguiente, al ordenar las zonas por código de Morton de
+    la celda más fina cada grupo de cualquier nivel es un tramo contiguo:
+    basta un único ordenamiento para construir todos los niveles.
+
+    Guarda además el último nivel de riesgo simulado de cada zona (-1 si
+    no hay) para reportar el peor riesgo de cada grupo.
+    """
+
+    def __init__(self, names, lats, lons, max_zoom=MAX_CLUSTER_ZOOM, cell_px=CLUSTER_CELL_PX):
+        names = np.asarray(list(names), dtype=object)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        self.size = len(names)
+        self.max_zoom = max_zoom
+
+        # Celdas del nivel más fino: 256 / cell_px celdas por tesela y eje
+        bits = max_zoom + int(np.log2(256 // cell_px))
+        x, y = mercator_xy(lats, lons)
+        scale = float(2 ** bits)
+        xi = np.clip(np.floor(x * scale), 0, scale - 1).astype(np.int64)
+        yi = np.clip(np.floor(y * scale), 0, scale - 1).astype(np.int64)
+        codes = _spread_bits(xi) | (_spread_bits(yi) << np.uint64(1))
+
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        self.names = names[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.slot = {name: i for i, name in enumerate(self.names)}
+        self.risk = np.full(self.size, -1, dtype=np.int8)
+
+        # Por nivel: inicio de cada grupo y su centroide. Desde el primer nivel
+        # en que todos los grupos tienen una sola zona, los siguientes son iguales
+        self.levels = []
+        for zoom in range(max_zoom + 1):
+            if self.levels and len(self.levels[-1]['starts']) == self.size:
+                self.levels.append(self.levels[-1])
+                continue
+            level_codes = codes >> np.uint64(2 * (max_zoom - zoom))
+            starts = np.flatnonzero(np.r_[True, level_codes[1:] != level_codes[:-1]]) if self.size \
+                else np.array([], dtype=np.int64)
+            counts = np.diff(np.append(starts, self.size))
+            self.levels.append({
+                'starts': starts.astype(np.int32),
+                'counts': counts.astype(np.int32),
+                'lat': np.add.reduceat(self.lats, starts) / counts if self.size else self.lats,
+                'lon': np.add.reduceat(self.lons, starts) / counts if self.size else self.lons
+            })
+
+    @classmethod
+    def from_zone_index(cls, zone_index, previous=None, **kwargs):
+        """
+        Construye la jerarquía desde DrainageSimulationModel.zone_index,
+        conservando los riesgos registrados en previous para las zonas que siguen
+        """
+        names = list(zone_index)
+        lats = np.fromiter((zone_index[n]['latitude'] for n in names), dtype=float, count=len(names))
+        lons = np.fromiter((zone_index[n]['longitude'] for n in names), dtype=float, count=len(names))
+        hierarchy = cls(names, lats, lons, **kwargs)
+        if previous is not None:
+            for name, i in previous.slot.items():
+                if previous.risk[i] >= 0 and name in hierarchy.slot:
+                    hierarchy.risk[hierarchy.slot[name]] = previous.risk[i]
+        return hierarchy
+
+    def set_risk(self, name, level):
+        """Registra el nivel de riesgo (índice) simulado más reciente de una zona"""
+        i = self.slot.get(name)
+        if i is not None:
+            self.risk[i] = level
+
+    def clusters(self, min_lon, min_lat, max_lon, max_lat, zoom):
+        """
+        Grupos del nivel zoom cuyo centroide está dentro del rectángulo
+
+        Retorna una lista de (latitud, longitud, cantidad, peor riesgo o -1,
+        nombre de la zona si el grupo tiene una sola)
+        """
+        if not self.size:
+            return []
+        level = self.levels[min(max(int(zoom), 0), self.max_zoom)]
+        lat, lon = level['lat'], level['lon']
+        inside = np.flatnonzero((lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon))
+        starts, counts = level['starts'][inside], level['counts'][inside]
+        worst = np.maximum.reduceat(self.risk, level['starts'])[inside]
+        names = np.where(counts == 1, self.names[starts], None)
+        return list(zip(lat[inside].tolist(), lon[inside].tolist(), counts.tolist(), worst.tolist(), names))
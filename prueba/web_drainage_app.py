@@ -1,28 +1,198 @@
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, render_template_string, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import os
-import requests
+import re
+import json
+import base64
+import time
+import sqlite3
+import tempfile
+import threading
+from itertools import chain, islice
+import numpy as np
+import pandas as pd
 
-from drainage_model import DrainageSimulationModel
+try:
+    import orjson
+except ImportError:  # Sin orjson se usa el módulo json estándar (más lento)
+    orjson = None
+
+from drainage_model import DrainageSimulationModel, DEFAULT_STREAM_CHUNK_HOURS
+from result_export import check_format as check_export_format
+from result_cache import ResultCache
+from job_queue import JobQueue, QueueFull
+import zone_cache
+import metrics
 
 app = Flask(__name__)
 CORS(app)
 
-DATA_FILE = os.environ.get('DATA_FILE', 'datos.xlsx')
-# Si DATA_FILE es una URL pública, descargarla localmente al inicio
-if isinstance(DATA_FILE, str) and DATA_FILE.startswith('http'):
+# Métricas de latencia en /metrics (desactivadas salvo METRICS_ENABLED=1)
+metrics.enable(os.environ.get('METRICS_ENABLED', '0') == '1')
+
+# Si DATA_FILE es una URL pública, descargarla localmente al inicio (con
+# gunicorn.conf.py la descarga la hace el proceso maestro una sola vez)
+DATA_FILE = zone_cache.fetch_workbook(os.environ.get('DATA_FILE', 'datos.xlsx'))
+
+# Inicializar modelo (DATA_LAZY=1: cargar cada zona solo cuando se consulta;
+# DATA_MMAP=1: mapear la caché en memoria, compartida entre procesos)
+LAZY_LOADING = os.environ.get('DATA_LAZY', '0') == '1'
+MAX_CACHED_ZONES = int(os.environ.get('DATA_MAX_CACHED_ZONES', '256'))
+MMAP_CACHE = os.environ.get('DATA_MMAP', '0') == '1'
+modelo = DrainageSimulationModel(DATA_FILE, lazy=LAZY_LOADING, max_cached_zones=MAX_CACHED_ZONES,
+                                 mmap_cache=MMAP_CACHE)
+
+# Recarga en caliente: cada DATA_RELOAD_INTERVAL segundos se revisa si DATA_FILE
+# cambió y, de ser así, se re-procesan solo las hojas modificadas (0 = desactivado)
+DATA_RELOAD_INTERVAL = float(os.environ.get('DATA_RELOAD_INTERVAL', '5'))
+
+
+def _file_signature(path):
     try:
-        r = requests.get(DATA_FILE, timeout=30)
-        r.raise_for_status()
-        with open('datos.xlsx', 'wb') as f:
-            f.write(r.content)
-        DATA_FILE = 'datos.xlsx'
-    except Exception as e:
-        # Si falla la descarga, dejar que el error sea visible en logs
-        raise RuntimeError(f"No se pudo descargar DATA_FILE desde {DATA_FILE}: {e}")
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def watch_data_file():
+    """Hilo de fondo que recarga el modelo cuando cambia DATA_FILE"""
+    last_seen = _file_signature(DATA_FILE)
+    pending = None
+    while True:
+        time.sleep(DATA_RELOAD_INTERVAL)
+        current = _file_signature(DATA_FILE)
+        if current is None or current == last_seen:
+            continue
+        # Esperar a que el archivo deje de cambiar entre dos revisiones
+        # (evita leer un archivo que aún se está escribiendo)
+        if current != pending:
+            pending = current
+            continue
+        try:
+            report = modelo.reload_data()
+            last_seen = current
+            app.logger.info(f"Datos recargados (versión {modelo.data_version}): {report}")
+        except Exception as e:
+            # Archivo a medio escribir u otro error: se conserva el estado
+            # anterior y se reintenta en la siguiente revisión
+            app.logger.warning(f"No se pudo recargar {DATA_FILE}: {e}")
+
+
+if DATA_RELOAD_INTERVAL > 0:
+    threading.Thread(target=watch_data_file, name='data-file-watcher', daemon=True).start()
+
+# Caché de respuestas (JSON ya serializado) de /api/simulate para peticiones con
+# semilla (reproducibles); la clave incluye data_version, así una recarga de
+# datos invalida de hecho las entradas anteriores
+simulation_cache = ResultCache(
+    max_entries=int(os.environ.get('SIM_CACHE_SIZE', '512')),
+    ttl_seconds=float(os.environ.get('SIM_CACHE_TTL', '600'))
+)
+
+# Valores por defecto de evaluate_scenario, para que configuraciones equivalentes
+# compartan la misma clave de caché
+CONFIG_DEFAULTS = {'hours': 24, 'intensity': 'moderate', 'drainage_capacity': 10,
+                   'area_m2': 1000, 'n_realizations': 1, 'month': None, 'storage_mm': None,
+                   'return_period': None}
+
+
+def normalize_config(config):
+    """Configuración canónica (con valores por defecto y tipos numéricos) sin la semilla"""
+    normalized = {**CONFIG_DEFAULTS, **{k: v for k, v in config.items() if k != 'seed'}}
+    for key in ('hours', 'n_realizations'):
+        normalized[key] = int(normalized[key] or CONFIG_DEFAULTS[key])
+    for key in ('drainage_capacity', 'area_m2'):
+        normalized[key] = float(normalized[key])
+    normalized['month'] = int(normalized['month']) if normalized['month'] else None
+    for key in ('storage_mm', 'return_period'):
+        if normalized[key] is not None:
+            normalized[key] = float(normalized[key])
+    return normalized
+
+
+@metrics.timed('serialize')
+def encode_json(obj):
+    """
+    Serializa a JSON (bytes) aceptando arreglos y escalares NumPy directamente
+
+    Con orjson los arreglos numéricos se codifican sin pasar por listas de Python.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY, default=_json_fallback)
+    return json.dumps(obj, default=_json_fallback, ensure_ascii=False).encode('utf-8')
+
+
+def _json_fallback(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def json_response(body, status=200):
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+def summary_response(summary):
+    """Resumen aplanado para facilitar el acceso en JavaScript"""
+    response = {
+        'zona': summary['zona'],
+        'latitud': summary['latitud'],
+        'longitud': summary['longitud'],
+        'datos_historicos': summary['datos_historicos'],
+        'simulacion': summary['simulacion']
+    }
+    for section in ('ensamble', 'almacenamiento'):
+        if section in summary:
+            response[section] = summary[section]
+    return response
+
+
+def columnar(results):
+    """Una lista por columna del DataFrame horario (las de texto como listas de Python)"""
+    return {
+        col: values.tolist() if values.dtype == object else values
+        for col, values in ((col, results[col].to_numpy()) for col in results.columns)
+    }
+
+
+def iso_dates(frame):
+    """Copia de frame con las columnas de fecha como texto 'AAAA-MM-DD' (None si falta)"""
+    frame = frame.copy()
+    for col in frame.columns:
+        values = frame[col].to_numpy()
+        if values.dtype.kind == 'M':
+            text = np.datetime_as_string(values, unit='D').astype(object)
+            text[np.isnat(values)] = None
+            frame[col] = text
+    return frame
+
+
+def simulation_cache_key(zone, config, seed, *extra):
+    """Clave (zona, configuración normalizada, semilla, versión de datos, ...)"""
+    return (zone, json.dumps(normalize_config(config), sort_keys=True), int(seed),
+            modelo.data_version) + extra
+
+
+def encode_cursor(zone_name):
+    """Cursor de paginación de /api/zones: la última zona entregada, en base64"""
+    return base64.urlsafe_b64encode(zone_name.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Cursor inválido: {cursor}")
+
+
+def parse_bbox(bbox):
+    parts = bbox.split(',')
+    if len(parts) != 4:
+        raise ValueError("bbox debe ser lon_min,lat_min,lon_max,lat_max")
+    return parts
 
-# Inicializar modelo
-modelo = DrainageSimulationModel(DATA_FILE)
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -192,13 +362,30 @@ HTML_TEMPLATE = """
         .risk-peligro { background: #f44336; color: white; }
         .risk-emergencia { background: #b71c1c; color: white; }
         
-        #chart-container {
+        .zone-cluster {
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            border-radius: 50%;
+            border: 2px solid white;
+            box-shadow: 0 1px 4px rgba(0,0,0,0.4);
+            font-size: 12px;
+            font-weight: 600;
+        }
+        
+        .zone-cluster.sin-datos { background: #667eea; color: white; }
+        
+        #chart-container, #sweep-results {
             background: white;
             padding: 20px;
             border-radius: 10px;
             margin-top: 20px;
         }
         
+        #sweep-results {
+            display: none;
+        }
+        
         .loading {
             display: none;
             text-align: center;
@@ -253,6 +440,8 @@ HTML_TEMPLATE = """
                     <label>Intensidad de Lluvia:</label>
                     <select id="intensity">
                         <option value="historical" selected>📊 Basada en Datos Históricos</option>
+                        <option value="stochastic">🌦️ Estocástica (rachas de lluvia y sequía del historial)</option>
+                        <option value="idf">🌀 Tormenta de Diseño (curva IDF de la zona)</option>
                         <option value="light">Ligera (2-5 mm/h)</option>
                         <option value="moderate">Moderada (5-15 mm/h)</option>
                         <option value="heavy">Fuerte (15-40 mm/h)</option>
@@ -260,6 +449,37 @@ HTML_TEMPLATE = """
                     </select>
                 </div>
                 
+                <div class="form-group">
+                    <label>Mes (solo para datos históricos):</label>
+                    <select id="month">
+                        <option value="" selected>Todo el año</option>
+                        <option value="1">Enero</option>
+                        <option value="2">Febrero</option>
+                        <option value="3">Marzo</option>
+                        <option value="4">Abril</option>
+                        <option value="5">Mayo</option>
+                        <option value="6">Junio</option>
+                        <option value="7">Julio</option>
+                        <option value="8">Agosto</option>
+                        <option value="9">Septiembre</option>
+                        <option value="10">Octubre</option>
+                        <option value="11">Noviembre</option>
+                        <option value="12">Diciembre</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label>Periodo de retorno (solo tormenta de diseño):</label>
+                    <select id="return-period">
+                        <option value="2">2 años</option>
+                        <option value="5">5 años</option>
+                        <option value="10" selected>10 años</option>
+                        <option value="25">25 años</option>
+                        <option value="50">50 años</option>
+                        <option value="100">100 años</option>
+                    </select>
+                </div>
+                
                 <div class="form-group">
                     <label>Duración (horas):</label>
                     <input type="number" id="hours" value="24" min="1" max="72">
@@ -275,7 +495,53 @@ HTML_TEMPLATE = """
                     <input type="number" id="area" value="5000" min="100" max="100000" step="100">
                 </div>
                 
+                <div class="form-group">
+                    <label>Almacenamiento / Encharcamiento (mm, opcional):</label>
+                    <input type="number" id="storage" min="0" step="1" placeholder="Sin almacenamiento">
+                </div>
+                
+                <div class="form-group">
+                    <label>Semilla (opcional, para resultados reproducibles):</label>
+                    <input type="number" id="seed" min="0" step="1" placeholder="Aleatoria">
+                </div>
+                
+                <div class="form-group">
+                    <label>Realizaciones (Monte Carlo, 1 = simulación única):</label>
+                    <input type="number" id="realizations" value="1" min="1" max="20000" step="1">
+                </div>
+                
                 <button class="btn" onclick="runSimulation()">🔍 Ejecutar Simulación</button>
+                <button class="btn" style="margin-top: 10px;" onclick="runSweep()">📉 Curva Capacidad vs Excedente</button>
+                
+                <div class="form-group" style="margin-top: 20px;">
+                    <label>Nivel de riesgo a evitar:</label>
+                    <select id="design-level">
+                        <option value="Precaución">Precaución</option>
+                        <option value="Alerta" selected>Alerta</option>
+                        <option value="Peligro">Peligro</option>
+                        <option value="Emergencia">Emergencia</option>
+                    </select>
+                </div>
+                
+                <div class="form-group">
+                    <label>Confianza (%):</label>
+                    <input type="number" id="design-confidence" value="95" min="1" max="100" step="1">
+                </div>
+                
+                <button class="btn" onclick="runDesign()">🎯 Calcular Capacidad Mínima</button>
+                <div id="design-result" style="margin-top: 10px;"></div>
+                
+                <div class="form-group" style="margin-top: 20px;">
+                    <label>Desagregación del historial diario:</label>
+                    <select id="replay-disaggregation">
+                        <option value="">Un paso por registro</option>
+                        <option value="uniform">Uniforme (24 h)</option>
+                        <option value="scs_type2">Tormenta SCS Tipo II (24 h)</option>
+                    </select>
+                </div>
+                
+                <button class="btn" onclick="runReplay()">📜 Reproducir Historial</button>
+                <div id="replay-result" style="margin-top: 10px;"></div>
             </div>
         </div>
         
@@ -293,12 +559,17 @@ HTML_TEMPLATE = """
                 <canvas id="resultsChart"></canvas>
             </div>
         </div>
+        
+        <div id="sweep-results">
+            <canvas id="sweepChart"></canvas>
+        </div>
     </div>
 
     <script>
         let map;
         let markers = [];
         let chart;
+        let sweepChart;
         
         // Inicializar mapa centrado en Honduras
         map = L.map('map').setView([14.0723, -87.1921], 7);
@@ -307,31 +578,102 @@ HTML_TEMPLATE = """
             attribution: '© OpenStreetMap contributors'
         }).addTo(map);
         
-        // Cargar zonas disponibles
-        fetch('/api/zones')
-            .then(response => response.json())
-            .then(data => {
-                const select = document.getElementById('zone-select');
-                data.zones.forEach(zone => {
-                    const option = document.createElement('option');
-                    option.value = zone.name;
-                    option.textContent = zone.name;
-                    option.dataset.lat = zone.lat;
-                    option.dataset.lon = zone.lon;
-                    select.appendChild(option);
-                    
-                    // Agregar marcador al mapa
-                    const marker = L.marker([zone.lat, zone.lon])
-                        .addTo(map)
-                        .bindPopup(`<b>${zone.name}</b><br>Lat: ${zone.lat}<br>Lon: ${zone.lon}`);
-                    
-                    marker.on('click', function() {
-                        select.value = zone.name;
+        // Cargar zonas disponibles, página por página
+        function loadZoneOptions(cursor) {
+            const url = '/api/zones?limit=1000' + (cursor ? `&cursor=${cursor}` : '');
+            fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    const select = document.getElementById('zone-select');
+                    const fragment = document.createDocumentFragment();
+                    data.zones.forEach(zone => {
+                        const option = document.createElement('option');
+                        option.value = zone.name;
+                        option.textContent = zone.name;
+                        option.dataset.lat = zone.lat;
+                        option.dataset.lon = zone.lon;
+                        fragment.appendChild(option);
+                    });
+                    select.appendChild(fragment);
+                    if (data.next_cursor) {
+                        loadZoneOptions(data.next_cursor);
+                    }
+                });
+        }
+        loadZoneOptions(null);
+        
+        // Marcadores agrupados por el servidor según la vista y el zoom del mapa
+        const clusterLayer = L.layerGroup().addTo(map);
+        let clusterRequest = 0;
+        
+        function riskClass(level) {
+            if (!level) {
+                return 'sin-datos';
+            }
+            return 'risk-' + level.normalize('NFD').replace(/[\\u0300-\\u036f]/g, '').toLowerCase();
+        }
+        
+        function loadClusters() {
+            const request = ++clusterRequest;
+            const bbox = map.getBounds().pad(0.25).toBBoxString();
+            fetch(`/api/zones/clusters?bbox=${bbox}&zoom=${map.getZoom()}`)
+                .then(response => response.json())
+                .then(data => {
+                    // Se descartan respuestas de vistas anteriores
+                    if (request !== clusterRequest || !data.clusters) {
+                        return;
+                    }
+                    clusterLayer.clearLayers();
+                    markers = data.clusters.map(cluster => {
+                        const size = Math.min(24 + 6 * Math.log10(cluster.zonas), 48);
+                        const icon = L.divIcon({
+                            className: '',
+                            html: `<div class="zone-cluster ${riskClass(cluster.nivel_riesgo)}"
+                                        style="width:${size}px;height:${size}px">${cluster.zonas}</div>`,
+                            iconSize: [size, size]
+                        });
+                        const marker = L.marker([cluster.latitud, cluster.longitud], {icon: icon})
+                            .addTo(clusterLayer);
+                        
+                        if (cluster.zona) {
+                            const risk = cluster.nivel_riesgo ? `<br>Riesgo: ${cluster.nivel_riesgo}` : '';
+                            marker.bindPopup(`<b>${cluster.zona}</b><br>Lat: ${cluster.latitud}<br>Lon: ${cluster.longitud}${risk}`);
+                            marker.on('click', function() {
+                                document.getElementById('zone-select').value = cluster.zona;
+                            });
+                        } else {
+                            // Un grupo se abre acercando el mapa
+                            marker.on('click', function() {
+                                map.setView([cluster.latitud, cluster.longitud], map.getZoom() + 2);
+                            });
+                        }
+                        return marker;
                     });
+                });
+        }
+        map.on('moveend', loadClusters);
+        loadClusters();
+        
+        // Clic en cualquier punto del mapa: zonas más cercanas
+        map.on('click', function(e) {
+            fetch(`/api/zones/nearest?lat=${e.latlng.lat}&lon=${e.latlng.lng}&k=5`)
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.zones || data.zones.length === 0) {
+                        return;
+                    }
+                    const select = document.getElementById('zone-select');
+                    select.value = data.zones[0].nombre;
                     
-                    markers.push(marker);
+                    const items = data.zones
+                        .map(z => `<li>${z.nombre} (${z.distancia_km.toFixed(1)} km)</li>`)
+                        .join('');
+                    L.popup()
+                        .setLatLng(e.latlng)
+                        .setContent(`<b>Zonas más cercanas</b><ol>${items}</ol>`)
+                        .openOn(map);
                 });
-            });
+        });
         
         // Actualizar mapa cuando se selecciona zona
         document.getElementById('zone-select').addEventListener('change', function() {
@@ -354,13 +696,26 @@ HTML_TEMPLATE = """
                 intensity: document.getElementById('intensity').value,
                 hours: parseInt(document.getElementById('hours').value),
                 drainage_capacity: parseFloat(document.getElementById('drainage').value),
-                area_m2: parseInt(document.getElementById('area').value)
+                area_m2: parseInt(document.getElementById('area').value),
+                n_realizations: parseInt(document.getElementById('realizations').value) || 1,
+                month: parseInt(document.getElementById('month').value) || null
             };
+            const seed = parseInt(document.getElementById('seed').value);
+            if (!isNaN(seed)) {
+                config.seed = seed;
+            }
+            const storage = parseFloat(document.getElementById('storage').value);
+            if (!isNaN(storage)) {
+                config.storage_mm = storage;
+            }
+            if (config.intensity === 'idf') {
+                config.return_period = parseFloat(document.getElementById('return-period').value);
+            }
             
             document.getElementById('loading').style.display = 'block';
             document.getElementById('results').style.display = 'none';
             
-            fetch('/api/simulate', {
+            fetch('/api/simulate?format=columnar', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -382,6 +737,8 @@ HTML_TEMPLATE = """
                 document.getElementById('loading').style.display = 'none';
                 console.log('Datos recibidos:', data); // Para debug
                 displayResults(data);
+                // El riesgo de la zona simulada cambia el color de su grupo
+                loadClusters();
             })
             .catch(error => {
                 document.getElementById('loading').style.display = 'none';
@@ -447,49 +804,120 @@ HTML_TEMPLATE = """
                 `;
             }
             
+            // Probabilidades del ensamble (Monte Carlo)
+            const ens = summary.ensamble;
+            if (ens) {
+                const probs = Object.entries(ens.probabilidad_alcanzar_nivel)
+                    .filter(([level]) => level !== 'Normal')
+                    .map(([level, p]) => `${level}: ${(p * 100).toFixed(1)}%`)
+                    .join('<br>');
+                summaryHTML += `
+                    <div class="stat-card" style="grid-column: span 2; background: #fff3e0;">
+                        <div class="stat-label">🎲 Ensamble (${ens.realizaciones} realizaciones)</div>
+                        <div style="font-size: 0.9em; margin-top: 10px;">
+                            Excedente total P10 / P50 / P90: ${ens.excedente_total_mm.p10} / ${ens.excedente_total_mm.p50} / ${ens.excedente_total_mm.p90} mm<br>
+                            <b>Probabilidad de alcanzar:</b><br>${probs}
+                        </div>
+                    </div>
+                `;
+            }
+            
+            // Ruteo por almacenamiento (encharcamiento)
+            const storage = summary.almacenamiento;
+            if (storage) {
+                const overflowProb = storage.probabilidad_desborde !== undefined
+                    ? `<br>Probabilidad de desborde: ${(storage.probabilidad_desborde * 100).toFixed(1)}%` : '';
+                summaryHTML += `
+                    <div class="stat-card" style="grid-column: span 2; background: #e0f7fa;">
+                        <div class="stat-label">🛢️ Almacenamiento (${storage.capacidad_almacenamiento_mm} mm)</div>
+                        <div style="font-size: 0.9em; margin-top: 10px;">
+                            Encharcamiento máximo: ${storage.almacenamiento_maximo_mm} mm<br>
+                            Desborde: ${storage.desborde_total_mm} mm (${storage.desborde_volumen_litros.toLocaleString()} L) en ${storage.horas_con_desborde} h<br>
+                            Horas para drenar al final: ${storage.horas_para_drenar_final}${overflowProb}
+                        </div>
+                    </div>
+                `;
+            }
+            
             document.getElementById('summary').innerHTML = summaryHTML;
             
             // Crear gráfico
-            createChart(data.hourly);
+            createChart(data.columns);
             
             // Scroll a resultados
             results.scrollIntoView({ behavior: 'smooth' });
         }
         
-        function createChart(hourlyData) {
+        function createChart(columns) {
             const ctx = document.getElementById('resultsChart').getContext('2d');
             
             if (chart) {
                 chart.destroy();
             }
             
+            const datasets = [
+                {
+                    label: 'Lluvia (mm)',
+                    data: columns.lluvia_mm,
+                    borderColor: '#667eea',
+                    backgroundColor: 'rgba(102, 126, 234, 0.1)',
+                    tension: 0.4
+                },
+                {
+                    label: 'Capacidad Drenaje (mm)',
+                    data: columns.capacidad_drenaje_mm,
+                    borderColor: '#4caf50',
+                    borderDash: [5, 5],
+                    fill: false
+                },
+                {
+                    label: 'Excedente Acumulado (mm)',
+                    data: columns.excedente_acumulado_mm,
+                    borderColor: '#f44336',
+                    backgroundColor: 'rgba(244, 67, 54, 0.1)',
+                    tension: 0.4
+                }
+            ];
+            
+            // Banda P10-P90 del excedente acumulado en modo ensamble
+            if (columns.excedente_acumulado_p90_mm) {
+                datasets.push({
+                    label: 'Excedente Acumulado P90 (mm)',
+                    data: columns.excedente_acumulado_p90_mm,
+                    borderColor: 'rgba(244, 67, 54, 0.4)',
+                    borderDash: [2, 2],
+                    fill: false
+                });
+                datasets.push({
+                    label: 'Excedente Acumulado P10 (mm)',
+                    data: columns.excedente_acumulado_p10_mm,
+                    borderColor: 'rgba(244, 67, 54, 0.4)',
+                    borderDash: [2, 2],
+                    fill: false
+                });
+            }
+            
+            if (columns.almacenamiento_mm) {
+                datasets.push({
+                    label: 'Encharcamiento (mm)',
+                    data: columns.almacenamiento_mm,
+                    borderColor: '#00acc1',
+                    backgroundColor: 'rgba(0, 172, 193, 0.1)',
+                    tension: 0.4
+                });
+                datasets.push({
+                    label: 'Desborde (mm)',
+                    data: columns.desborde_mm,
+                    borderColor: '#6a1b9a',
+                    fill: false
+                });
+            }
+            
             chart = new Chart(ctx, {
                 type: 'line',
                 data: {
-                    labels: hourlyData.map(d => `Hora ${d.hora}`),
-                    datasets: [
-                        {
-                            label: 'Lluvia (mm)',
-                            data: hourlyData.map(d => d.lluvia_mm),
-                            borderColor: '#667eea',
-                            backgroundColor: 'rgba(102, 126, 234, 0.1)',
-                            tension: 0.4
-                        },
-                        {
-                            label: 'Capacidad Drenaje (mm)',
-                            data: hourlyData.map(d => d.capacidad_drenaje_mm),
-                            borderColor: '#4caf50',
-                            borderDash: [5, 5],
-                            fill: false
-                        },
-                        {
-                            label: 'Excedente Acumulado (mm)',
-                            data: hourlyData.map(d => d.excedente_acumulado_mm),
-                            borderColor: '#f44336',
-                            backgroundColor: 'rgba(244, 67, 54, 0.1)',
-                            tension: 0.4
-                        }
-                    ]
+                    labels: columns.hora.map(h => `Hora ${h}`),
+                    datasets: datasets
                 },
                 options: {
                     responsive: true,
@@ -518,25 +946,316 @@ HTML_TEMPLATE = """
                 }
             });
         }
+        
+        // Capacidad mínima para no alcanzar el nivel elegido con la confianza indicada
+        function runDesign() {
+            const zone = document.getElementById('zone-select').value;
+            if (!zone) {
+                alert('Por favor seleccione una zona');
+                return;
+            }
+            const level = document.getElementById('design-level').value;
+            const confidence = parseFloat(document.getElementById('design-confidence').value) / 100;
+            const seed = parseInt(document.getElementById('seed').value);
+            const intensity = document.getElementById('intensity').value;
+            
+            fetch('/api/design', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    zone: zone,
+                    intensity: intensity,
+                    hours: parseInt(document.getElementById('hours').value),
+                    month: parseInt(document.getElementById('month').value) || null,
+                    risk_level: level,
+                    confidence: confidence,
+                    seed: isNaN(seed) ? null : seed,
+                    return_period: intensity === 'idf' ?
+                        parseFloat(document.getElementById('return-period').value) : null
+                })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                document.getElementById('design-result').innerHTML =
+                    `Capacidad mínima: <b>${data.capacidad_requerida_mm_h} mm/h</b> para no alcanzar ` +
+                    `${data.nivel_riesgo} en el ${(data.confianza * 100).toFixed(0)}% de ` +
+                    `${data.realizaciones} tormentas de ${data.horas} h ` +
+                    `(logrado: ${(data.probabilidad_lograda * 100).toFixed(1)}%)`;
+            })
+            .catch(error => alert('Error en el cálculo: ' + error.message));
+        }
+        
+        // Días del historial registrado que habrían superado la capacidad
+        function runReplay() {
+            const zone = document.getElementById('zone-select').value;
+            if (!zone) {
+                alert('Por favor seleccione una zona');
+                return;
+            }
+            
+            fetch('/api/replay', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    zones: [zone],
+                    config: {
+                        drainage_capacity: parseFloat(document.getElementById('drainage').value),
+                        area_m2: parseInt(document.getElementById('area').value),
+                        disaggregation: document.getElementById('replay-disaggregation').value || null
+                    }
+                })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                const zones = data.zonas;
+                const events = data.eventos;
+                // Los cinco días con mayor excedente
+                const top = events.excedente_mm
+                    .map((excess, i) => i)
+                    .sort((a, b) => events.excedente_mm[b] - events.excedente_mm[a])
+                    .slice(0, 5)
+                    .map(i => `${events.fecha[i] || '?'}: ${events.excedente_mm[i]} mm (${events.nivel_riesgo[i]})`)
+                    .join('<br>');
+                document.getElementById('replay-result').innerHTML =
+                    `<b>${zones.dias_con_excedente[0]}</b> de ${zones.registros[0]} días con excedente ` +
+                    `(${zones.excedente_total_mm[0]} mm). Nivel máximo: <b>${zones.max_nivel_riesgo[0]}</b><br>` +
+                    `Precaución: ${zones.dias_precaucion[0]}, Alerta: ${zones.dias_alerta[0]}, ` +
+                    `Peligro: ${zones.dias_peligro[0]}, Emergencia: ${zones.dias_emergencia[0]}` +
+                    (top ? `<br>${top}` : '');
+            })
+            .catch(error => alert('Error en la reproducción: ' + error.message));
+        }
+        
+        // Excedente total según la capacidad de drenaje, una curva por intensidad
+        function runSweep() {
+            const zone = document.getElementById('zone-select').value;
+            if (!zone) {
+                alert('Por favor seleccione una zona');
+                return;
+            }
+            
+            const config = {
+                hours: parseInt(document.getElementById('hours').value),
+                area_m2: parseInt(document.getElementById('area').value),
+                month: parseInt(document.getElementById('month').value) || null
+            };
+            const seed = parseInt(document.getElementById('seed').value);
+            
+            fetch('/api/sweep', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    zone: zone,
+                    config: config,
+                    seed: isNaN(seed) ? null : seed,
+                    intensities: ['light', 'moderate', 'heavy', 'extreme', 'historical'],
+                    capacity_range: {min: 1, max: 50, steps: 200}
+                })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                createSweepChart(data);
+            })
+            .catch(error => alert('Error en el barrido: ' + error.message));
+        }
+        
+        function createSweepChart(data) {
+            document.getElementById('sweep-results').style.display = 'block';
+            const ctx = document.getElementById('sweepChart').getContext('2d');
+            if (sweepChart) {
+                sweepChart.destroy();
+            }
+            
+            const names = {light: 'Ligera', moderate: 'Moderada', heavy: 'Fuerte', extreme: 'Extrema', historical: 'Histórica'};
+            const colors = ['#4caf50', '#667eea', '#ff9800', '#b71c1c', '#764ba2'];
+            const intensities = Object.keys(data.curvas);
+            
+            sweepChart = new Chart(ctx, {
+                type: 'line',
+                data: {
+                    labels: data.capacidades.map(c => c.toFixed(1)),
+                    datasets: intensities.map((intensity, i) => ({
+                        label: names[intensity] || intensity,
+                        data: data.curvas[intensity].excedente_total_mm,
+                        borderColor: colors[i % colors.length],
+                        pointRadius: 0,
+                        fill: false
+                    }))
+                },
+                options: {
+                    responsive: true,
+                    interaction: {
+                        mode: 'index',
+                        intersect: false
+                    },
+                    plugins: {
+                        title: {
+                            display: true,
+                            text: `Capacidad de Drenaje vs Excedente Total: ${data.zona}`,
+                            font: {
+                                size: 16
+                            }
+                        },
+                        tooltip: {
+                            callbacks: {
+                                label: item => {
+                                    const curve = data.curvas[intensities[item.datasetIndex]];
+                                    return `${item.dataset.label}: ${item.formattedValue} mm (${curve.max_nivel_riesgo[item.dataIndex]})`;
+                                }
+                            }
+                        }
+                    },
+                    scales: {
+                        x: {
+                            title: {
+                                display: true,
+                                text: 'Capacidad de Drenaje (mm/h)'
+                            }
+                        },
+                        y: {
+                            beginAtZero: true,
+                            title: {
+                                display: true,
+                                text: 'Excedente Total (mm)'
+                            }
+                        }
+                    }
+                }
+            });
+        }
     </script>
 </body>
 </html>
 """
 
+@app.before_request
+def start_request_timer():
+    if metrics.is_enabled():
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        # Se etiqueta por regla de ruta (no por URL) para acotar las series
+        endpoint = request.url_rule.rule if request.url_rule else 'desconocido'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        'Latencia de las peticiones HTTP', endpoint=endpoint, method=request.method)
+        metrics.inc('http_requests_total', 1, 'Peticiones HTTP atendidas',
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+        if response.status_code >= 500:
+            metrics.inc('http_request_errors_total', 1, 'Peticiones HTTP con error del servidor',
+                        endpoint=endpoint, method=request.method)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas en el formato de texto de Prometheus"""
+    if not metrics.is_enabled():
+        return jsonify({'error': 'Métricas desactivadas (active METRICS_ENABLED=1)'}), 404
+    metrics.set_gauge('drainage_zones', len(modelo.zone_index), 'Zonas disponibles')
+    metrics.set_gauge('drainage_workbook_load_seconds', modelo.load_seconds,
+                      'Duración de la última carga completa del libro')
+    metrics.set_gauge('drainage_data_version', modelo.data_version,
+                      'Versión de los datos (aumenta con cada recarga)')
+    metrics.set_gauge('simulation_cache_entries', len(simulation_cache), 'Entradas en la caché de simulaciones')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 @app.route('/api/zones')
 def get_zones():
-    zones = []
-    for name, data in modelo.zones_data.items():
-        zones.append({
-            'name': name,
-            'lat': data['latitude'],
-            'lon': data['longitude']
-        })
-    return jsonify({'zones': zones})
+    """
+    Zonas disponibles; ?bbox=lon_min,lat_min,lon_max,lat_max limita a un rectángulo
+
+    Con ?limit=N la lista se pagina: la respuesta incluye next_cursor, que se
+    pasa como ?cursor= para pedir la página siguiente (null en la última)
+    """
+    try:
+        # Una sola versión de los datos para toda la página, aunque haya una recarga en medio
+        state = modelo.state
+        bbox = request.args.get('bbox')
+        names = modelo.get_zones_in_bbox(*parse_bbox(bbox), state=state) if bbox else None
+        
+        cursor = request.args.get('cursor')
+        names = modelo.iter_zone_names(decode_cursor(cursor) if cursor else None, names, state)
+        limit = request.args.get('limit')
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError("limit debe ser al menos 1")
+            # Se pide una zona de más para saber si hay otra página
+            names = list(islice(names, limit + 1))
+        
+        zones = []
+        for name in islice(names, limit):
+            data = state.zone_index[name]
+            zones.append({
+                'name': name,
+                'lat': data['latitude'],
+                'lon': data['longitude']
+            })
+        
+        body = {'zones': zones}
+        if limit is not None:
+            body['next_cursor'] = encode_cursor(zones[-1]['name']) if len(names) > limit else None
+        return jsonify(body)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/zones/clusters')
+def get_zone_clusters():
+    """
+    Zonas agrupadas para el mapa: ?bbox=lon_min,lat_min,lon_max,lat_max&zoom=z
+
+    Cada grupo trae su centroide, la cantidad de zonas y el peor nivel de
+    riesgo entre las simulaciones ya hechas de sus zonas
+    """
+    try:
+        bbox = request.args.get('bbox', '-180,-90,180,90')
+        zoom = int(request.args.get('zoom', 0))
+        clusters = modelo.get_zone_clusters(*parse_bbox(bbox), zoom)
+        return jsonify({'zoom': zoom, 'clusters': clusters})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/zones/nearest')
+def get_nearest_zones():
+    """Las k zonas más cercanas a ?lat=&lon= (k=5 por defecto)"""
+    try:
+        zones = modelo.find_nearest_zones(request.args['lat'], request.args['lon'],
+                                          request.args.get('k', 5))
+        return jsonify({'zones': zones})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/zones/<name>/idf')
+def get_zone_idf(name):
+    """
+    Curva intensidad-duración-frecuencia precalculada de una zona: tablas de
+    profundidad (mm) e intensidad (mm/h) por duración y periodo de retorno
+    """
+    try:
+        return jsonify({'zona': name, **modelo.get_idf(name)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/simulate', methods=['POST'])
 def simulate():
@@ -544,24 +1263,288 @@ def simulate():
         data = request.json
         zone = data['zone']
         config = data['config']
+        seed = data.get('seed', config.get('seed'))
+        # ?format=columnar: una lista por columna en lugar de una fila por hora
+        response_format = request.args.get('format', 'records')
+        if response_format not in ('records', 'columnar'):
+            raise ValueError(f"Formato desconocido: {response_format}")
         
-        results, summary = modelo.evaluate_scenario(zone, config)
+        # Solo las simulaciones con semilla son reproducibles y pueden cachearse
+        cache_key = simulation_cache_key(zone, config, seed, response_format) if seed is not None else None
+        if cache_key is not None:
+            cached = simulation_cache.get(cache_key)
+            if cached is not None:
+                return json_response(cached)
         
-        # Aplanar el resumen para facilitar el acceso en JavaScript
-        response = {
-            'summary': {
-                'zona': summary['zona'],
-                'latitud': summary['latitud'],
-                'longitud': summary['longitud'],
-                'datos_historicos': summary['datos_historicos'],
-                'simulacion': summary['simulacion']
-            },
-            'hourly': results.to_dict('records')
-        }
+        results, summary = modelo.evaluate_scenario(zone, config, seed=seed)
         
-        return jsonify(response)
+        if response_format == 'columnar':
+            body = encode_json({
+                'format': 'columnar',
+                'summary': summary_response(summary),
+                'columns': columnar(results)
+            })
+        else:
+            body = encode_json({
+                'summary': summary_response(summary),
+                'hourly': results.to_dict('records')
+            })
+        
+        if cache_key is not None:
+            # Se guarda el cuerpo ya serializado: un acierto no vuelve a codificar JSON
+            simulation_cache.put(cache_key, body)
+        
+        return json_response(body)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/simulate/stream', methods=['POST'])
+def simulate_stream():
+    """
+    Simulación por bloques como JSON delimitado por líneas (NDJSON):
+    una línea por hora y, al final, {"summary": ...}. La memoria del servidor
+    no crece con la duración ('hours') del escenario. Con la misma semilla,
+    las horas y el resumen son los de /api/simulate para cualquier intensidad
+    y tamaño de bloque.
+    """
+    try:
+        data = request.json
+        config = data['config']
+        seed = data.get('seed', config.get('seed'))
+        chunk_hours = int(request.args.get('chunk_hours', DEFAULT_STREAM_CHUNK_HOURS))
+        
+        events = modelo.iter_scenario(data['zone'], config, seed=seed, chunk_hours=chunk_hours)
+        # El primer bloque se calcula aquí para responder los errores de
+        # validación con el código 500 habitual y no a mitad del flujo
+        first = next(events)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        try:
+            for kind, payload in chain([first], events):
+                if kind == 'hourly':
+                    yield b''.join(encode_json(row) + b'\n' for row in payload.to_dict('records'))
+                else:
+                    yield encode_json({'summary': summary_response(payload)}) + b'\n'
+        except Exception as e:
+            yield encode_json({'error': str(e)}) + b'\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/export', methods=['POST'])
+def export_simulation():
+    """
+    Ejecuta la simulación y envía el archivo de resultados por bloques, sin
+    armarlo completo en memoria: ?format=xlsx (por defecto), csv o parquet
+    (ZIP con una tabla por archivo); ?history=0 omite los datos históricos
+    """
+    try:
+        data = request.json
+        zone = data['zone']
+        config = data['config']
+        seed = data.get('seed', config.get('seed'))
+        export_format = request.args.get('format', 'xlsx')
+        include_history = request.args.get('history', '1') != '0'
+        mimetype, extension = check_export_format(export_format)
+        
+        results, summary = modelo.evaluate_scenario(zone, config, seed=seed)
+        blocks = modelo.iter_export(results, summary, export_format, include_history)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    filename = re.sub(r'[^A-Za-z0-9_.-]+', '_', f'simulacion_{zone}') + extension
+    return Response(stream_with_context(blocks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/simulate/batch', methods=['POST'])
+def simulate_batch():
+    try:
+        data = request.json
+        config = data['config']
+        include_hourly = bool(data.get('include_hourly', False))
+        
+        table, hourly = modelo.evaluate_scenarios(data.get('zones'), config, include_hourly=include_hourly)
+        
+        response = {'zones': table.to_dict('records')}
+        if include_hourly:
+            response['hourly'] = {zone: df.to_dict('records') for zone, df in hourly.items()}
+        
+        with metrics.stage('serialize'):
+            return jsonify(response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sweep', methods=['POST'])
+def capacity_sweep():
+    """
+    Curva capacidad de drenaje vs excedente para una zona: una por intensidad
+    
+    Cuerpo: {"zone", "config", "seed", "intensities": [...], y
+    "capacities": [...] o "capacity_range": {"min", "max", "steps"}}
+    """
+    try:
+        data = request.json
+        config = data.get('config', {})
+        seed = data.get('seed', config.get('seed'))
+        capacities = data.get('capacities')
+        if capacities is None:
+            capacity_range = data.get('capacity_range', {})
+            capacities = np.linspace(float(capacity_range.get('min', 1)),
+                                     float(capacity_range.get('max', 50)),
+                                     int(capacity_range.get('steps', 200)))
+        
+        table = modelo.evaluate_sweep(data['zone'], capacities, data.get('intensities'), config, seed=seed)
+        
+        curves = {intensity: columnar(group.drop(columns=['intensidad', 'capacidad_drenaje_mm']))
+                  for intensity, group in table.groupby('intensidad', sort=False)}
+        return json_response(encode_json({
+            'zona': data['zone'],
+            'capacidades': table['capacidad_drenaje_mm'].to_numpy()[:len(table) // len(curves)],
+            'curvas': curves
+        }))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/design', methods=['POST'])
+def design_capacity():
+    """
+    Capacidad de drenaje mínima para no alcanzar un nivel de riesgo con la
+    confianza indicada. Cuerpo: {"zone", "intensity", "hours", "risk_level",
+    "confidence", "n_realizations", "month", "seed", "return_period"}
+    """
+    try:
+        data = request.json
+        design = modelo.design_capacity(
+            data['zone'],
+            intensity=data.get('intensity', 'heavy'),
+            hours=data.get('hours', 24),
+            risk_level=data.get('risk_level', 'Alerta'),
+            confidence=data.get('confidence', 0.95),
+            n_realizations=data.get('n_realizations'),
+            month=data.get('month'),
+            seed=data.get('seed'),
+            return_period=data.get('return_period')
+        )
+        return jsonify(design)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/replay', methods=['POST'])
+def replay_historical():
+    """
+    Reproducción del historial registrado de las zonas (días con excedente)
+    
+    Cuerpo: {"zones": [...] (opcional, todas por defecto), "config":
+    {"drainage_capacity", "area_m2", "disaggregation"}, "events": true}
+    """
+    try:
+        data = request.json or {}
+        events, table = modelo.replay_historical(data.get('zones'), data.get('config', {}))
+        
+        response = {'zonas': columnar(iso_dates(table))}
+        if data.get('events', True):
+            response['eventos'] = columnar(iso_dates(events))
+        return json_response(encode_json(response))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Trabajos en segundo plano (ensambles grandes, simulaciones largas, lotes):
+# JOB_WORKERS hilos como máximo a la vez en cada proceso; los resultados se
+# guardan JOB_TTL segundos. El estado se comparte entre los workers de
+# gunicorn en una base SQLite junto a la caché del libro (JOB_STORE)
+JOB_STORE = os.environ.get('JOB_STORE', f"{DATA_FILE}.jobs")
+JOB_OPTIONS = dict(
+    max_workers=int(os.environ.get('JOB_WORKERS', '2')),
+    max_pending=int(os.environ.get('JOB_MAX_PENDING', '32')),
+    ttl_seconds=float(os.environ.get('JOB_TTL', '3600'))
+)
+try:
+    jobs = JobQueue(path=JOB_STORE, **JOB_OPTIONS)
+except sqlite3.Error:
+    # Directorio de solo lectura: la base va al directorio temporal, que
+    # los workers de una misma máquina también comparten
+    jobs = JobQueue(path=os.path.join(tempfile.gettempdir(), os.path.basename(JOB_STORE)), **JOB_OPTIONS)
+
+def run_simulation_job(job, zone, config, seed):
+    """Trabajo 'simulate': mismo resultado que /api/simulate?format=columnar"""
+    if int(config.get('n_realizations') or 1) > 1:
+        results, summary = modelo.evaluate_scenario(zone, config, seed=seed)
+    else:
+        # Por bloques, para informar el avance y poder cancelar entre bloques
+        hours = int(config.get('hours', 24))
+        chunks = []
+        for kind, payload in modelo.iter_scenario(zone, config, seed=seed):
+            if kind == 'hourly':
+                chunks.append(payload)
+                job.report(payload['hora'].iloc[-1] / hours)
+            else:
+                summary = payload
+        results = pd.concat(chunks, ignore_index=True)
+    return {'format': 'columnar', 'summary': summary_response(summary), 'columns': columnar(results)}
+
+def run_batch_job(job, zones, config, include_hourly):
+    """Trabajo 'batch': mismo resultado que /api/simulate/batch"""
+    # Avance y cancelación tras cada zona
+    table, hourly = modelo.evaluate_scenarios(zones, config, include_hourly=include_hourly,
+                                              progress=lambda done, total: job.report(done / total))
+    result = {'zones': table.to_dict('records')}
+    if include_hourly:
+        result['hourly'] = {zone: df.to_dict('records') for zone, df in hourly.items()}
+    return result
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Encola un trabajo y responde de inmediato con su id (202).
+    Cuerpo: {"tipo": "simulate", "zone", "config", "seed"} o
+            {"tipo": "batch", "zones", "config", "include_hourly"}
+    """
+    try:
+        data = request.json
+        kind = data.get('tipo', 'simulate')
+        config = data['config']
+        if kind == 'simulate':
+            zone = data['zone']
+            if zone not in modelo.zone_index:
+                raise ValueError(f"Zona '{zone}' no encontrada")
+            seed = data.get('seed', config.get('seed'))
+            job = jobs.submit(kind, run_simulation_job, zone, config, seed)
+        elif kind == 'batch':
+            job = jobs.submit(kind, run_batch_job, data.get('zones'), config,
+                              bool(data.get('include_hourly', False)))
+        else:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        return jsonify(job.to_dict()), 202
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs')
+def list_jobs():
+    return jsonify({
+        **jobs.stats(),
+        'lista': [job.to_dict(include_result=False) for job in jobs.list()]
+    })
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Trabajo '{job_id}' no encontrado o expirado"}), 404
+    return json_response(encode_json(job.to_dict()))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f"Trabajo '{job_id}' no encontrado o expirado"}), 404
+    return jsonify(job.to_dict(include_result=False))
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    return jsonify(simulation_cache.stats())
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
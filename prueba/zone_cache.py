@@ -0,0 +1,353 @@
+"""
+Caché columnar en disco de las zonas ya procesadas de un libro Excel
+
+El archivo se guarda junto al original (datos.xlsx -> datos.xlsx.cache) con
+el formato:
+
+    MAGIC (8 bytes) | largo del encabezado (uint64) | encabezado JSON | columnas
+
+Cada columna es un arreglo NumPy contiguo alineado a 64 bytes; el encabezado
+describe su tipo, forma y posición. Las series de todas las zonas se
+concatenan en columnas únicas ('fechas', 'lluvia_mm') y 'offsets' indica
+dónde empieza cada zona. Las estadísticas precalculadas viajan en el JSON.
+
+La caché es válida solo si coinciden el tamaño, la fecha de modificación y
+el hash SHA-256 del archivo original, además de CACHE_VERSION.
+
+Con load_zones(..., mmap=True) las series no se copian: cada zona queda
+como vistas de solo lectura de un mapeo en memoria del archivo, de modo
+que varios procesos (los workers de gunicorn) comparten las mismas páginas.
+"""
+
+import os
+import json
+import struct
+import hashlib
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+import requests
+
+MAGIC = b'ZCACHE01'
+# Incrementar cuando cambie lo que el cargador guarda por zona
+CACHE_VERSION = 4
+ALIGNMENT = 64
+
+
+def cache_path(source_file):
+    """Ruta del archivo de caché asociado a un libro Excel"""
+    return f"{source_file}.cache"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hash SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_key(source_file, with_hash=True):
+    """Clave de validez del archivo original: tamaño, mtime y hash de contenido"""
+    st = os.stat(source_file)
+    key = {'version': CACHE_VERSION, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        key['sha256'] = file_sha256(source_file)
+    return key
+
+
+def write_columnar(path, columns, meta):
+    """
+    Escribe columnas NumPy y metadatos JSON en un único archivo
+
+    La escritura es atómica (archivo temporal + os.replace), de modo que
+    varios procesos pueden generar la caché a la vez sin corromperla.
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in columns.items()}
+
+    # Calcular posiciones relativas al inicio de la zona de datos
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += arr.nbytes
+
+    header = json.dumps({'columns': layout, 'meta': meta}, default=_json_default).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for name, arr in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(arr.tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_columnar(path, mmap=False):
+    """
+    Lee un archivo escrito por write_columnar. Retorna (columnas, meta)
+
+    Con mmap=True las columnas son vistas de solo lectura de un único mapeo
+    del archivo (np.memmap): no se copian y el sistema carga sus páginas
+    bajo demanda, compartidas entre los procesos que mapean el mismo archivo.
+    El mapeo sigue siendo válido aunque el archivo se reemplace después.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Formato de caché no reconocido: {path}")
+        (header_len,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = -(-(len(MAGIC) + 8 + header_len) // ALIGNMENT) * ALIGNMENT
+        mapped = np.memmap(f, dtype=np.uint8, mode='r') if mmap else None
+
+        columns = {}
+        for name, info in header['columns'].items():
+            dtype = np.dtype(info['dtype'])
+            count = int(np.prod(info['shape'])) if info['shape'] else 1
+            start = data_start + info['offset']
+            if mapped is not None:
+                # Las columnas están alineadas a ALIGNMENT bytes: la vista no copia
+                view = mapped[start:start + count * dtype.itemsize]
+                if len(view) != count * dtype.itemsize:
+                    raise ValueError(f"Caché truncada: {path}")
+                columns[name] = np.asarray(view).view(dtype).reshape(info['shape'])
+            else:
+                f.seek(start)
+                columns[name] = np.fromfile(f, dtype=dtype, count=count).reshape(info['shape'])
+
+    return columns, header['meta']
+
+
+def save_zones(source_file, zones_data):
+    """
+    Guarda zones_data (series y estadísticas) en la caché del archivo original
+
+    Lanza ValueError, sin escribir nada, si alguna columna fecha tiene valores
+    que no caben en datetime64 (horas del día de números de serie de Excel
+    menores a 1): guardarlos como NaT cambiaría los datos al leer la caché
+    """
+    names = list(zones_data)
+    frames = [zones_data[name]['historical_data'] for name in names]
+
+    fechas = [_dates_of(df) for df in frames]
+    date_dtype = next((f.dtype for f in fechas if len(f)), np.dtype('datetime64[ns]'))
+    lluvias = [_rain_of(df) for df in frames]
+
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(r) for r in lluvias])
+
+    columns = {
+        'fechas': np.concatenate([f.astype(date_dtype) for f in fechas]) if names else np.array([], date_dtype),
+        'lluvia_mm': np.concatenate(lluvias) if names else np.array([], float),
+        'offsets': offsets
+    }
+    meta = {
+        'source': source_key(source_file),
+        'zones': [
+            {'name': name, **{k: v for k, v in zones_data[name].items() if k != 'historical_data'}}
+            for name in names
+        ]
+    }
+    write_columnar(cache_path(source_file), columns, meta)
+
+
+def load_zones(source_file, mmap=False):
+    """
+    Carga zones_data desde la caché si sigue siendo válida
+
+    Args:
+        mmap: Si True, las series de cada zona son vistas de solo lectura
+              del archivo mapeado en memoria (ver read_columnar)
+
+    Retorna None si no existe caché o si el archivo original cambió.
+    """
+    path = cache_path(source_file)
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        columns, meta = read_columnar(path, mmap=mmap)
+    except (OSError, ValueError):
+        return None
+
+    # Validación barata (versión, tamaño, mtime) antes de calcular el hash
+    cached_key = meta.get('source', {})
+    current = source_key(source_file, with_hash=False)
+    if any(cached_key.get(k) != v for k, v in current.items()):
+        return None
+    if cached_key.get('sha256') != file_sha256(source_file):
+        return None
+
+    fechas = columns['fechas']
+    lluvia = columns['lluvia_mm']
+    offsets = columns['offsets']
+
+    zones_data = {}
+    for i, info in enumerate(meta['zones']):
+        start, end = offsets[i], offsets[i + 1]
+        zone = {k: v for k, v in info.items() if k != 'name'}
+        # copy=False: con mmap las columnas siguen siendo vistas del archivo
+        zone['historical_data'] = pd.DataFrame({
+            'fecha': fechas[start:end],
+            'lluvia_mm': lluvia[start:end]
+        }, copy=False)
+        zones_data[info['name']] = zone
+
+    return zones_data
+
+
+def fetch_workbook(source, target='datos.xlsx', timeout=30):
+    """
+    Si source es una URL (http/https), descarga el libro a target y retorna
+    target; si no, retorna source sin cambios
+    """
+    if not (isinstance(source, str) and source.startswith('http')):
+        return source
+    try:
+        r = requests.get(source, timeout=timeout)
+        r.raise_for_status()
+    except Exception as e:
+        # Si falla la descarga, dejar que el error sea visible en logs
+        raise RuntimeError(f"No se pudo descargar DATA_FILE desde {source}: {e}")
+    # Escritura atómica, como la caché: nunca queda un libro a medio escribir
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(r.content)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+
+_NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_NS_PKG = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def workbook_fingerprint(source_file, previous=None):
+    """
+    Huellas por hoja de un libro .xlsx, para detectar qué hojas cambiaron
+
+    La huella de cada hoja es el CRC32 y tamaño de su XML dentro del zip
+    (se leen del directorio central, sin descomprimir). Como los textos de
+    las celdas viven en la tabla compartida sharedStrings.xml, una hoja solo
+    se considera igual si además los textos ya existentes no cambiaron
+    (la tabla nueva empieza con la anterior) y los estilos tampoco.
+
+    Args:
+        previous: Huella anterior; se usa para comparar la tabla de textos
+
+    Retorna un diccionario con 'sheets' ({hoja: huella}), 'globals',
+    'shared_strings' ({'count', 'digest'}) y 'reusable' (True si las hojas
+    con la misma huella que en previous pueden reutilizarse).
+    """
+    with zipfile.ZipFile(source_file) as zf:
+        infos = {info.filename: info for info in zf.infolist()}
+
+        workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+        rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+        targets = {}
+        shared_strings_path = 'xl/sharedStrings.xml'
+        styles_path = 'xl/styles.xml'
+        for rel in rels.iter(f'{_NS_PKG}Relationship'):
+            target = _zip_target(rel.get('Target'))
+            targets[rel.get('Id')] = target
+            if rel.get('Type', '').endswith('/sharedStrings'):
+                shared_strings_path = target
+            elif rel.get('Type', '').endswith('/styles'):
+                styles_path = target
+
+        sheets = {}
+        for sheet in workbook.iter(f'{_NS_MAIN}sheet'):
+            info = infos.get(targets.get(sheet.get(f'{_NS_REL}id')))
+            sheets[sheet.get('name')] = f"{info.CRC:08x}-{info.file_size}" if info else None
+
+        # Propiedades del libro que afectan a todas las hojas (época de fechas, estilos)
+        props = workbook.find(f'{_NS_MAIN}workbookPr')
+        date1904 = props.get('date1904', '0') if props is not None else '0'
+        styles = infos.get(styles_path)
+        global_fp = f"{date1904}:{styles.CRC:08x}-{styles.file_size}" if styles else date1904
+
+        prefix = previous['shared_strings']['count'] if previous else 0
+        if shared_strings_path in infos:
+            with zf.open(shared_strings_path) as f:
+                count, digest, prefix_digest = _shared_strings_digest(f, prefix)
+        else:
+            count, digest, prefix_digest = 0, hashlib.sha1().hexdigest(), hashlib.sha1().hexdigest()
+
+    reusable = bool(previous) and previous['globals'] == global_fp and \
+        count >= prefix and prefix_digest == previous['shared_strings']['digest']
+
+    return {
+        'sheets': sheets,
+        'globals': global_fp,
+        'shared_strings': {'count': count, 'digest': digest},
+        'reusable': reusable
+    }
+
+
+def _zip_target(target):
+    """Ruta dentro del zip de un destino de relación de xl/workbook.xml"""
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join('xl', target))
+
+
+def _shared_strings_digest(stream, prefix_count):
+    """
+    Recorre sharedStrings.xml calculando un hash incremental de los textos.
+    Retorna (cantidad, hash total, hash de los primeros prefix_count textos)
+    """
+    digest = hashlib.sha1()
+    prefix_digest = digest.hexdigest() if prefix_count == 0 else None
+    count = 0
+    for _, elem in ET.iterparse(stream):
+        if elem.tag != f'{_NS_MAIN}si':
+            continue
+        text = ''.join(elem.itertext()).encode('utf-8')
+        digest.update(struct.pack('<I', len(text)))
+        digest.update(text)
+        elem.clear()
+        count += 1
+        if count == prefix_count:
+            prefix_digest = digest.hexdigest()
+    return count, digest.hexdigest(), prefix_digest
+
+
+def _dates_of(df):
+    if 'fecha' not in df:
+        return np.array([], dtype='datetime64[ns]')
+    try:
+        return pd.to_datetime(df['fecha']).to_numpy()
+    except TypeError as e:
+        raise ValueError(f"Columna fecha no representable en la caché: {e}") from e
+
+
+def _rain_of(df):
+    if 'lluvia_mm' not in df:
+        return np.array([], dtype=float)
+    return df['lluvia_mm'].to_numpy(dtype=float)
+
+
+def _json_default(value):
+    """Convierte tipos NumPy a tipos nativos para JSON"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")